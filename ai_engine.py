@@ -4,6 +4,7 @@ from google import genai
 from google.genai import types
 import time
 import random
+import threading
 from utils import safe_print
 import docx
 import io
@@ -157,6 +158,14 @@ ROBUST_MODEL_LIST = [
     "gemini-1.5-flash"            # 8. 1.5 Flash
 ]
 
+# Output tokens the SDK reported (usage_metadata) for the last call on this thread.
+# Thread-local so parallel map/commentary workers each read their own call.
+_last_usage = threading.local()
+
+def last_output_tokens() -> int | None:
+    """candidates_token_count of this thread's last generate_content_v2 call, None if not reported."""
+    return getattr(_last_usage, "output_tokens", None)
+
 def generate_with_retry_v2(client, parts, config, model_list=None, cancel_check=None):
     """
     Unified function for generating content with advanced cyclic fallback logic.
@@ -248,6 +257,8 @@ def generate_with_retry_v2(client, parts, config, model_list=None, cancel_check=
                     text_content = response.text
                     if text_content:
                         safe_print(f"Success with {model_name}.")
+                        usage = getattr(response, "usage_metadata", None)
+                        _last_usage.output_tokens = getattr(usage, "candidates_token_count", None)
                         return text_content, model_name
                     else:
                         safe_print(f"[{model_name}] Returned empty text (No error but no content). Skipping...")
@@ -302,6 +313,19 @@ def generate_with_retry_v2(client, parts, config, model_list=None, cancel_check=
          raise ValueError(f"Hệ thống AI gặp lỗi không xác định. Chi tiết: {error_msg[:100]}...")
 
 
+def rotate_keys(api_keys: list[str], offset: int) -> list[str]:
+    """
+    Returns the cleaned key list rotated by offset.
+    Parallel workers use this so each one starts on a different key while
+    the remaining keys stay available as fallbacks.
+    """
+    unique_keys = list(dict.fromkeys(k.strip() for k in (api_keys or []) if k and k.strip()))
+    if not unique_keys:
+        return unique_keys
+    offset %= len(unique_keys)
+    return unique_keys[offset:] + unique_keys[:offset]
+
+
 def generate_content_v2(api_keys: list[str], parts, config, model_list=None, cancel_check=None):
     """
     Wrapper around generate_with_retry that rotates through a list of API keys.
@@ -309,6 +333,7 @@ def generate_content_v2(api_keys: list[str], parts, config, model_list=None, can
     """
     if not api_keys or len(api_keys) == 0:
         raise ValueError("No API keys provided for rotation.")
+    _last_usage.output_tokens = None
 
     # Deduplicate keys while preserving order
     unique_keys = []
@@ -362,13 +387,66 @@ def generate_content_v2(api_keys: list[str], parts, config, model_list=None, can
     raise ValueError(f"All API Keys failed. Last error: {last_exception}")
 
 
-from document_loader import load_document, extract_text_from_docx, extract_text_from_epub
+from document_loader import load_structured_document
+from text_normalizer import normalize_document_for_prompt, estimate_tokens
+from section_retrieval import focus_document, match_sections, build_focused_text, Selection
+from text_compressor import compress_for_prompt
+from cache_store import content_hash
+from deck_store import save_deck, deck_options, load_deck
+from wire_format import COMPACT_SLIDES_INSTRUCTION, expand_deck, log_wire_stats
+from stage_profiles import stage_config
+
+# Text documents larger than this are TextRank-compressed before prompting (None = send everything)
+SLIDE_TOKEN_BUDGET = 150_000
+# Slide regeneration sends at most this many source sections (best BM25 matches for the slides)
+REGENERATE_MAX_SECTIONS = 4
+
+REGENERATE_PROMPT = """
+Bài thuyết trình "{deck_title}" đã được tạo. Dàn ý hiện tại (số thứ tự. tiêu đề):
+{outline}
 
-def analyze_document(file_bytes, mime_type, api_key=None, api_keys: list[str] = None, detail_level="Tóm tắt", user_instructions="", cancel_check=None):
+Hãy VIẾT LẠI slide {first}-{last} dưới đây dựa trên nội dung tài liệu gốc.
+- Giữ đúng vai trò của các slide này trong dàn ý, không lặp lại nội dung của các slide khác.
+- Có thể tách thành nhiều slide nếu nội dung quá dài.
+- Trả về JSON: {{"slides": [{{"title": "...", "content": ["..."], "notes": "..."}}]}} chỉ gồm các slide thay thế.
+
+Slide cần viết lại:
+{slides_json}
+"""
+
+# Appended to the system instruction for analyze_document(with_notes=False)
+NO_NOTES_INSTRUCTION = """
+KHÔNG viết trường "notes" (ghi chú sẽ được tạo ở bước sau). Mỗi slide chỉ gồm "title" và "content".
+"""
+
+def fill_empty_content(slides: list[dict]):
+    """Replaces empty "content" arrays in place (notes as fallback) so no slide comes out blank."""
+    for i, slide in enumerate(slides):
+        content = slide.get("content", [])
+        if not content or (isinstance(content, list) and len(content) == 0):
+            safe_print(f"WARNING: Slide {i+1} ('{slide.get('title', 'Untitled')}') has EMPTY content.")
+            if slide.get("notes"):
+                safe_print("-> Movings 'notes' to 'content' as fallback.")
+                slide["content"] = [slide["notes"]]
+            else:
+                slide["content"] = ["(Nội dung chưa được trích xuất - Vui lòng kiểm tra lại tài liệu gốc)"]
+
+def analyze_document(file_bytes, mime_type, api_key=None, api_keys: list[str] = None, detail_level="Tóm tắt", user_instructions="", cancel_check=None,
+                     token_budget=SLIDE_TOKEN_BUDGET, outline_first: bool | None = None, progress_callback=None,
+                     with_notes=True, compact_wire=False):
     """
     Analyzes the document using Gemini to extract key ideas
     and structure them into a slide presentation format.
     Uses centralized robust retry logic with KEY ROTATION.
+    token_budget: max prompt tokens for DOCX/EPUB text (extractive compression above it).
+    outline_first: "Chi tiết" decks as an outline call + parallel per-section calls (see outline_deck.py).
+        None = automatic (long DOCX/EPUB only). True on a PDF re-attaches the file to every section
+        call (input ~ (sections + 1) x the PDF), so sections are capped there.
+    progress_callback(stage, done, total, label): per-section progress in outline-first mode.
+    with_notes: False = slides without speaker notes (fewer output tokens); fill them later
+        with speaker_notes.fill_speaker_notes.
+    compact_wire: ask for the compact response format (wire_format.py) and expand it locally;
+        same deck JSON, fewer output tokens.
     """
     # 1. Prepare Key List
     keys_to_use = []
@@ -426,46 +504,81 @@ def analyze_document(file_bytes, mime_type, api_key=None, api_keys: list[str] =
         --------------------------------------------------\n
         """
         
-    final_instruction = base_instruction + "\n" + specific_instruction + custom_instruction_block
+    # Shared by the single call and the outline section calls
+    extra_instruction = custom_instruction_block
+    if not with_notes:
+        extra_instruction += NO_NOTES_INSTRUCTION
+    if compact_wire:
+        extra_instruction += COMPACT_SLIDES_INSTRUCTION
+    final_instruction = base_instruction + "\n" + specific_instruction + extra_instruction
 
     try:
         parts = []
         prompt = f"Hãy phân tích tài liệu này và tạo cấu trúc bài thuyết trình ({detail_level})."
+        # Outline-first mode sends the document (without the single-call prompt) with each call
+        document = focused_text = None
+        source_parts = []
 
         if mime_type == "application/pdf":
             parts.append(types.Part.from_bytes(data=file_bytes, mime_type="application/pdf"))
+            source_parts = list(parts)
             parts.append(types.Part.from_text(text=prompt))
         
         elif mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            text_content = extract_text_from_docx(file_bytes)
+            document = normalize_document_for_prompt(load_structured_document(file_bytes, mime_type), source="DOCX")
+            focused_text = focus_document(document, user_instructions)
+            text_content = focused_text or compress_for_prompt(document, token_budget, source="DOCX").text
             parts.append(types.Part.from_text(text=f"{prompt}\n\nNội dung tài liệu:\n{text_content}"))
+            source_parts = [types.Part.from_text(text=f"Nội dung tài liệu:\n{text_content}")]
             
         elif mime_type == "application/epub+zip":
             safe_print("Processing EPUB file...")
-            text_content = extract_text_from_epub(file_bytes)
+            document = normalize_document_for_prompt(load_structured_document(file_bytes, mime_type), source="EPUB")
+            focused_text = focus_document(document, user_instructions)
+            text_content = focused_text or compress_for_prompt(document, token_budget, source="EPUB").text
             parts.append(types.Part.from_text(text=f"{prompt}\n\nNội dung tài liệu:\n{text_content}"))
+            source_parts = [types.Part.from_text(text=f"Nội dung tài liệu:\n{text_content}")]
         
         else:
             raise ValueError(f"Định dạng file không được hỗ trợ: {mime_type}")
         
-        # Config
-        # Execute with Rotation
-        generated_text, used_model = generate_content_v2(
-            api_keys=keys_to_use, 
-            parts=parts,
-            config=types.GenerateContentConfig(
-                system_instruction=final_instruction,
-                response_mime_type="application/json",
-                temperature=0.7 # Creative but structured
-            ),
-            cancel_check=cancel_check
-        )
-        
-        if not generated_text:
-            raise ValueError("Gemini không trả về nội dung.")
+        from outline_deck import generate_outlined_deck, should_use_outline, SECTION_INSTRUCTION
+        if outline_first is None:
+            outline_first = detail_level == "Chi tiết" and should_use_outline(
+                mime_type, estimate_tokens(text_content) if document is not None else None)
+
+        parsed_data = None
+        if outline_first:
+            safe_print("Using OUTLINE-FIRST pipeline (sections in parallel)...")
+            # Section calls pick their own sections from the document, unless the user already focused it
+            parsed_data, used_model = generate_outlined_deck(
+                keys_to_use, source_parts, base_instruction + SECTION_INSTRUCTION + extra_instruction,
+                document=None if focused_text else document,
+                progress_callback=progress_callback, cancel_check=cancel_check, generate_fn=generate_content_v2
+            )
+        else:
+            # Config
+            # Execute with Rotation
+            config, models = stage_config("slides", system_instruction=final_instruction,
+                                          response_mime_type="application/json")
+            started = time.perf_counter()
+            generated_text, used_model = generate_content_v2(
+                api_keys=keys_to_use, 
+                parts=parts,
+                config=config,
+                model_list=models,
+                cancel_check=cancel_check
+            )
+            
+            if not generated_text:
+                raise ValueError("Gemini không trả về nội dung.")
+            log_wire_stats("Slides", compact_wire, generated_text, time.perf_counter() - started, last_output_tokens())
             
         try:
-            parsed_data = robust_json_parse(generated_text)
+            if parsed_data is None:
+                parsed_data = robust_json_parse(generated_text)
+                if compact_wire:
+                    parsed_data = expand_deck(parsed_data)
             
             # Critical Fix for "list object has no attribute get"
             if isinstance(parsed_data, list):
@@ -477,15 +590,10 @@ def analyze_document(file_bytes, mime_type, api_key=None, api_keys: list[str] =
             
             # --- VALIDATION STEP ---
             if "slides" in parsed_data:
-                for i, slide in enumerate(parsed_data["slides"]):
-                    content = slide.get("content", [])
-                    if not content or (isinstance(content, list) and len(content) == 0):
-                        safe_print(f"WARNING: Slide {i+1} ('{slide.get('title', 'Untitled')}') has EMPTY content.")
-                        if slide.get("notes"):
-                            safe_print("-> Movings 'notes' to 'content' as fallback.")
-                            slide["content"] = [slide["notes"]]
-                        else:
-                            slide["content"] = ["(Nội dung chưa được trích xuất - Vui lòng kiểm tra lại tài liệu gốc)"]
+                fill_empty_content(parsed_data["slides"])
+
+            # Keep the deck so it can be re-rendered (other template) without calling Gemini again
+            save_deck(parsed_data, content_hash(file_bytes), deck_options(detail_level, user_instructions, token_budget), used_model)
             
             return parsed_data
             
@@ -496,3 +604,89 @@ def analyze_document(file_bytes, mime_type, api_key=None, api_keys: list[str] =
     except Exception as e:
         # Catch-all for top level errors
         raise RuntimeError(f"{str(e)}")
+
+
+def splice_slides(deck: dict, first: int, last: int, new_slides: list[dict]) -> dict:
+    """Copy of deck with slides first..last (1-based, inclusive) replaced by new_slides."""
+    slides = deck.get("slides", [])
+    return dict(deck, slides=slides[:first - 1] + list(new_slides) + slides[last:])
+
+
+def _regeneration_source(file_bytes, mime_type, query: str, token_budget) -> list:
+    """Prompt parts carrying the source for the slides: the PDF itself, or the best matching sections."""
+    if mime_type == "application/pdf":
+        return [types.Part.from_bytes(data=file_bytes, mime_type="application/pdf")]
+    source = {"application/epub+zip": "EPUB", "text/plain": "TXT"}.get(mime_type, "DOCX")
+    document = normalize_document_for_prompt(load_structured_document(file_bytes, mime_type), source=source)
+    indices = match_sections(document, query, REGENERATE_MAX_SECTIONS) if len(document) > 1 else []
+    if indices:
+        safe_print(f"🎯 Regenerating from {len(indices)}/{len(document)} sections")
+        text_content = build_focused_text(document, Selection(indices, "slide regeneration"))
+    else:
+        text_content = compress_for_prompt(document, token_budget, source=source).text
+    return [types.Part.from_text(text=f"Nội dung tài liệu:\n{text_content}")]
+
+
+def regenerate_slides(key: str, first: int, last: int, file_bytes, mime_type, api_key=None, api_keys: list[str] = None,
+                      instructions="", cancel_check=None, token_budget=SLIDE_TOKEN_BUDGET) -> dict:
+    """
+    Rewrites slides first..last (1-based, inclusive, title slide not counted) of a stored deck
+    with one Gemini call, using only the source sections that match those slides.
+    The result is spliced into the deck and saved as a revision of it (deck_store.py).
+    Returns: the new stored record (deck JSON under "deck").
+    """
+    keys_to_use = []
+    if api_keys and len(api_keys) > 0:
+        keys_to_use = api_keys
+    elif api_key:
+        keys_to_use = [api_key]
+    else:
+        env_key = os.environ.get("GOOGLE_API_KEY")
+        if env_key:
+            keys_to_use = [env_key]
+
+    if not keys_to_use:
+        raise ValueError("Thiếu Google API Key. Vui lòng thiết lập biến môi trường hoặc nhập vào giao diện.")
+
+    record = load_deck(key)
+    if record is None:
+        raise ValueError("Không tìm thấy bản slide đã lưu. Hãy bấm Generate Slides trước.")
+    deck = record["deck"]
+    slides = deck.get("slides", [])
+    if not 1 <= first <= last <= len(slides):
+        raise ValueError(f"Khoảng slide không hợp lệ: {first}-{last} (bài có {len(slides)} slide nội dung).")
+
+    targets = slides[first - 1:last]
+    query = " ".join(
+        [str(s.get("title", "")) + " " + " ".join(str(c) for c in s.get("content", [])) for s in targets] + [instructions or ""]
+    )
+    outline = "\n".join(f"{i}. {s.get('title', '')}" for i, s in enumerate(slides, start=1))
+    prompt = REGENERATE_PROMPT.format(
+        deck_title=deck.get("title", ""), outline=outline, first=first, last=last,
+        slides_json=json.dumps(targets, ensure_ascii=False, indent=1),
+    )
+    if instructions and instructions.strip():
+        prompt += f"\nYÊU CẦU CHỈNH SỬA TỪ NGƯỜI DÙNG (ƯU TIÊN TUYỆT ĐỐI):\n\"{instructions.strip()}\"\n"
+
+    parts = _regeneration_source(file_bytes, mime_type, query, token_budget) + [types.Part.from_text(text=prompt)]
+    safe_print(f"Regenerating slides {first}-{last} of {len(slides)}...")
+    config, models = stage_config("slides", system_instruction=SYSTEM_INSTRUCTION, response_mime_type="application/json")
+    generated_text, used_model = generate_content_v2(
+        api_keys=keys_to_use,
+        parts=parts,
+        config=config,
+        model_list=models,
+        cancel_check=cancel_check
+    )
+    if not generated_text:
+        raise ValueError("Gemini không trả về nội dung.")
+
+    parsed_data = robust_json_parse(generated_text)
+    new_slides = parsed_data.get("slides") if isinstance(parsed_data, dict) else parsed_data
+    if not isinstance(new_slides, list) or not new_slides or not all(isinstance(s, dict) for s in new_slides):
+        raise ValueError("Lỗi đọc dữ liệu từ AI: không có slide thay thế.")
+    fill_empty_content(new_slides)
+
+    new_key = save_deck(splice_slides(deck, first, last, new_slides), record["document_hash"], record["options"],
+                        used_model, parent=key)
+    return load_deck(new_key)
@@ -0,0 +1,198 @@
+import io
+import sys
+import json
+import time
+import zipfile
+import random
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from PIL import Image
+from pptx import Presentation
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.util import Cm, Emu
+from slide_engine import create_pptx
+
+# Benchmark suite for create_pptx.
+# Synthetic decks (Vietnamese text; long multi-line titles) of 10/100/1000 slides, with and
+# without a template, measured for speed (slides/s), peak RSS of a process building the deck
+# once, output size (slide XML uncompressed, .pptx as written), the time python-pptx takes to
+# load and re-save the output, and geometry invariants of every content slide.
+# Results are written as JSON so runs can be diffed for regressions.
+# Usage: python bench_slide_engine.py [--sizes 10,100,1000] [--rounds 3] [--output bench_results.json]
+#        python bench_slide_engine.py --compare-writers --sizes 1000   (python-pptx vs fast writer)
+
+WORDS = ["thói", "quen", "hệ", "thống", "mục", "tiêu", "kết", "quả", "nhỏ", "lớn", "mỗi", "ngày", "**quan trọng**"]
+
+SIZES = (10, 100, 1000)
+# case -> (title words, bullets per slide, words per bullet) ranges
+CASES = {
+    "vietnamese": ((3, 14), (2, 6), (6, 30)),
+    "long_titles": ((25, 45), (2, 4), (6, 20)),
+}
+OUTPUT_FILE = "bench_results.json"
+# Geometry comparisons tolerate EMU rounding
+GEOMETRY_TOLERANCE = Emu(12700)  # 1pt
+
+
+def make_deck(slide_count: int, seed: int = 0, case: str = "vietnamese") -> dict:
+    rng = random.Random(seed)
+    title_words, bullet_count, bullet_words = CASES[case]
+    slides = []
+    for i in range(slide_count):
+        title = " ".join(rng.choice(WORDS[:-1]) for _ in range(rng.randint(*title_words))).capitalize()
+        content = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(*bullet_words))) for _ in range(rng.randint(*bullet_count))]
+        slides.append({"title": f"Slide {i + 1}: {title}", "content": content, "notes": "Ghi chú " * 10})
+    return {"title": "Benchmark", "slides": slides}
+
+
+def make_template() -> bytes:
+    """A corporate-style template: 16:9, leftover slides, a logo on the master."""
+    prs = Presentation()
+    prs.slide_width, prs.slide_height = Cm(33.867), Cm(19.05)
+    for _ in range(3):
+        prs.slides.add_slide(prs.slide_layouts[1])
+    logo = io.BytesIO()
+    Image.new("RGB", (256, 256), (0, 112, 192)).save(logo, format="PNG")
+    # Master shapes have no add_picture: build the picture on a slide, then move it to the master
+    picture = prs.slides[0].shapes.add_picture(logo, Cm(31), Cm(17.5), Cm(1.5), Cm(1.5))
+    image_part = picture.part.related_part(picture._element.blip_rId)
+    picture._element.blipFill.blip.rEmbed = prs.slide_masters[0].part.relate_to(image_part, RT.IMAGE)
+    prs.slide_masters[0].shapes._spTree.append(picture._element)
+    buffer = io.BytesIO()
+    prs.save(buffer)
+    return buffer.getvalue()
+
+
+def check_geometry(pptx_bytes: bytes) -> dict:
+    """
+    Invariants of every content slide: title above the body (no overlap) and both boxes
+    inside the slide. Returns counts plus the first few violations.
+    """
+    prs = Presentation(io.BytesIO(pptx_bytes))
+    width, height = prs.slide_width, prs.slide_height
+    violations = []
+    checked = 0
+    for number, slide in enumerate(prs.slides, start=1):
+        if number == 1:
+            continue  # Title slide keeps the template's own layout
+        checked += 1
+        title = slide.shapes.title
+        body = next((ph for ph in slide.placeholders if title is None or ph.shape_id != title.shape_id), None)
+        for name, shape in (("title", title), ("body", body)):
+            if shape is None:
+                continue
+            if (shape.left < -GEOMETRY_TOLERANCE or shape.top < -GEOMETRY_TOLERANCE
+                    or shape.left + shape.width > width + GEOMETRY_TOLERANCE
+                    or shape.top + shape.height > height + GEOMETRY_TOLERANCE):
+                violations.append(f"slide {number}: {name} outside slide bounds")
+        if title is not None and body is not None and title.top + title.height > body.top + GEOMETRY_TOLERANCE:
+            violations.append(f"slide {number}: title overlaps body")
+    return {"slides_checked": checked, "violation_count": len(violations), "violations": violations[:10]}
+
+
+def _peak_rss_mb(slide_count: int, case: str, template: bool, fast_writer: bool | None) -> float | None:
+    """Peak resident memory of a fresh process that builds the deck once (None where unsupported)."""
+    code = (
+        "import resource, bench_slide_engine as b, slide_engine as s;"
+        f"s.create_pptx(b.make_deck({slide_count}, case={case!r}), b.make_template() if {template} else None, "
+        f"fast_writer={fast_writer});"
+        "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    )
+    try:
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        # ru_maxrss is in KiB on Linux, in bytes on macOS
+        scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return round(int(output.strip().splitlines()[-1]) / scale, 1)
+    except (subprocess.CalledProcessError, ValueError, IndexError):
+        return None
+
+
+def _load_save_seconds(pptx_bytes: bytes) -> tuple[float, float]:
+    start = time.perf_counter()
+    prs = Presentation(io.BytesIO(pptx_bytes))
+    for slide in prs.slides:
+        slide.shapes  # parse every slide, as opening the deck does
+    loaded = time.perf_counter()
+    prs.save(io.BytesIO())
+    return loaded - start, time.perf_counter() - loaded
+
+
+def run(slide_count: int = 200, rounds: int = 3, fast_writer: bool | None = None, case: str = "vietnamese",
+        template: bool = True, measure_rss: bool = True) -> dict:
+    """One configuration. fast_writer=None lets create_pptx choose, as in production."""
+    deck = make_deck(slide_count, case=case)
+    template_bytes = make_template() if template else None
+    output = create_pptx(deck, template_bytes, fast_writer=fast_writer).getvalue()  # warm-up (template cache, imports)
+    with zipfile.ZipFile(io.BytesIO(output)) as archive:
+        slide_parts = [i for i in archive.infolist() if i.filename.startswith("ppt/slides/slide")]
+    load_seconds, save_seconds = min(_load_save_seconds(output) for _ in range(3))
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        create_pptx(deck, template_bytes, fast_writer=fast_writer)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        "case": case,
+        "template": template,
+        "writer": {None: "auto", True: "fast", False: "python-pptx"}[fast_writer],
+        "slides": slide_count,
+        # Title slide and "(tiếp)" continuation slides included
+        "slides_written": len(slide_parts),
+        "best_seconds": round(best, 4),
+        "ms_per_slide": round(best * 1000 / len(slide_parts), 3),
+        "slides_per_second": round(len(slide_parts) / best, 1),
+        "slide_xml_kb": round(sum(i.file_size for i in slide_parts) / 1024, 1),
+        "pptx_bytes": len(output),
+        "load_seconds": round(load_seconds, 4),
+        "save_seconds": round(save_seconds, 4),
+        "peak_rss_mb": _peak_rss_mb(slide_count, case, template, fast_writer) if measure_rss else None,
+        "geometry": check_geometry(output),
+    }
+
+
+def run_suite(sizes=SIZES, rounds: int = 3, writers=(None,)) -> dict:
+    results = []
+    for size in sizes:
+        for case in CASES:
+            for template in (False, True):
+                for fast_writer in writers:
+                    result = run(size, rounds, fast_writer, case, template)
+                    results.append(result)
+                    _print_result(result)
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def _print_result(result: dict):
+    geometry = result["geometry"]
+    status = "OK" if not geometry["violation_count"] else f"{geometry['violation_count']} VIOLATIONS"
+    print(f"[{result['writer']}] {result['slides']} slides, {result['case']}, "
+          f"{'template' if result['template'] else 'default'}: {result['slides_per_second']} slides/s, "
+          f"{result['ms_per_slide']} ms/slide, pptx {result['pptx_bytes'] / 1024:.0f} KB, "
+          f"slide XML {result['slide_xml_kb']} KB, load {result['load_seconds']}s, save {result['save_seconds']}s, "
+          f"peak RSS {result['peak_rss_mb']} MB, geometry {status}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="create_pptx benchmark suite")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma-separated slide counts")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--output", default=OUTPUT_FILE, help="JSON results file")
+    parser.add_argument("--compare-writers", action="store_true", help="run python-pptx and fast writer explicitly")
+    args = parser.parse_args()
+    suite = run_suite(
+        [int(s) for s in args.sizes.split(",")], args.rounds,
+        (False, True) if args.compare_writers else (None,),
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(suite, f, ensure_ascii=False, indent=2)
+    violations = sum(r["geometry"]["violation_count"] for r in suite["results"])
+    print(f"Results written to {args.output} ({len(suite['results'])} runs, {violations} geometry violations)")
+    sys.exit(1 if violations else 0)
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import random
+import argparse
+import mimetypes
+from bench_slide_engine import make_deck, WORDS
+from wire_format import compact_deck, compact_summary, compact_deep_dive
+
+# Output size of each Gemini response shape, verbose JSON vs compact wire format.
+# Offline: sample outputs are encoded both ways (as the model would send them) and measured in
+# characters and in tokens counted by the SDK (models.count_tokens, needs GOOGLE_API_KEY; without
+# a key only characters are reported: chars/4 is too far off for Vietnamese and one-letter keys).
+# --live FILE runs analyze_document on a real document in both modes and reports wall time; the
+# output tokens of each call are in the log lines of wire_format.log_wire_stats.
+# Usage: python bench_wire_format.py [--slides 10,40] [--live deck.docx]
+
+
+def _sentence(rng, low, high) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize() + "."
+
+
+def make_summary(points: int = 8, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    return {"title": _sentence(rng, 3, 8), "overview": " ".join(_sentence(rng, 10, 20) for _ in range(8)),
+            "key_points": [_sentence(rng, 12, 25) for _ in range(points)], "conclusion": _sentence(rng, 15, 30)}
+
+
+def make_deep_dive(ideas: int = 6, seed: int = 0, detail_key: str = "commentary") -> dict:
+    rng = random.Random(seed)
+    sentences = 15 if detail_key == "commentary" else 2
+    return {
+        "metadata": {"title": _sentence(rng, 2, 5), "slogan": _sentence(rng, 6, 12), "author": "James Clear"},
+        "big_ideas": [_sentence(rng, 3, 5) for _ in range(ideas)],
+        "introduction": {"text": " ".join(_sentence(rng, 10, 20) for _ in range(7)), "best_quote": _sentence(rng, 8, 15)},
+        "core_ideas": [{"title": _sentence(rng, 3, 6).upper(), "quote": _sentence(rng, 8, 15),
+                        detail_key: " ".join(_sentence(rng, 10, 20) for _ in range(sentences))} for _ in range(ideas)],
+        "about_author": " ".join(_sentence(rng, 10, 20) for _ in range(3)),
+        "about_creator": "SlideGenius AI: Chúng tôi cam kết chắt lọc những tinh hoa tri thức để giúp bạn tiết kiệm thời gian.",
+    }
+
+
+def sdk_token_counter(api_key: str = None, model: str = None):
+    """Returns text -> token count using the Gemini tokenizer, or None without an API key."""
+    api_key = api_key or os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        return None
+    from google import genai
+    from ai_engine import ROBUST_MODEL_LIST
+    client = genai.Client(api_key=api_key)
+    model = model or ROBUST_MODEL_LIST[0]
+    return lambda text: client.models.count_tokens(model=model, contents=text).total_tokens
+
+
+def _compare(name: str, verbose_text: str, compact_text: str, count_tokens=None) -> dict:
+    row = {"shape": name, "json_chars": len(verbose_text), "compact_chars": len(compact_text)}
+    if count_tokens:
+        v, c = count_tokens(verbose_text), count_tokens(compact_text)
+        row.update(json_tokens=v, compact_tokens=c, saved=round(1 - c / v, 3))
+    else:
+        row["saved"] = round(1 - len(compact_text) / len(verbose_text), 3)
+    return row
+
+
+def _measure(name: str, verbose: dict, compact: dict, count_tokens=None) -> dict:
+    # Models answer pretty-printed JSON by default; compact answers are asked for on one line
+    verbose_text = json.dumps(verbose, ensure_ascii=False, indent=2)
+    compact_text = json.dumps(compact, ensure_ascii=False, separators=(",", ":"))
+    return _compare(name, verbose_text, compact_text, count_tokens)
+
+
+def run_offline(slide_counts, count_tokens=None) -> list[dict]:
+    """count_tokens: text -> tokens (sdk_token_counter()); None measures characters only."""
+    rows = []
+    for count in slide_counts:
+        deck = make_deck(count)
+        rows.append(_measure(f"deck {count} slides", deck, compact_deck(deck), count_tokens))
+        no_notes = dict(deck, slides=[{k: v for k, v in s.items() if k != "notes"} for s in deck["slides"]])
+        rows.append(_measure(f"deck {count} slides, no notes", no_notes, compact_deck(no_notes), count_tokens))
+    summary = make_summary()
+    rows.append(_measure("summary", summary, compact_summary(summary), count_tokens))
+    full = make_deep_dive()
+    rows.append(_measure("deep dive (single shot)", full, compact_deep_dive(full), count_tokens))
+    skeleton = make_deep_dive(detail_key="brief")
+    rows.append(_measure("deep dive skeleton", skeleton, compact_deep_dive(skeleton, "brief"), count_tokens))
+    commentary = full["core_ideas"][0]["commentary"]
+    rows.append(_compare("commentary", json.dumps({"commentary": commentary}, ensure_ascii=False), commentary,
+                         count_tokens))
+    return rows
+
+
+def run_live(path: str) -> list[dict]:
+    from ai_engine import analyze_document
+    mime_type = mimetypes.guess_type(path)[0] or "application/pdf"
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    rows = []
+    for compact in (False, True):
+        start = time.perf_counter()
+        deck = analyze_document(file_bytes, mime_type, compact_wire=compact, outline_first=False)
+        rows.append({"mode": "compact" if compact else "json", "seconds": round(time.perf_counter() - start, 2),
+                     "slides": len(deck.get("slides", []))})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verbose JSON vs compact wire format")
+    parser.add_argument("--slides", default="10,40")
+    parser.add_argument("--live", help="document to run analyze_document on in both modes (needs GOOGLE_API_KEY)")
+    args = parser.parse_args()
+    count_tokens = sdk_token_counter()
+    if count_tokens is None:
+        print("GOOGLE_API_KEY not set: reporting characters only (no SDK token counts).")
+    for row in run_offline([int(n) for n in args.slides.split(",")], count_tokens):
+        if count_tokens:
+            size = f"json {row['json_tokens']:>6} tok  compact {row['compact_tokens']:>6} tok"
+        else:
+            size = f"json {row['json_chars']:>7} chars  compact {row['compact_chars']:>7} chars"
+        print(f"{row['shape']:<32} {size}  saved {row['saved']:.0%}")
+    if args.live:
+        for row in run_live(args.live):
+            print(f"live {row['mode']:<8} {row['seconds']:>7.2f}s  {row['slides']} slides")
+
+
+if __name__ == "__main__":
+    main()
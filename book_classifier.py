@@ -0,0 +1,125 @@
+import re
+from collections import namedtuple
+from document_loader import DocumentMetadata
+
+# Local Fiction / Non-Fiction classification for the syntopic review.
+# The Librarian call spends a full model round trip on a label that EPUBs (dc:subject) and
+# DOCX (subject, keywords) often already carry. The subjects decide the category; a cheap
+# text classifier (dialogue and narration cues vs. expository cues) gives a second opinion.
+# The Librarian only has to run when the subjects are missing, mixed, or contradicted by the text.
+
+LocalClassification = namedtuple("LocalClassification", ["category", "genre", "confident", "reason"])
+
+FICTION, NON_FICTION = "Fiction", "Non-Fiction"
+
+# A subject votes only when its heading *is* a category term, optionally qualified the way the
+# language does it: English qualifiers come before the head noun ("Science Fiction", "Economic
+# History"), Vietnamese ones after it ("Tiểu thuyết lịch sử"). Anything else is no vote, so
+# "Romance languages", "Novelty books", "Mystery plays" or "Fiction writing" say nothing.
+# BISAC-style headings ("BUSINESS & ECONOMICS / Fiction writing") are read by their top level.
+# Longer terms are tried first: "Nonfiction" before "fiction", "khoa học viễn tưởng" before "khoa học".
+FICTION_TERMS = ("fiction", "novel", "romance", "thriller", "mystery", "fantasy", "horror", "short stories",
+                 "science fiction", "fairy tales", "comics & graphic novels")
+NON_FICTION_TERMS = ("non-fiction", "nonfiction", "literary criticism", "self-help", "business",
+                     "business & economics", "economics", "psychology", "history", "biography",
+                     "biography & autobiography", "memoir", "science", "philosophy", "health", "education",
+                     "management", "finance", "technology", "computers", "politics", "political science",
+                     "religion", "reference", "personal development", "productivity")
+VI_FICTION_TERMS = ("tiểu thuyết", "truyện ngắn", "truyện dài", "truyện trinh thám", "ngôn tình", "kiếm hiệp",
+                    "khoa học viễn tưởng", "viễn tưởng", "hư cấu")
+VI_NON_FICTION_TERMS = ("phi hư cấu", "kỹ năng", "kinh tế", "kinh doanh", "tâm lý", "lịch sử", "khoa học",
+                        "triết học", "hồi ký", "tiểu sử", "giáo dục", "quản trị", "tài chính",
+                        "phát triển bản thân", "sức khỏe")
+
+
+def _term_patterns():
+    # (pattern, category) longest term first; English terms end the heading (plural allowed),
+    # Vietnamese terms start it
+    terms = [(t, FICTION, False) for t in FICTION_TERMS] + [(t, NON_FICTION, False) for t in NON_FICTION_TERMS]
+    terms += [(t, FICTION, True) for t in VI_FICTION_TERMS] + [(t, NON_FICTION, True) for t in VI_NON_FICTION_TERMS]
+    terms.sort(key=lambda t: -len(t[0]))
+    return [(re.compile(rf"^{re.escape(t)}(?:\s|$)" if head_first else rf"(?:^|[\s-]){re.escape(t)}s?$"), category)
+            for t, category, head_first in terms]
+
+
+TERM_PATTERNS = _term_patterns()
+# Fraction of the subjects that must name a category for the metadata to be trusted on its own
+MIN_VOTING_SHARE = 0.5
+
+# Text cues, counted per 1,000 words of the sample
+DIALOGUE_RE = re.compile(r'^\s*(?:["“«]|[—–-]\s)', re.MULTILINE)
+FICTION_CUE_RE = re.compile(r"\b(?:said|asked|replied|whispered|shouted|nói|hỏi|đáp|thì thầm|hét lên|mỉm cười)\b",
+                            re.IGNORECASE)
+NON_FICTION_CUE_RE = re.compile(
+    r"\b(?:research|study|studies|data|evidence|for example|according to|nghiên cứu|dữ liệu|bằng chứng|ví dụ|"
+    r"chẳng hạn|phương pháp|chiến lược)\b|\d+(?:[.,]\d+)?\s?%", re.IGNORECASE)
+TEXT_SAMPLE_CHARS = 60_000
+# A label needs this many cues per 1,000 words and twice the other side's rate
+MIN_CUE_RATE = 2.0
+
+
+def classify_subject(subject: str) -> str | None:
+    """Category implied by one subject heading, None (no vote) if it does not name one."""
+    heading = " ".join(subject.split("/")[0].lower().split())
+    heading = re.sub(r"[\s,]+general$", "", heading)
+    for pattern, category in TERM_PATTERNS:
+        if pattern.search(heading):
+            return category
+    return None
+
+
+def classify_text(text: str) -> str | None:
+    """Fiction / Non-Fiction from cue rates in the opening of the text; None when undecided."""
+    sample = text[:TEXT_SAMPLE_CHARS]
+    words = len(sample.split())
+    if words < 200:
+        return None
+    fiction = (len(FICTION_CUE_RE.findall(sample)) + len(DIALOGUE_RE.findall(sample))) * 1000 / words
+    non_fiction = len(NON_FICTION_CUE_RE.findall(sample)) * 1000 / words
+    if fiction >= MIN_CUE_RATE and fiction >= 2 * non_fiction:
+        return FICTION
+    if non_fiction >= MIN_CUE_RATE and non_fiction >= 2 * fiction:
+        return NON_FICTION
+    return None
+
+
+def classify_locally(metadata: DocumentMetadata, text: str = "") -> LocalClassification:
+    """
+    Confident when every subject that names a category names the same one, those subjects are at
+    least MIN_VOTING_SHARE of all subjects (the others are no vote), and the text classifier does
+    not say otherwise. Without subjects the text label is returned, never confident.
+    """
+    votes = [(subject, classify_subject(subject)) for subject in metadata.subjects]
+    categories = {category for _, category in votes if category}
+    text_category = classify_text(text) if text else None
+    if len(categories) != 1:
+        reason = "mixed subjects" if categories else "no subject metadata"
+        return LocalClassification(text_category, None, False, reason)
+    category = categories.pop()
+    voting = sum(1 for _, c in votes if c)
+    if voting < MIN_VOTING_SHARE * len(votes):
+        return LocalClassification(category, None, False, f"only {voting}/{len(votes)} subjects name a category")
+    genre = next(subject for subject, c in votes if c == category)
+    if text_category and text_category != category:
+        return LocalClassification(category, genre, False, f"text reads as {text_category}")
+    return LocalClassification(category, genre, True, "subject metadata" + (" + text" if text_category else ""))
+
+
+def librarian_from_metadata(metadata: DocumentMetadata, classification: LocalClassification, mime_type: str) -> dict:
+    """
+    librarian_data (the Librarian's JSON shape) built from the file's metadata.
+    Author and description are taken from EPUBs only: DOCX core properties hold whoever saved
+    the file ("python-docx", an office account) and tool boilerplate, not the book's.
+    """
+    data = {"category": classification.category, "genre": classification.genre or "General"}
+    if metadata.title:
+        data["title"] = metadata.title
+    if metadata.subjects:
+        data["subjects"] = list(metadata.subjects)
+    if mime_type == "application/epub+zip":
+        if metadata.creator:
+            data["author"] = metadata.creator
+        if metadata.description:
+            data["core_theme"] = metadata.description[:500]
+    data["source"] = "metadata"
+    return data
@@ -0,0 +1,146 @@
+import os
+import json
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from utils import safe_print
+
+# Small on-disk JSON cache shared by the pipelines (chunk results, per-document artifacts...).
+# Layout: CACHE_DIR/<namespace>/<key[:2]>/<key>.json
+# Override the location with the SLIDEGENIUS_CACHE_DIR environment variable.
+# Both tiers are bounded for the long-running server: memory is an LRU of MEMORY_MAX_ENTRIES
+# values; on disk, entries older than DISK_MAX_AGE_DAYS are dropped and the oldest entries
+# are evicted once the directory exceeds DISK_MAX_MB (checked every PRUNE_EVERY_WRITES writes).
+# Namespaces registered with keep_on_size_prune (stored decks, review analyses) are artifacts the
+# user comes back to: they only expire by age and do not count towards DISK_MAX_MB, so a large
+# map-reduce run cannot evict them.
+
+CACHE_DIR = os.environ.get("SLIDEGENIUS_CACHE_DIR", ".slidegenius_cache")
+MEMORY_MAX_ENTRIES = int(os.environ.get("SLIDEGENIUS_CACHE_MEMORY_ENTRIES", "256"))
+DISK_MAX_MB = float(os.environ.get("SLIDEGENIUS_CACHE_MAX_MB", "500"))
+DISK_MAX_AGE_DAYS = float(os.environ.get("SLIDEGENIUS_CACHE_MAX_AGE_DAYS", "30"))
+PRUNE_EVERY_WRITES = 100
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_writes = {"count": 0}
+_size_exempt_namespaces = set()
+
+
+def content_hash(data) -> str:
+    """SHA-256 hex digest of bytes or str (str is UTF-8 encoded)."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def keep_on_size_prune(namespace: str):
+    """Excludes a namespace from the DISK_MAX_MB eviction (age expiry still applies)."""
+    _size_exempt_namespaces.add(namespace)
+
+
+def _path(namespace: str, key: str) -> str:
+    return os.path.join(CACHE_DIR, namespace, key[:2], f"{key}.json")
+
+
+def _remember(namespace: str, key: str, value):
+    # Caller holds _lock
+    _memory[(namespace, key)] = value
+    _memory.move_to_end((namespace, key))
+    while len(_memory) > MEMORY_MAX_ENTRIES:
+        _memory.popitem(last=False)
+
+
+def _expired(mtime: float, now: float) -> bool:
+    return DISK_MAX_AGE_DAYS > 0 and now - mtime > DISK_MAX_AGE_DAYS * 86400
+
+
+def cache_get(namespace: str, key: str, default=None):
+    """Returns the cached value or default. Memory first, then disk."""
+    with _lock:
+        if (namespace, key) in _memory:
+            _memory.move_to_end((namespace, key))
+            return _memory[(namespace, key)]
+    path = _path(namespace, key)
+    try:
+        now = time.time()
+        if _expired(os.path.getmtime(path), now):
+            os.remove(path)
+            return default
+        with open(path, "r", encoding="utf-8") as f:
+            value = json.load(f)
+        # Disk eviction is oldest-mtime first: a hit counts as a use
+        os.utime(path, (now, now))
+    except FileNotFoundError:
+        return default
+    except Exception as e:
+        safe_print(f"⚠️ Cache read failed ({namespace}/{key[:12]}): {e}")
+        return default
+    with _lock:
+        _remember(namespace, key, value)
+    return value
+
+
+def cache_put(namespace: str, key: str, value):
+    """Stores a JSON-serializable value (atomic write, safe across worker threads)."""
+    with _lock:
+        _remember(namespace, key, value)
+        _writes["count"] += 1
+        prune = _writes["count"] % PRUNE_EVERY_WRITES == 0
+    path = _path(namespace, key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        # The cache is an optimization: never fail the pipeline because of it
+        safe_print(f"⚠️ Cache write failed ({namespace}/{key[:12]}): {e}")
+    if prune:
+        prune_disk_cache()
+
+
+def prune_disk_cache(max_mb: float | None = None, max_age_days: float | None = None) -> int:
+    """
+    Deletes expired entries, then the least recently used ones until the cache fits max_mb.
+    Namespaces registered with keep_on_size_prune are neither counted nor evicted for size.
+    Returns the number of files removed.
+    """
+    max_bytes = (DISK_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    max_age = (DISK_MAX_AGE_DAYS if max_age_days is None else max_age_days) * 86400
+    now = time.time()
+    entries = []
+    for root, _, files in os.walk(CACHE_DIR):
+        exempt = os.path.relpath(root, CACHE_DIR).split(os.sep)[0] in _size_exempt_namespaces
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path, exempt))
+
+    removed = 0
+    total = sum(size for _, size, _, exempt in entries if not exempt)
+    for mtime, size, path, exempt in sorted(entries):
+        expired = max_age > 0 and now - mtime > max_age
+        over_budget = not exempt and max_bytes > 0 and total > max_bytes
+        if not (expired or over_budget):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        if not exempt:
+            total -= size
+        removed += 1
+    if removed:
+        safe_print(f"🧹 Cache pruned: {removed} files removed, {total / (1024 * 1024):.1f} MB kept")
+    return removed
+
+
+def clear_memory_cache():
+    with _lock:
+        _memory.clear()
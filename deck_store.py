@@ -0,0 +1,99 @@
+import json
+import uuid
+import threading
+from datetime import datetime, timezone
+from cache_store import cache_get, cache_put, content_hash, keep_on_size_prune
+
+# Versioned store of the slide JSON produced by analyze_document.
+# A deck depends only on the document, the analysis options and the model that wrote it;
+# the template is applied afterwards by create_pptx. Keeping the JSON lets the UI re-render
+# a deck with another template in well under a second, without calling Gemini.
+#
+# Every fresh analysis is its own version (a run id is part of its key), so rerunning with the
+# same model never overwrites an earlier deck. Editing a stored deck (slide regeneration) saves
+# a revision: a new version whose "parent" is the key it was made from, so the original stays available.
+#
+# decks/<key>               : {"schema", "key", "document_hash", "options", "model", "parent", "run_id", "created_at", "deck"}
+# deck_index/<document_hash>: [{"key", "options", "model", "parent", "created_at", "slides"}, ...] newest first
+
+DECK_NAMESPACE = "decks"
+DECK_INDEX_NAMESPACE = "deck_index"
+# Bump when the stored deck JSON changes shape; older records are then ignored
+DECK_SCHEMA_VERSION = 1
+MAX_VERSIONS_PER_DOCUMENT = 20
+# Stored decks are what Re-render reads back: never evicted to make room for chunk notes
+keep_on_size_prune(DECK_NAMESPACE)
+keep_on_size_prune(DECK_INDEX_NAMESPACE)
+
+_index_lock = threading.Lock()
+
+
+def deck_options(detail_level: str, user_instructions: str = "", token_budget=None) -> dict:
+    """The analyze_document arguments that change the generated deck."""
+    return {
+        "detail_level": detail_level,
+        "user_instructions": (user_instructions or "").strip(),
+        "token_budget": token_budget,
+    }
+
+
+def deck_key(document_hash: str, options: dict, model: str, parent: str | None = None, deck: dict | None = None,
+             run_id: str | None = None) -> str:
+    parts = [document_hash, options, model]
+    if parent:
+        # Revisions of one deck differ by content, not by options
+        parts += [parent, deck]
+    else:
+        parts.append(run_id)
+    return content_hash(json.dumps(parts, ensure_ascii=False, sort_keys=True))
+
+
+def save_deck(deck: dict, document_hash: str, options: dict, model: str, parent: str | None = None) -> str:
+    """
+    Stores the deck as the newest version for this document/options. Returns its key.
+    parent: key of the stored deck this one was edited from (None for a fresh analysis, which gets a new run id).
+    """
+    run_id = None if parent else uuid.uuid4().hex
+    key = deck_key(document_hash, options, model, parent, deck, run_id)
+    created_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    cache_put(DECK_NAMESPACE, key, {
+        "schema": DECK_SCHEMA_VERSION,
+        "key": key,
+        "document_hash": document_hash,
+        "options": options,
+        "model": model,
+        "parent": parent,
+        "run_id": run_id,
+        "created_at": created_at,
+        "deck": deck,
+    })
+    entry = {"key": key, "options": options, "model": model, "parent": parent, "created_at": created_at,
+             "slides": len(deck.get("slides", []))}
+    with _index_lock:
+        versions = [v for v in cache_get(DECK_INDEX_NAMESPACE, document_hash, []) if v["key"] != key]
+        cache_put(DECK_INDEX_NAMESPACE, document_hash, ([entry] + versions)[:MAX_VERSIONS_PER_DOCUMENT])
+    return key
+
+
+def load_deck(key: str) -> dict | None:
+    """The stored record (deck JSON under "deck"), or None if missing or from an older schema."""
+    record = cache_get(DECK_NAMESPACE, key)
+    if not record or record.get("schema") != DECK_SCHEMA_VERSION:
+        return None
+    return record
+
+
+def list_decks(document_hash: str) -> list[dict]:
+    """Index entries of every stored version for a document, newest first."""
+    return list(cache_get(DECK_INDEX_NAMESPACE, document_hash, []))
+
+
+def find_deck(document_hash: str, options: dict | None = None) -> dict | None:
+    """Newest stored record for the document (with these options, if given), whatever the model."""
+    for entry in list_decks(document_hash):
+        if options is not None and entry["options"] != options:
+            continue
+        record = load_deck(entry["key"])
+        if record is not None:
+            return record
+    return None
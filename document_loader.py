@@ -1,8 +1,13 @@
 
 import os
 import io
+import re
 import docx
+import zipfile
 import ebooklib
+import xml.etree.ElementTree as ET
+from array import array
+from collections import namedtuple
 from ebooklib import epub
 from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
 import warnings
@@ -11,19 +16,169 @@ import warnings
 warnings.filterwarnings("ignore", category=UserWarning, module='ebooklib')
 warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
 
-def extract_text_from_docx(file_bytes: bytes) -> str:
-    """Extracts text from a DOCX file bytes."""
+NO_PAGE = -1
+
+Section = namedtuple("Section", ["index", "level", "title", "start", "end", "page"])
+
+class StructuredDocument:
+    """
+    Flat document text plus an ordered section index.
+    Section metadata is stored column-wise in compact arrays (not one object per section)
+    so books with 1,000+ chapters stay cheap to build, cache and pass around.
+    """
+    __slots__ = ("text", "titles", "levels", "starts", "ends", "pages", "mime_type")
+
+    def __init__(self, text: str, mime_type: str = ""):
+        self.text = text
+        self.mime_type = mime_type
+        self.titles = []            # list[str]
+        self.levels = array('B')    # heading level (0 = preamble / untitled)
+        self.starts = array('q')    # char offset (inclusive)
+        self.ends = array('q')      # char offset (exclusive)
+        self.pages = array('i')     # 1-based page number, NO_PAGE if unknown
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __str__(self):
+        return self.text
+
+    def add_section(self, title: str, level: int, start: int, end: int, page: int = NO_PAGE):
+        self.titles.append(title)
+        self.levels.append(max(0, min(level, 255)))
+        self.starts.append(start)
+        self.ends.append(end)
+        self.pages.append(page if page is not None else NO_PAGE)
+
+    def section(self, i: int) -> Section:
+        page = self.pages[i]
+        return Section(i, self.levels[i], self.titles[i], self.starts[i], self.ends[i], None if page == NO_PAGE else page)
+
+    def sections(self):
+        for i in range(len(self.titles)):
+            yield self.section(i)
+
+    def section_text(self, i: int) -> str:
+        return self.text[self.starts[i]:self.ends[i]]
+
+    def outline(self) -> list[str]:
+        """Indented list of section titles (untitled sections are skipped)."""
+        return [("  " * max(0, self.levels[i] - 1)) + self.titles[i] for i in range(len(self.titles)) if self.titles[i]]
+
+    @classmethod
+    def from_parts(cls, parts: list[tuple[str, int, str, int]], separator: str = "\n\n", mime_type: str = ""):
+        """
+        Builds a document from (title, level, text, page) parts joined with separator.
+        Section offsets cover each part's text (separator excluded).
+        """
+        texts = []
+        spans = []
+        offset = 0
+        for title, level, text, page in parts:
+            if texts:
+                offset += len(separator)
+            spans.append((title, level, offset, offset + len(text), page))
+            texts.append(text)
+            offset += len(text)
+
+        doc = cls(separator.join(texts), mime_type)
+        for title, level, start, end, page in spans:
+            doc.add_section(title, level, start, end, page)
+        return doc
+
+
+class _SectionIndexBuilder:
+    """Collects heading positions while a loader streams paragraphs into one text buffer."""
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+        self.open_sections = []  # (title, level, start, page)
+
+    def append(self, text: str, separator: str):
+        if self.chunks:
+            self.chunks.append(separator)
+            self.offset += len(separator)
+        self.chunks.append(text)
+        self.offset += len(text)
+
+    def start_section(self, title: str, level: int, page: int = NO_PAGE, separator: str = "\n"):
+        # Section starts where the next appended chunk will start
+        start = self.offset + (len(separator) if self.chunks else 0)
+        self.open_sections.append((title, level, start, page))
+
+    def build(self, mime_type: str) -> StructuredDocument:
+        doc = StructuredDocument("".join(self.chunks), mime_type)
+        sections = list(self.open_sections)
+        if not sections or sections[0][2] > 0:
+            # Leading text before the first heading becomes an untitled preamble section
+            preamble_page = 1 if sections and sections[0][3] != NO_PAGE else NO_PAGE
+            sections.insert(0, ("", 0, 0, preamble_page))
+        for i, (title, level, start, page) in enumerate(sections):
+            end = sections[i + 1][2] if i + 1 < len(sections) else len(doc.text)
+            doc.add_section(title, level, start, end, page)
+        return doc
+
+
+# Markdown headings and common chapter markers (Vietnamese + English) in plain text
+PLAIN_HEADING_RE = re.compile(
+    r'^(?:(#{1,6})\s+(.+)|((?:chương|chapter|phần|part)\s+[\dIVXLC]+\b.{0,80}))$',
+    re.IGNORECASE
+)
+
+def _docx_heading_level(para) -> int:
+    """Returns the heading level of a DOCX paragraph from its style, 0 if it is body text."""
+    try:
+        style_name = (para.style.name or "") if para.style is not None else ""
+    except Exception:
+        return 0
+    if style_name == "Title":
+        return 1
+    match = re.match(r'^(?:Heading|Tiêu đề)\s*(\d)', style_name, re.IGNORECASE)
+    if match:
+        return int(match.group(1))
+    return 0
+
+def _docx_page_breaks(para) -> int:
+    """Counts explicit and last-rendered page breaks in a paragraph."""
+    return len(para._p.xpath('.//w:br[@w:type="page"] | .//w:lastRenderedPageBreak'))
+
+def load_structured_docx(file_bytes: bytes) -> StructuredDocument:
+    """Loads a DOCX into a StructuredDocument using heading styles as section boundaries."""
     try:
         doc = docx.Document(io.BytesIO(file_bytes))
-        full_text = []
-        for para in doc.paragraphs:
-            full_text.append(para.text)
-        return '\n'.join(full_text)
+        builder = _SectionIndexBuilder()
+        paragraphs = doc.paragraphs
+        has_pages = any(_docx_page_breaks(p) for p in paragraphs)
+        page = 1
+
+        for para in paragraphs:
+            level = _docx_heading_level(para)
+            if level and para.text.strip():
+                builder.start_section(para.text.strip(), level, page if has_pages else NO_PAGE)
+            builder.append(para.text, "\n")
+            page += _docx_page_breaks(para)
+
+        return builder.build("application/vnd.openxmlformats-officedocument.wordprocessingml.document")
     except Exception as e:
         raise ValueError(f"Lỗi khi đọc file DOCX: {str(e)}")
 
-def extract_text_from_epub(file_bytes: bytes) -> str:
-    """Extracts text from an EPUB file bytes."""
+def extract_text_from_docx(file_bytes: bytes) -> str:
+    """Extracts text from a DOCX file bytes."""
+    return load_structured_docx(file_bytes).text
+
+def _epub_item_title(soup, item) -> tuple[str, int]:
+    """Title and level of an EPUB item: first heading tag, then <title>, then file name."""
+    for level in range(1, 7):
+        heading = soup.find(f"h{level}")
+        if heading and heading.get_text(strip=True):
+            return heading.get_text(" ", strip=True), level
+    if soup.title and soup.title.get_text(strip=True):
+        return soup.title.get_text(" ", strip=True), 1
+    return os.path.splitext(os.path.basename(item.get_name() or ""))[0], 1
+
+def load_structured_epub(file_bytes: bytes) -> StructuredDocument:
+    """Loads an EPUB into a StructuredDocument with one section per content item."""
     try:
         # EbookLib requires a file path or a file-like object.
         # However, epub.read_epub usually takes a path. 
@@ -37,7 +192,7 @@ def extract_text_from_epub(file_bytes: bytes) -> str:
             tmp_path = tmp.name
             
         book = epub.read_epub(tmp_path)
-        full_text = []
+        parts = []
 
         # Import safe_print locally since it's not at top level (avoid circular import if utils uses this)
         # But here we can just skip logging or use standard print if needed, 
@@ -64,7 +219,8 @@ def extract_text_from_epub(file_bytes: bytes) -> str:
                 
                 # Only add meaningful chunks
                 if len(text) > 50:
-                    full_text.append(text)
+                    title, level = _epub_item_title(soup, item)
+                    parts.append((title, level, text, NO_PAGE))
                 
         # Clean up temp file
         try:
@@ -72,25 +228,113 @@ def extract_text_from_epub(file_bytes: bytes) -> str:
         except:
             pass
             
-        result = '\n\n'.join(full_text)
-        return result
+        return StructuredDocument.from_parts(parts, separator="\n\n", mime_type="application/epub+zip")
 
     except Exception as e:
         raise ValueError(f"Lỗi khi đọc file EPUB: {str(e)}")
 
-def load_document(file_bytes: bytes, mime_type: str) -> str:
+def extract_text_from_epub(file_bytes: bytes) -> str:
+    """Extracts text from an EPUB file bytes."""
+    return load_structured_epub(file_bytes).text
+
+def load_structured_text(text: str, mime_type: str = "text/plain") -> StructuredDocument:
+    """
+    Builds a StructuredDocument from plain text.
+    Headings: Markdown '#' lines or 'Chương/Chapter/Phần/Part N' lines. Pages: form feeds (\\f).
+    """
+    builder = _SectionIndexBuilder()
+    has_pages = "\f" in text
+    page = 1
+    for line in text.split("\n"):
+        match = PLAIN_HEADING_RE.match(line.strip())
+        if match:
+            if match.group(1):
+                builder.start_section(match.group(2).strip(), len(match.group(1)), page if has_pages else NO_PAGE)
+            else:
+                builder.start_section(match.group(3).strip(), 1, page if has_pages else NO_PAGE)
+        builder.append(line, "\n")
+        page += line.count("\f")
+    return builder.build(mime_type)
+
+def decode_plain_text(file_bytes: bytes) -> str:
+    """Decodes a text/plain upload (UTF-8 first, Latin-1 fallback)."""
+    try:
+        return file_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        return file_bytes.decode('latin-1')
+
+def load_structured_document(file_bytes: bytes, mime_type: str) -> StructuredDocument:
     """
     Loads document content based on mime type.
-    Returns: Text content of the document.
+    Returns: StructuredDocument (flat text + section index).
     """
     if mime_type == "application/pdf":
         raise NotImplementedError("PDF loading is handled by Gemini Multimodal, not text extraction yet.")
     
     elif mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        return extract_text_from_docx(file_bytes)
+        return load_structured_docx(file_bytes)
         
     elif mime_type == "application/epub+zip":
-        return extract_text_from_epub(file_bytes)
+        return load_structured_epub(file_bytes)
+
+    elif mime_type == "text/plain":
+        return load_structured_text(decode_plain_text(file_bytes))
     
     else:
         raise ValueError(f"Định dạng file không được hỗ trợ để trích xuất text thuần: {mime_type}")
+
+# Bibliographic metadata carried by the file itself (EPUB OPF, DOCX core properties).
+# Empty fields when the format has none (PDF, plain text) or the file does not set them.
+DocumentMetadata = namedtuple("DocumentMetadata", ["title", "creator", "subjects", "description", "language"])
+EMPTY_METADATA = DocumentMetadata("", "", (), "", "")
+
+DC_NS = "{http://purl.org/dc/elements/1.1/}"
+CONTAINER_NS = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+KEYWORD_SPLIT_RE = re.compile(r"\s*[;,]\s*")
+
+def _xml_text(element) -> str:
+    return " ".join("".join(element.itertext()).split()) if element is not None else ""
+
+def _epub_metadata(archive: zipfile.ZipFile) -> DocumentMetadata:
+    container = ET.fromstring(archive.read("META-INF/container.xml"))
+    rootfile = container.find(f".//{CONTAINER_NS}rootfile")
+    opf = ET.fromstring(archive.read(rootfile.get("full-path")))
+    values = lambda name: [v for v in (_xml_text(e) for e in opf.iter(f"{DC_NS}{name}")) if v]
+    first = lambda name: (values(name) or [""])[0]
+    # Descriptions are often HTML
+    description = BeautifulSoup(first("description"), "html.parser").get_text(" ", strip=True)
+    return DocumentMetadata(first("title"), " & ".join(values("creator")), tuple(values("subject")), description,
+                            first("language"))
+
+def _docx_metadata(archive: zipfile.ZipFile) -> DocumentMetadata:
+    core = ET.fromstring(archive.read("docProps/core.xml"))
+    field = lambda ns, name: _xml_text(core.find(f"{ns}{name}"))
+    cp = "{http://schemas.openxmlformats.org/package/2006/metadata/core-properties}"
+    subjects = [field(DC_NS, "subject")] + KEYWORD_SPLIT_RE.split(field(cp, "keywords"))
+    return DocumentMetadata(field(DC_NS, "title"), field(DC_NS, "creator"), tuple(s for s in subjects if s),
+                            field(DC_NS, "description"), field(DC_NS, "language"))
+
+def extract_metadata(file_bytes: bytes, mime_type: str) -> DocumentMetadata:
+    """
+    Reads the metadata from the package (OPF / docProps/core.xml) without loading the content.
+    Never raises: an unreadable or missing block gives EMPTY_METADATA.
+    """
+    readers = {
+        "application/epub+zip": _epub_metadata,
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document": _docx_metadata,
+    }
+    reader = readers.get(mime_type)
+    if reader is None:
+        return EMPTY_METADATA
+    try:
+        with zipfile.ZipFile(io.BytesIO(file_bytes)) as archive:
+            return reader(archive)
+    except (zipfile.BadZipFile, KeyError, ET.ParseError, AttributeError, TypeError):
+        return EMPTY_METADATA
+
+def load_document(file_bytes: bytes, mime_type: str) -> str:
+    """
+    Loads document content based on mime type.
+    Returns: Text content of the document (flat view over load_structured_document).
+    """
+    return load_structured_document(file_bytes, mime_type).text
@@ -5,20 +5,26 @@ from utils import suppress_console_output, safe_print
 # suppress_console_output()
 
 import base64
+import re
 import mesop as me
 import mesop.labs as mel
 from dataclasses import field
 from dotenv import load_dotenv
-from ai_engine import analyze_document
-from slide_engine import create_pptx
+from ai_engine import analyze_document, regenerate_slides, SLIDE_TOKEN_BUDGET
+from speaker_notes import fill_speaker_notes
+from slide_engine import create_pptx, rendered_slide_numbers
+from cache_store import content_hash
+from deck_store import deck_options, find_deck, load_deck
+import slide_preview
 import concurrent.futures
 import time
 import asyncio
+import queue
 
 
 # Re-import functions to update references
 from ai_engine import analyze_document
-from summarizer import summarize_document_v2, save_summary_to_pdf, summarize_book_deep_dive, review_book_syntopic, PartialCompletionError
+from summarizer import summarize_document_v2, save_summary_to_pdf, summarize_book_deep_dive, review_book_languages, PartialCompletionError
 
 
 load_dotenv()
@@ -42,6 +48,25 @@ def clear_cancel_signal():
 def check_cancel_signal():
     return os.path.exists(CANCEL_SIGNAL_FILE) or GLOBAL_CANCEL_FLAG
 
+def make_progress_reporter():
+    """
+    Thread-safe progress channel for worker threads (e.g. Map-Reduce chunks).
+    Workers call report(stage, done, total, label); the poll loop drains messages into state.logs.
+    """
+    progress_queue = queue.Queue()
+
+    def report(stage, done, total, label):
+        progress_queue.put(f"🧩 {stage} {done}/{total}: {label}")
+
+    return progress_queue, report
+
+def drain_progress(progress_queue, state):
+    while True:
+        try:
+            state.logs.append(progress_queue.get_nowait())
+        except queue.Empty:
+            return
+
 @me.stateclass
 class State:
     # Processing State
@@ -53,6 +78,10 @@ class State:
     uploaded_file_bytes: bytes = b""
     uploaded_mime_type: str = ""
     uploaded_filename: str = ""
+    # SHA-256 of the uploaded file: key of its stored decks (deck_store.py)
+    document_hash: str = ""
+    # Key of the stored deck for this document + options ("" = none); looked up when they change
+    stored_deck_key: str = ""
     user_topic: str = ""
     
     # Template Data
@@ -62,6 +91,25 @@ class State:
     # Output Data
     pptx_filename: str = ""
     pptx_content_base64: str = ""
+    # PNG thumbnails (base64) of the generated slides, title slide first
+    slide_previews: list[str] = field(default_factory=list)
+    # Per preview: the content slide number the regenerate range uses (0 = title slide)
+    slide_preview_numbers: list[int] = field(default_factory=list)
+
+    # Deferred speaker notes: the deck is returned first, a copy with notes follows
+    defer_notes: bool = False
+    notes_status: str = "" # "", running, ready, error
+    pptx_notes_filename: str = ""
+    pptx_notes_content_base64: str = ""
+
+    # Compact response format (wire_format.py): fewer output tokens, expanded locally
+    compact_wire: bool = False
+    # Drop the template's unused layouts/masters/media from the .pptx (pptx_slim.py)
+    slim_deck: bool = False
+
+    # Slide regeneration: range of content slides ("3" or "3-5") and what to change
+    regen_range: str = ""
+    regen_instructions: str = ""
     
     # Summary Data
     pdf_filename: str = ""
@@ -81,7 +129,12 @@ class State:
     # Advanced Config
     use_multi_key: bool = False
     user_api_keys_input: str = ""
-    review_language: str = "Tiếng Việt"
+    # Review languages: the Librarian/Analyst run once, then one Editor call per language
+    review_languages: list[str] = field(default_factory=lambda: ["Tiếng Việt"])
+    # Run the Librarian/Analyst again instead of reusing the stored analysis of this document
+    reanalyse_review: bool = False
+    # Reviews beyond the first language: PDF file name -> base64
+    review_extra_pdfs: dict = field(default_factory=dict)
     
     # Resume State
     resume_data: dict = field(default_factory=dict)
@@ -104,6 +157,8 @@ def handle_upload(event: me.UploadEvent):
     state.uploaded_file_bytes = file.read()
     state.uploaded_mime_type = file.mime_type
     state.uploaded_filename = file.name
+    state.document_hash = content_hash(state.uploaded_file_bytes)
+    refresh_stored_deck(state)
     
     # reset logs/status
     state.logs = [f"Đã tải lên: {file.name}", "System: Console Output Suppressed (v3)"]
@@ -127,6 +182,19 @@ def handle_template_upload(event: me.UploadEvent):
 def on_detail_change(e: me.CheckboxChangeEvent):
     state = me.state(State)
     state.is_detailed = e.checked
+    refresh_stored_deck(state)
+
+def on_defer_notes_change(e: me.CheckboxChangeEvent):
+    state = me.state(State)
+    state.defer_notes = e.checked
+
+def on_compact_wire_change(e: me.CheckboxChangeEvent):
+    state = me.state(State)
+    state.compact_wire = e.checked
+
+def on_slim_deck_change(e: me.CheckboxChangeEvent):
+    state = me.state(State)
+    state.slim_deck = e.checked
 
 def on_multi_key_change(e: me.CheckboxChangeEvent):
     state = me.state(State)
@@ -134,7 +202,11 @@ def on_multi_key_change(e: me.CheckboxChangeEvent):
 
 def on_language_change(e: me.SelectSelectionChangeEvent):
     state = me.state(State)
-    state.review_language = e.value
+    state.review_languages = list(e.values)
+
+def on_reanalyse_review_change(e: me.CheckboxChangeEvent):
+    state = me.state(State)
+    state.reanalyse_review = e.checked
 
 def handle_api_keys_input(e: me.InputEvent):
     state = me.state(State)
@@ -143,6 +215,15 @@ def handle_api_keys_input(e: me.InputEvent):
 def handle_user_instruction(e: me.InputEvent):
     state = me.state(State)
     state.user_instructions = e.value
+    refresh_stored_deck(state)
+
+def handle_regen_range(e: me.InputEvent):
+    state = me.state(State)
+    state.regen_range = e.value
+
+def handle_regen_instructions(e: me.InputEvent):
+    state = me.state(State)
+    state.regen_instructions = e.value
 
 def request_cancel(e: me.ClickEvent):
     state = me.state(State)
@@ -212,6 +293,7 @@ async def generate_summary(e: me.ClickEvent):
         # Run AI task in a separate thread
         executor = concurrent.futures.ThreadPoolExecutor()
         cancel_check_lambda = check_cancel_signal # Use file checker
+        progress_queue, report_progress = make_progress_reporter()
         
         try:
             if state.is_detailed:
@@ -224,7 +306,9 @@ async def generate_summary(e: me.ClickEvent):
                     state.uploaded_mime_type,
                     api_key=api_key_env,
                     api_keys=api_keys_list,
-                    cancel_check=cancel_check_lambda
+                    cancel_check=cancel_check_lambda,
+                    progress_callback=report_progress,
+                    compact_wire=state.compact_wire
                 )
             else:
                 future = executor.submit(
@@ -234,7 +318,9 @@ async def generate_summary(e: me.ClickEvent):
                     api_key=api_key_env,
                     api_keys=api_keys_list,
                     user_instructions=state.user_instructions,
-                    cancel_check=cancel_check_lambda
+                    cancel_check=cancel_check_lambda,
+                    progress_callback=report_progress,
+                    compact_wire=state.compact_wire
                 )
             
             # Poll loop
@@ -245,9 +331,11 @@ async def generate_summary(e: me.ClickEvent):
                     executor.shutdown(wait=False)
                     yield
                     return
+                drain_progress(progress_queue, state)
                 yield
                 await asyncio.sleep(0.1)
                 
+            drain_progress(progress_queue, state)
             summary_data = future.result()
         finally:
             executor.shutdown(wait=False)
@@ -257,6 +345,8 @@ async def generate_summary(e: me.ClickEvent):
 
         if "used_model" in summary_data:
              state.logs.append(f"Model used: {summary_data['used_model']}")
+        if summary_data.get("missing_commentaries"):
+             state.logs.append(f"⏱️ {summary_data['missing_commentaries']} phân tích chưa xong trước hạn giờ (giữ bản tóm lược ngắn).")
         
         state.logs.append("Tóm tắt hoàn tất. Đang tạo file PDF...")
         state.processing_status = "generating_pdf"
@@ -307,6 +397,157 @@ async def generate_summary(e: me.ClickEvent):
         yield
 
 
+def current_deck_options(state) -> dict:
+    detail_mode = "Chi tiết" if state.is_detailed else "Tóm tắt"
+    return deck_options(detail_mode, state.user_instructions, SLIDE_TOKEN_BUDGET)
+
+def refresh_stored_deck(state):
+    """Points state.stored_deck_key at the newest deck saved for this document and these options."""
+    record = find_deck(state.document_hash, current_deck_options(state)) if state.document_hash else None
+    state.stored_deck_key = record["key"] if record else ""
+
+def stored_deck(state) -> dict | None:
+    """Deck record saved by an earlier Generate for this document and these options (loaded on click)."""
+    return load_deck(state.stored_deck_key) if state.stored_deck_key else None
+
+def parse_slide_range(text: str) -> tuple[int, int] | None:
+    """ "3" -> (3, 3), "3-5" -> (3, 5); None if not a range."""
+    match = re.fullmatch(r'\s*(\d+)\s*(?:[-–]\s*(\d+)\s*)?', text or "")
+    if not match:
+        return None
+    first = int(match.group(1))
+    return first, int(match.group(2) or first)
+
+def collect_api_keys(state) -> list[str]:
+    """Keys from the multi-key input plus the default env key ([] = analyze with the env key only)."""
+    api_key_env = os.environ.get("GOOGLE_API_KEY")
+    api_keys_list = []
+    if state.use_multi_key and state.user_api_keys_input:
+        raw_keys = re.split(r'[,\n\r]+', state.user_api_keys_input)
+        api_keys_list = [k.strip() for k in raw_keys if k.strip()]
+        if api_key_env and api_key_env not in api_keys_list:
+            api_keys_list.append(api_key_env)
+    return api_keys_list
+
+def preview_label(state, index: int) -> str:
+    """Thumbnail caption: the number to type in the regenerate range ("(tiếp)" for continuation slides)."""
+    numbers = state.slide_preview_numbers
+    if index >= len(numbers):
+        return f"Slide {index + 1}"
+    if numbers[index] == 0:
+        return "Slide tiêu đề"
+    continued = index > 0 and numbers[index - 1] == numbers[index]
+    return f"Slide {numbers[index]}" + (" (tiếp)" if continued else "")
+
+def render_deck(state, slide_json: dict, fast_writer: bool | None = None):
+    """create_pptx with the current template, then preview thumbnails; fills the download state."""
+    template_bytes = state.template_file_bytes if state.template_file_bytes else None
+    pptx_io = create_pptx(slide_json, template_pptx_bytes=template_bytes, fast_writer=fast_writer, slim=state.slim_deck)
+    pptx_bytes = pptx_io.read()
+
+    # Thumbnails for the in-page preview (optional: the download works without them)
+    try:
+        thumbnails = slide_preview.render_thumbnails(slide_json, template_bytes)
+        state.slide_previews = [base64.b64encode(png).decode('utf-8') for png in thumbnails]
+        state.slide_preview_numbers = rendered_slide_numbers(slide_json, template_bytes)
+    except Exception as preview_error:
+        safe_print(f"⚠️ Slide preview failed: {preview_error}")
+        state.slide_previews = []
+        state.slide_preview_numbers = []
+
+    # Prepare filename
+    original_name = state.uploaded_filename
+    name_no_ext = original_name.rsplit('.', 1)[0]
+    state.pptx_filename = f"{name_no_ext}_presentation.pptx"
+
+    state.pptx_content_base64 = base64.b64encode(pptx_bytes).decode('utf-8')
+
+def rerender_slides(e: me.ClickEvent):
+    """Re-applies the current template to the stored deck JSON: no Gemini call, no quota."""
+    state = me.state(State)
+    state.error_message = ""
+    record = stored_deck(state)
+    if record is None:
+        state.error_message = "Chưa có slide đã lưu cho tài liệu và tùy chọn này. Hãy bấm Generate Slides trước."
+        yield
+        return
+    try:
+        start = time.perf_counter()
+        render_deck(state, record["deck"])
+        # The newest stored deck already carries any notes written for it
+        state.notes_status = ""
+        template_label = state.template_filename or "mẫu mặc định"
+        state.logs.append(
+            f"♻️ Đã xuất lại với {template_label} trong {time.perf_counter() - start:.2f}s "
+            f"(bản lưu {record['created_at']}, {record['model']}, không gọi Gemini)."
+        )
+        state.processing_status = "done"
+    except Exception as ex:
+        safe_print(f"DEBUG RERENDER EXCEPTION: {ex}")
+        state.processing_status = "error"
+        state.error_message = str(ex)
+        state.logs.append(f"Lỗi: {str(ex)}")
+    yield
+
+async def regenerate_slide_range(e: me.ClickEvent):
+    """Rewrites only the chosen slides of the stored deck (one small Gemini call), then re-renders."""
+    state = me.state(State)
+    state.error_message = ""
+    state.cancel_requested = False
+    clear_cancel_signal()
+    record = stored_deck(state)
+    slide_range = parse_slide_range(state.regen_range)
+    if record is None or slide_range is None:
+        state.error_message = "Nhập số slide cần tạo lại (ví dụ: 3 hoặc 3-5)." if record else \
+            "Chưa có slide đã lưu cho tài liệu và tùy chọn này. Hãy bấm Generate Slides trước."
+        yield
+        return
+
+    first, last = slide_range
+    state.processing_status = "analyzing"
+    state.logs.append(f"🔁 Đang tạo lại slide {first}-{last}...")
+    yield
+
+    start = time.perf_counter()
+    executor = concurrent.futures.ThreadPoolExecutor()
+    try:
+        future = executor.submit(
+            regenerate_slides,
+            record["key"], first, last,
+            state.uploaded_file_bytes,
+            state.uploaded_mime_type,
+            api_key=os.environ.get("GOOGLE_API_KEY"),
+            api_keys=collect_api_keys(state),
+            instructions=state.regen_instructions,
+            cancel_check=check_cancel_signal
+        )
+        while not future.done():
+            if check_cancel_signal() or me.state(State).cancel_requested:
+                state.processing_status = "done"
+                state.logs.append("❌ Đã hủy tạo lại slide.")
+                yield
+                return
+            yield
+            await asyncio.sleep(0.1)
+        new_record = future.result()
+
+        # Unchanged slides come from the fast writer's and the preview's caches
+        render_deck(state, new_record["deck"], fast_writer=True)
+        state.stored_deck_key = new_record["key"]
+        state.notes_status = ""
+        state.logs.append(
+            f"✅ Đã tạo lại slide {first}-{last} trong {time.perf_counter() - start:.1f}s ({new_record['model']})."
+        )
+        state.processing_status = "done"
+    except Exception as ex:
+        safe_print(f"DEBUG REGENERATE EXCEPTION: {ex}")
+        state.processing_status = "done"
+        state.error_message = str(ex)
+        state.logs.append(f"Lỗi: {str(ex)}")
+    finally:
+        executor.shutdown(wait=False)
+    yield
+
 async def generate_slides(e: me.ClickEvent):
     state = me.state(State)
 
@@ -330,6 +571,12 @@ async def generate_slides(e: me.ClickEvent):
              state.logs.append("Warning: Source and Template are the same file!")
 
     state.logs.append("Đang phân tích tài liệu với Gemini...")
+    state.slide_previews = []
+    state.slide_preview_numbers = []
+    state.notes_status = ""
+    state.pptx_notes_content_base64 = ""
+    # Preview workers start while Gemini works, so thumbnails are ready right after the deck
+    slide_preview.warm_up()
     yield # Yield to update UI
     
     if state.cancel_requested or GLOBAL_CANCEL_FLAG:
@@ -367,6 +614,7 @@ async def generate_slides(e: me.ClickEvent):
         # Run AI task in a separate thread
         executor = concurrent.futures.ThreadPoolExecutor()
         cancel_check_lambda = lambda: GLOBAL_CANCEL_FLAG
+        progress_queue, report_progress = make_progress_reporter()
         try:
             future = executor.submit(
                 analyze_document,
@@ -376,7 +624,10 @@ async def generate_slides(e: me.ClickEvent):
                 api_keys=api_keys_list,
                 detail_level=detail_mode,
                 user_instructions=state.user_instructions,
-                cancel_check=cancel_check_lambda
+                cancel_check=cancel_check_lambda,
+                progress_callback=report_progress,
+                with_notes=not state.defer_notes,
+                compact_wire=state.compact_wire
             )
             
             # Poll loop
@@ -387,9 +638,11 @@ async def generate_slides(e: me.ClickEvent):
                     executor.shutdown(wait=False)
                     yield
                     return
+                drain_progress(progress_queue, state)
                 yield
                 await asyncio.sleep(0.1)
             
+            drain_progress(progress_queue, state)
             slide_json = future.result()
         finally:
             executor.shutdown(wait=False)
@@ -404,20 +657,55 @@ async def generate_slides(e: me.ClickEvent):
              yield
              return
         
-        # 2. Generate PPTX
-        pptx_io = create_pptx(slide_json, template_pptx_bytes=state.template_file_bytes if state.template_file_bytes else None)
-        pptx_bytes = pptx_io.read()
-        
-        # Prepare filename
-        original_name = state.uploaded_filename
-        name_no_ext = original_name.rsplit('.', 1)[0]
-        state.pptx_filename = f"{name_no_ext}_presentation.pptx"
-        
-        state.pptx_content_base64 = base64.b64encode(pptx_bytes).decode('utf-8')
+        # 2. Generate PPTX (+ preview thumbnails)
+        render_deck(state, slide_json)
         state.logs.append(f"Đã tạo xong file: {state.pptx_filename}")
         state.processing_status = "done"
         yield
 
+        # 3. Speaker notes after the download is available
+        refresh_stored_deck(state)
+        record = stored_deck(state) if state.defer_notes else None
+        if record is not None:
+            state.notes_status = "running"
+            state.logs.append("📝 Đang viết ghi chú thuyết trình (bản tải thứ hai)...")
+            yield
+            notes_executor = concurrent.futures.ThreadPoolExecutor()
+            try:
+                future = notes_executor.submit(
+                    fill_speaker_notes, record["key"],
+                    api_key=api_key_env,
+                    api_keys=api_keys_list,
+                    progress_callback=report_progress,
+                    cancel_check=check_cancel_signal
+                )
+                while not future.done():
+                    if check_cancel_signal() or me.state(State).cancel_requested:
+                        state.notes_status = ""
+                        state.logs.append("❌ Đã hủy viết ghi chú.")
+                        yield
+                        return
+                    drain_progress(progress_queue, state)
+                    yield
+                    await asyncio.sleep(0.1)
+                drain_progress(progress_queue, state)
+                notes_record = future.result()
+                state.stored_deck_key = notes_record["key"]
+                template_bytes = state.template_file_bytes if state.template_file_bytes else None
+                notes_pptx = create_pptx(notes_record["deck"], template_pptx_bytes=template_bytes, slim=state.slim_deck).read()
+                state.pptx_notes_filename = state.pptx_filename.replace("_presentation.pptx", "_presentation_notes.pptx")
+                state.pptx_notes_content_base64 = base64.b64encode(notes_pptx).decode('utf-8')
+                state.notes_status = "ready"
+                state.logs.append(f"📝 Ghi chú đã sẵn sàng: {state.pptx_notes_filename}")
+            except Exception as notes_error:
+                # The deck itself is fine: only the notes copy is missing
+                safe_print(f"DEBUG NOTES EXCEPTION: {notes_error}")
+                state.notes_status = "error"
+                state.logs.append(f"⚠️ Không tạo được ghi chú: {notes_error}")
+            finally:
+                notes_executor.shutdown(wait=False)
+            yield
+
     except Exception as ex:
         safe_print(f"DEBUG MAIN EXCEPTION: {ex}")
         state.processing_status = "error"
@@ -428,6 +716,33 @@ async def generate_slides(e: me.ClickEvent):
 
 
 
+REVIEW_LANGUAGE_CODES = {"Tiếng Việt": "vi", "English": "en", "Français": "fr", "日本語": "ja"}
+
+def review_languages(state: State) -> list[str]:
+    return state.review_languages or ["Tiếng Việt"]
+
+def store_review_pdfs(state: State, reviews: dict):
+    """PDF per review: the first language in pdf_filename/pdf_content_base64, the others in review_extra_pdfs."""
+    import tempfile
+    name_no_ext = state.uploaded_filename.rsplit('.', 1)[0]
+    state.review_extra_pdfs = {}
+    for i, (language, review_data) in enumerate(reviews.items()):
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+            tmp_path = tmp.name
+        final_path = save_summary_to_pdf(review_data, tmp_path)
+        with open(final_path, "rb") as f:
+            pdf_base64 = base64.b64encode(f.read()).decode('utf-8')
+        try:
+             os.remove(final_path)
+        except:
+             pass
+        if i == 0:
+            state.pdf_filename = f"{name_no_ext}_expert_review.pdf"
+            state.pdf_content_base64 = pdf_base64
+        else:
+            code = REVIEW_LANGUAGE_CODES.get(language, str(i + 1))
+            state.review_extra_pdfs[f"{name_no_ext}_expert_review_{code}.pdf"] = pdf_base64
+
 async def generate_review(e: me.ClickEvent):
     global GLOBAL_CANCEL_FLAG
     state = me.state(State)
@@ -481,13 +796,14 @@ async def generate_review(e: me.ClickEvent):
             cancel_check_lambda = check_cancel_signal
             
             future = executor.submit(
-                review_book_syntopic,
+                review_book_languages,
                 state.uploaded_file_bytes,
                 state.uploaded_mime_type,
+                review_languages(state),
                 api_key=api_key_env,
                 api_keys=api_keys_list,
-                language=state.review_language,
-                cancel_check=cancel_check_lambda
+                cancel_check=cancel_check_lambda,
+                reuse_analysis=not state.reanalyse_review
             )
             
             # Poll for completion or cancellation
@@ -504,12 +820,12 @@ async def generate_review(e: me.ClickEvent):
                 await asyncio.sleep(0.1)
             
             # Get result
-            review_data = future.result()
+            reviews = future.result()
         finally:
             executor.shutdown(wait=False)
 
-        if "used_model" in review_data:
-             state.logs.append(f"Model used: {review_data['used_model']}")
+        for language, review_data in reviews.items():
+             state.logs.append(f"Model used ({language}): {review_data['used_model']}")
              
         state.logs.append("Review hoàn tất. Đang tạo file PDF...")
         state.processing_status = "generating_pdf" # Re-use this status for PDF gen
@@ -522,28 +838,8 @@ async def generate_review(e: me.ClickEvent):
              yield
              return
         
-        # Generate PDF (Review style)
-        import tempfile
-        original_name = state.uploaded_filename
-        name_no_ext = original_name.rsplit('.', 1)[0]
-        pdf_out_name = f"{name_no_ext}_expert_review.pdf"
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp_path = tmp.name
-            
-        final_path = save_summary_to_pdf(review_data, tmp_path)
-        
-        with open(final_path, "rb") as f:
-            pdf_bytes = f.read()
-            
-        state.pdf_content_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
-        state.pdf_filename = pdf_out_name
-        
-        # Cleanup
-        try:
-             os.remove(final_path)
-        except:
-             pass
+        # Generate PDF (Review style), one per language
+        store_review_pdfs(state, reviews)
 
         state.logs.append(f"Đã tạo xong file: {state.pdf_filename}")
         state.processing_status = "review_done" # New Done State
@@ -555,6 +851,9 @@ async def generate_review(e: me.ClickEvent):
         state.error_message = f"{str(partial_ex)} (Có thể tiếp tục)"
         state.resume_data = partial_ex.partial_data
         state.logs.append(f"⚠️ Lỗi một phần: {str(partial_ex)}. Dữ liệu đã lưu để tiếp tục.")
+        finished = list((partial_ex.partial_data or {}).get("reviews") or {})
+        if finished:
+            state.logs.append(f"✅ Review đã xong ({', '.join(finished)}): không chạy lại khi tiếp tục.")
         yield
 
     except Exception as ex:
@@ -614,12 +913,12 @@ async def resume_review(e: me.ClickEvent):
             
             # PASS RESUME STATE HERE
             future = executor.submit(
-                review_book_syntopic,
+                review_book_languages,
                 state.uploaded_file_bytes,
                 state.uploaded_mime_type,
+                review_languages(state),
                 api_key=api_key_env,
                 api_keys=api_keys_list,
-                language=state.review_language,
                 cancel_check=cancel_check_lambda,
                 resume_state=state.resume_data # Pass the saved state
             )
@@ -634,12 +933,12 @@ async def resume_review(e: me.ClickEvent):
                 yield
                 await asyncio.sleep(0.1)
             
-            review_data = future.result()
+            reviews = future.result()
         finally:
             executor.shutdown(wait=False)
 
-        if "used_model" in review_data:
-             state.logs.append(f"Model used: {review_data['used_model']}")
+        for language, review_data in reviews.items():
+             state.logs.append(f"Model used ({language}): {review_data['used_model']}")
              
         state.logs.append("Review hoàn tất. Đang tạo file PDF...")
         state.processing_status = "generating_pdf"
@@ -651,27 +950,8 @@ async def resume_review(e: me.ClickEvent):
              yield
              return
         
-        # Generate PDF
-        import tempfile
-        original_name = state.uploaded_filename
-        name_no_ext = original_name.rsplit('.', 1)[0]
-        pdf_out_name = f"{name_no_ext}_expert_review.pdf"
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp_path = tmp.name
-            
-        final_path = save_summary_to_pdf(review_data, tmp_path)
-        
-        with open(final_path, "rb") as f:
-            pdf_bytes = f.read()
-            
-        state.pdf_content_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
-        state.pdf_filename = pdf_out_name
-        
-        try:
-             os.remove(final_path)
-        except:
-             pass
+        # Generate PDF, one per language
+        store_review_pdfs(state, reviews)
 
         state.logs.append(f"Đã tạo xong file: {state.pdf_filename}")
         state.processing_status = "review_done"
@@ -683,6 +963,9 @@ async def resume_review(e: me.ClickEvent):
         state.error_message = f"{str(partial_ex)} (Có thể tiếp tục)"
         state.resume_data = partial_ex.partial_data # Update progress even if failed again
         state.logs.append(f"⚠️ Lại gặp lỗi: {str(partial_ex)}. Đã cập nhật điểm dừng.")
+        finished = list((partial_ex.partial_data or {}).get("reviews") or {})
+        if finished:
+            state.logs.append(f"✅ Review đã xong ({', '.join(finished)}): không chạy lại khi tiếp tục.")
         yield
 
     except Exception as ex:
@@ -866,6 +1149,21 @@ def main_page():
                         "Nếu chọn: Tạo nhiều slide hơn, nội dung sâu hơn. Mặc định: Tổng quan ngắn gọn.", 
                         style=me.Style(font_size=12, color="#64748b", margin=me.Margin(top=4, left=32))
                     )
+                    me.checkbox(
+                        label="Viết ghi chú thuyết trình sau (tải slide nhanh hơn)",
+                        checked=state.defer_notes,
+                        on_change=on_defer_notes_change,
+                    )
+                    me.checkbox(
+                        label="Định dạng phản hồi rút gọn (ít token hơn, nhanh hơn)",
+                        checked=state.compact_wire,
+                        on_change=on_compact_wire_change,
+                    )
+                    me.checkbox(
+                        label="Giảm dung lượng file (bỏ các layout mẫu không dùng)",
+                        checked=state.slim_deck,
+                        on_change=on_slim_deck_change,
+                    )
 
                 # Advanced API Key Section
                 with me.box(style=me.Style(width="100%", margin=me.Margin(top=24), padding=me.Padding.all(16), background="#f8fafc", border_radius=8, border=me.Border.all(me.BorderSide(width=1, color="#e2e8f0")))):
@@ -922,6 +1220,15 @@ def main_page():
                             z_index=10, # Force text to top
                         )
                     )
+
+                # Re-render Button: stored deck + current template, no Gemini call
+                if not is_loading and state.stored_deck_key:
+                    me.button(
+                        "♻️ Xuất lại với template hiện tại (không gọi AI)",
+                        on_click=rerender_slides,
+                        type="stroked",
+                        style=me.Style(width="100%", margin=me.Margin(top=8)),
+                    )
                 
                 # Summary Button Logic
                 su_bg = "transparent"
@@ -962,15 +1269,27 @@ def main_page():
                 with me.box(style=me.Style(margin=me.Margin(top=16))):
                     me.text("Ngôn ngữ Review:", style=me.Style(font_size=12, color="#64748b", margin=me.Margin(bottom=4)))
                     me.select(
-                        label="Chọn ngôn ngữ",
+                        label="Chọn ngôn ngữ (có thể chọn nhiều)",
                         options=[
                             me.SelectOption(label="Tiếng Việt (Vietnamese)", value="Tiếng Việt"),
                             me.SelectOption(label="Tiếng Anh (English)", value="English"),
+                            me.SelectOption(label="Tiếng Pháp (Français)", value="Français"),
+                            me.SelectOption(label="Tiếng Nhật (日本語)", value="日本語"),
                         ],
-                        value=state.review_language,
+                        value=state.review_languages,
+                        multiple=True,
                         on_selection_change=on_language_change,
                         style=me.Style(width="100%")
                     )
+                    me.text(
+                        "Đổi hoặc thêm ngôn ngữ cho cùng tài liệu: chỉ chạy lại bước Editor.",
+                        style=me.Style(font_size=12, color="#64748b", margin=me.Margin(top=4))
+                    )
+                    me.checkbox(
+                        label="Phân tích lại từ đầu (không dùng kết quả phân tích đã lưu)",
+                        checked=state.reanalyse_review,
+                        on_change=on_reanalyse_review_change,
+                    )
 
                 with me.box(
                     on_click=generate_review if not is_disabled else None,
@@ -1146,7 +1465,73 @@ def main_page():
                             'Download PowerPoint'
                             '</a>'
                         )
-                        
+
+                        # Second download: same deck with speaker notes, written after the first
+                        if state.notes_status == "running":
+                            me.text("📝 Đang viết ghi chú thuyết trình...", style=me.Style(font_size=13, color="#065f46"))
+                        elif state.notes_status == "ready" and state.pptx_notes_content_base64:
+                            notes_uri = f"data:application/vnd.openxmlformats-officedocument.presentationml.presentation;base64,{state.pptx_notes_content_base64}"
+                            me.html(
+                                f'<a href="{notes_uri}" download="{state.pptx_notes_filename}" '
+                                'style="display: inline-block; color: #0284c7; border: 1px solid #0284c7; '
+                                'padding: 10px 20px; text-decoration: none; border-radius: 8px; font-weight: 600; font-family: Inter, sans-serif;">'
+                                'Download PowerPoint (kèm ghi chú)'
+                                '</a>'
+                            )
+
+                        # Slide thumbnails: check the layout without opening PowerPoint
+                        if state.slide_previews:
+                            with me.box(
+                                style=me.Style(
+                                    display="grid",
+                                    grid_template_columns="repeat(auto-fill, minmax(220px, 1fr))",
+                                    gap=12,
+                                    width="100%",
+                                    max_height=560,
+                                    overflow_y="auto",
+                                )
+                            ):
+                                for index, preview in enumerate(state.slide_previews):
+                                    label = preview_label(state, index)
+                                    with me.box(style=me.Style(display="flex", flex_direction="column", gap=4)):
+                                        me.image(
+                                            src=f"data:image/png;base64,{preview}",
+                                            alt=label,
+                                            style=me.Style(
+                                                width="100%",
+                                                border=me.Border.all(me.BorderSide(width=1, color="#cbd5e1")),
+                                                border_radius=4,
+                                            ),
+                                        )
+                                        me.text(label, style=me.Style(font_size=12, color="#475569"))
+
+                        # Slide regeneration: rewrite a weak slide without regenerating the deck
+                        if state.stored_deck_key:
+                            with me.box(style=me.Style(display="flex", flex_direction="column", gap=8, width="100%", text_align="left")):
+                                me.text(
+                                    "Tạo lại một vài slide (dùng số ghi dưới ảnh xem trước; slide \"(tiếp)\" thuộc slide gốc của nó):",
+                                    style=me.Style(font_size=13, color="#065f46"),
+                                )
+                                me.input(
+                                    label="Slide cần tạo lại (ví dụ: 3 hoặc 3-5)",
+                                    value=state.regen_range,
+                                    on_blur=handle_regen_range,
+                                    style=me.Style(width="100%"),
+                                )
+                                me.textarea(
+                                    label="Yêu cầu chỉnh sửa (Tùy chọn)",
+                                    placeholder="Ví dụ: Thêm số liệu cụ thể, viết ngắn gọn hơn...",
+                                    value=state.regen_instructions,
+                                    on_blur=handle_regen_instructions,
+                                    rows=2,
+                                    style=me.Style(width="100%"),
+                                )
+                                me.button(
+                                    "🔁 Tạo lại slide",
+                                    on_click=regenerate_slide_range,
+                                    type="stroked",
+                                )
+
                         me.button(
                             "Create Another",
                             on_click=lambda e: setattr(state, "processing_status", "idle"),
@@ -1212,6 +1597,14 @@ def main_page():
                             'Download Review PDF'
                             '</a>'
                         )
+                        for extra_name, extra_base64 in state.review_extra_pdfs.items():
+                            me.html(
+                                f'<a href="data:application/pdf;base64,{extra_base64}" download="{extra_name}" '
+                                'style="display: inline-block; background-color: white; color: #7c3aed; border: 1px solid #7c3aed; '
+                                'padding: 10px 20px; text-decoration: none; border-radius: 8px; font-weight: 600; font-family: Inter, sans-serif;">'
+                                f'Download {extra_name}'
+                                '</a>'
+                            )
                         
                         me.button(
                             "Start Over",
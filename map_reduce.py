@@ -0,0 +1,339 @@
+import re
+import time
+import bisect
+import concurrent.futures
+from collections import namedtuple
+from google.genai import types
+from utils import safe_print
+from ai_engine import generate_content_v2, rotate_keys, robust_json_parse, ROBUST_MODEL_LIST
+from document_loader import StructuredDocument
+from text_normalizer import estimate_tokens, CHARS_PER_TOKEN
+from cache_store import cache_get, cache_put, content_hash
+from stage_profiles import stage_config, get_profile
+
+# Map-reduce mode for documents that do not fit (or degrade) in one request.
+# MAP: each content-defined chunk is condensed into notes, concurrently across the key pool.
+# Map results are cached by chunk hash, so re-summarizing an edited document only re-runs changed chunks.
+# The "map" stage profile is part of the key, and notes written by a fallback model (not the first of
+# the profile's models) are not stored, so a rate-limited run does not pin lower-quality notes.
+# REDUCE: notes are merged in groups until they fit, then the existing single-shot prompts
+# (standard summary / deep dive) run on the notes instead of the raw book.
+# Text formats only (DOCX/EPUB/TXT): PDFs are attached to the prompt whole and never chunked.
+
+# Above this many input tokens the summarizers switch to map-reduce automatically
+MAP_REDUCE_THRESHOLD_TOKENS = 200_000
+# Maximum size of one map chunk (min/avg default to 1/4 and 1/2 of it)
+MAP_CHUNK_TOKENS = 40_000
+# Content-defined chunking: the gear hash only looks at the last GEAR_WINDOW characters
+GEAR_WINDOW = 32
+# Typical paragraph length, used to turn the average chunk size into a fixed cut mask
+ASSUMED_PARAGRAPH_CHARS = 400
+# Cache namespace for per-chunk map results (keyed by chunk text hash)
+MAP_CACHE_NAMESPACE = "map_chunks"
+REDUCE_CACHE_NAMESPACE = "reduce_groups"
+# Notes are reduced hierarchically until they fit in this budget
+REDUCE_TARGET_TOKENS = 60_000
+# How many notes one reduce call merges
+REDUCE_FAN_IN = 8
+# Upper bound on parallel calls, whatever the number of keys
+MAX_CONCURRENCY_CAP = 8
+
+Chunk = namedtuple("Chunk", ["index", "title", "text"])
+
+MAP_PROMPT = """
+Bạn đang đọc PHẦN {index}/{total} của một tài liệu dài ({title}).
+Hãy ghi chú lại nội dung của phần này để dùng cho bước tổng hợp sau.
+
+Trả về JSON hợp lệ:
+{{
+  "summary": "Tóm tắt phần này (80-150 từ)",
+  "key_points": ["Ý chính 1", "Ý chính 2", "..."],
+  "quotes": ["Trích dẫn nguyên văn đắt giá (tối đa 3)"]
+}}
+
+Yêu cầu: Tiếng Việt (trừ trích dẫn giữ nguyên văn), không bịa thông tin, không bỏ sót số liệu quan trọng.
+"""
+
+REDUCE_PROMPT = """
+Dưới đây là các ghi chú của {count} phần liên tiếp trong một tài liệu dài.
+Hãy gộp chúng thành MỘT ghi chú duy nhất, giữ nguyên trình tự, loại bỏ trùng lặp nhưng không bỏ sót ý quan trọng.
+
+Trả về JSON hợp lệ:
+{{
+  "summary": "Tóm tắt gộp (150-300 từ)",
+  "key_points": ["Ý chính 1", "..."],
+  "quotes": ["Trích dẫn hay nhất (tối đa 5)"]
+}}
+"""
+
+
+def default_concurrency(api_keys: list[str]) -> int:
+    """One worker per unique key (capped): wall-clock scales down with the key pool."""
+    return max(1, min(len(rotate_keys(api_keys, 0)), MAX_CONCURRENCY_CAP))
+
+
+def should_map_reduce(text: str) -> bool:
+    return estimate_tokens(text) > MAP_REDUCE_THRESHOLD_TOKENS
+
+
+def _split_long_text(text: str, max_chars: int) -> list[str]:
+    """Splits an oversized section on paragraph (then line) boundaries."""
+    pieces = []
+    current = []
+    current_len = 0
+    for paragraph in text.split('\n'):
+        # A single giant paragraph is hard-split as a last resort
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                pieces.append('\n'.join(current))
+                current, current_len = [], 0
+            pieces.append(paragraph[:cut])
+            paragraph = paragraph[cut:].lstrip()
+        if current and current_len + len(paragraph) + 1 > max_chars:
+            pieces.append('\n'.join(current))
+            current, current_len = [], 0
+        current.append(paragraph)
+        current_len += len(paragraph) + 1
+    if current:
+        pieces.append('\n'.join(current))
+    return [p for p in pieces if p.strip()]
+
+
+def _gear_table() -> list[int]:
+    # Fixed pseudo-random table (deterministic across runs/machines)
+    table = []
+    value = 0x9E3779B9
+    for _ in range(256):
+        value = (value * 1103515245 + 12345) & 0xFFFFFFFF
+        table.append(value)
+    return table
+
+GEAR = _gear_table()
+
+
+def _gear_hash(text: str, end: int) -> int:
+    """
+    Gear rolling hash at position end. With a 32-bit left shift, characters older
+    than GEAR_WINDOW positions have shifted out, so only the local window matters.
+    """
+    h = 0
+    for ch in text[max(0, end - GEAR_WINDOW):end]:
+        h = ((h << 1) + GEAR[ord(ch) & 0xFF]) & 0xFFFFFFFF
+    return h
+
+
+def _cut_mask(min_chars: int, avg_chars: int) -> int:
+    # Probability of a cut per paragraph break ~ ASSUMED_PARAGRAPH_CHARS / (avg - min).
+    # Derived from constants only, so an edit never changes the mask for the whole document.
+    ratio = max(1, (avg_chars - min_chars) // ASSUMED_PARAGRAPH_CHARS)
+    return (1 << max(0, ratio.bit_length() - 1)) - 1
+
+
+def _chunk_title(doc: StructuredDocument, start: int, end: int, index: int) -> str:
+    first = max(0, bisect.bisect_right(doc.starts, start) - 1)
+    last = max(0, bisect.bisect_right(doc.starts, max(start, end - 1)) - 1)
+    titles = [doc.titles[i] for i in range(first, min(last + 1, len(doc))) if doc.titles[i]]
+    if not titles:
+        return f"Phần {index + 1}"
+    if len(titles) == 1:
+        return titles[0]
+    return f"{titles[0]} → {titles[-1]}"
+
+
+def chunk_document(doc: StructuredDocument, max_tokens: int = MAP_CHUNK_TOKENS,
+                   min_tokens: int | None = None, avg_tokens: int | None = None) -> list[Chunk]:
+    """
+    Content-defined chunking over the document text.
+    Candidate cut points are paragraph breaks; a cut happens once the chunk has
+    min_tokens and either a top-level section starts there or the gear hash of the
+    preceding text matches the mask. Boundaries therefore depend only on local content:
+    editing a few pages changes the chunks around the edit, not the whole book.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    min_chars = (min_tokens * CHARS_PER_TOKEN) if min_tokens else max_chars // 4
+    avg_chars = (avg_tokens * CHARS_PER_TOKEN) if avg_tokens else max_chars // 2
+    mask = _cut_mask(min_chars, avg_chars)
+    text = doc.text
+
+    section_starts = {doc.starts[i] for i in range(len(doc)) if doc.levels[i] <= 1}
+    candidates = sorted(set(m.end() for m in re.finditer(r'\n+', text)) | section_starts)
+
+    spans = []
+    start = 0
+    last_candidate = 0
+    for pos in candidates:
+        if pos <= start or pos >= len(text):
+            continue
+        if pos - start > max_chars:
+            # Too long without a content-defined cut: fall back to the last paragraph break
+            cut = last_candidate if last_candidate - start >= min_chars else pos
+            spans.append((start, cut))
+            start = cut
+        length = pos - start
+        if length >= min_chars and (pos in section_starts or (_gear_hash(text, pos) & mask) == 0):
+            spans.append((start, pos))
+            start = pos
+        last_candidate = pos
+    if start < len(text):
+        spans.append((start, len(text)))
+
+    chunks = []
+    for span_start, span_end in spans:
+        piece = text[span_start:span_end].strip()
+        if not piece:
+            continue
+        title = _chunk_title(doc, span_start, span_end, len(chunks))
+        # A single paragraph larger than max_chars is hard-split as a last resort
+        pieces = [piece] if len(piece) <= max_chars else _split_long_text(piece, max_chars)
+        for j, sub in enumerate(pieces):
+            label = title if len(pieces) == 1 else f"{title} ({j + 1})"
+            chunks.append(Chunk(len(chunks), label, sub))
+    return chunks
+
+
+def _notes_from_response(text: str) -> dict:
+    try:
+        data = robust_json_parse(text)
+        if isinstance(data, list):
+            data = data[0] if data and isinstance(data[0], dict) else {"summary": str(data)}
+        return data
+    except Exception:
+        # Keep whatever the model wrote rather than losing the chunk
+        return {"summary": text.strip(), "key_points": [], "quotes": []}
+
+
+def format_notes(notes: list[dict]) -> str:
+    """Renders notes as compact Markdown for the next prompt."""
+    blocks = []
+    for note in notes:
+        lines = [f"### {note.get('label', '')}".rstrip()]
+        if note.get("summary"):
+            lines.append(str(note["summary"]))
+        for point in note.get("key_points") or []:
+            lines.append(f"- {point}")
+        for quote in note.get("quotes") or []:
+            lines.append(f"> {quote}")
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+
+def _item_label(item, i: int) -> str:
+    if isinstance(item, str):
+        return item
+    title = item.get("title") if isinstance(item, dict) else getattr(item, "title", None)
+    return title or f"#{i + 1}"
+
+
+def run_parallel(items, worker, max_concurrency: int, stage: str, progress_callback=None, cancel_check=None,
+                 deadline: float | None = None, return_exceptions: bool = False) -> list:
+    """
+    Runs worker(i, item) for all items with bounded concurrency, preserving order.
+    progress_callback(stage, done, total, label) is called as each item finishes.
+    deadline: time.monotonic() value; items unfinished by then stay None (calls in flight
+        finish in the background and their results are dropped).
+    return_exceptions: a failed item's exception is stored in its slot instead of raised,
+        so one failure does not cost the other items.
+    """
+    total = len(items)
+    results = [None] * total
+    if total == 0:
+        return results
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, total)))
+    futures = {executor.submit(worker, i, item): i for i, item in enumerate(items)}
+    pending = set(futures)
+    done = 0
+    try:
+        while pending:
+            if cancel_check and cancel_check():
+                raise ValueError("Operation cancelled by user.")
+            timeout = 0.5 if deadline is None else min(0.5, deadline - time.monotonic())
+            if timeout <= 0:
+                safe_print(f"⏱️ {stage} deadline reached: {len(pending)}/{total} unfinished.")
+                break
+            finished, pending = concurrent.futures.wait(pending, timeout=timeout,
+                                                        return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                i = futures[future]
+                label = _item_label(items[i], i)
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    safe_print(f"⚠️ {stage} {label} failed: {e}")
+                    results[i] = e
+                done += 1
+                safe_print(f"🧩 {stage} {done}/{total} done: {label}")
+                if progress_callback:
+                    progress_callback(stage, done, total, label)
+    finally:
+        # Drops queued items on error, cancel or deadline; calls already running are not waited for
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def condense_document(doc: StructuredDocument, api_keys: list[str], max_concurrency: int | None = None,
+                      progress_callback=None, cancel_check=None, generate_fn=None,
+                      chunk_tokens: int = MAP_CHUNK_TOKENS, use_cache: bool = True) -> str:
+    """
+    Map + hierarchical reduce over a structured document.
+    With use_cache, map (and reduce) results are reused for chunks whose text is unchanged.
+    Returns: Markdown notes covering the whole document, small enough for one final prompt.
+    """
+    generate_fn = generate_fn or generate_content_v2
+    concurrency = max_concurrency or default_concurrency(api_keys)
+    chunks = chunk_document(doc, chunk_tokens)
+    total = len(chunks)
+    safe_print(f"Map-Reduce: {total} chunks, concurrency={concurrency}, keys={len(rotate_keys(api_keys, 0))}")
+
+    config, models = stage_config("map", response_mime_type="application/json")
+    preferred = models or ROBUST_MODEL_LIST
+    profile_key = repr(tuple(get_profile("map")))
+    stats = {"hits": 0, "misses": 0}
+
+    def cached_call(namespace, cache_key, i, parts):
+        if use_cache:
+            cached = cache_get(namespace, cache_key)
+            if cached is not None:
+                stats["hits"] += 1
+                return dict(cached)
+        if cancel_check and cancel_check():
+            raise ValueError("Operation cancelled by user.")
+        text, model_name = generate_fn(rotate_keys(api_keys, i), parts, config, model_list=models, cancel_check=cancel_check)
+        note = _notes_from_response(text)
+        stats["misses"] += 1
+        if use_cache and model_name not in preferred[1:]:
+            cache_put(namespace, cache_key, note)
+        return dict(note)
+
+    def map_chunk(i, chunk):
+        prompt = MAP_PROMPT.format(index=i + 1, total=total, title=chunk.title)
+        parts = [types.Part.from_text(text=f"Content:\n{chunk.text}"), types.Part.from_text(text=prompt)]
+        # Position in the book does not change the notes: key on the profile and chunk text only
+        note = cached_call(MAP_CACHE_NAMESPACE, content_hash(profile_key + MAP_PROMPT + chunk.text), i, parts)
+        note["label"] = f"[Phần {i + 1}] {chunk.title}"
+        return note
+
+    notes = run_parallel(chunks, map_chunk, concurrency, "Map", progress_callback, cancel_check)
+    safe_print(f"Map cache: {stats['hits']} reused, {stats['misses']} generated.")
+
+    # Hierarchical reduce until the notes fit one final prompt
+    level = 1
+    while len(notes) > 1 and estimate_tokens(format_notes(notes)) > REDUCE_TARGET_TOKENS:
+        groups = [notes[g:g + REDUCE_FAN_IN] for g in range(0, len(notes), REDUCE_FAN_IN)]
+        group_items = [Chunk(g, f"{group[0]['label']} … {group[-1]['label']}", format_notes(group)) for g, group in enumerate(groups)]
+
+        def reduce_group(i, item):
+            prompt = REDUCE_PROMPT.format(count=len(groups[i]))
+            parts = [types.Part.from_text(text=f"Notes:\n{item.text}"), types.Part.from_text(text=prompt)]
+            note = cached_call(REDUCE_CACHE_NAMESPACE, content_hash(profile_key + prompt + item.text), i, parts)
+            note["label"] = f"[Nhóm {i + 1}/{len(groups)}]"
+            return note
+
+        notes = run_parallel(group_items, reduce_group, concurrency, f"Reduce L{level}", progress_callback, cancel_check)
+        level += 1
+
+    return format_notes(notes)
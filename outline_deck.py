@@ -0,0 +1,165 @@
+from collections import namedtuple
+from google.genai import types
+from utils import safe_print
+from ai_engine import generate_content_v2, rotate_keys, robust_json_parse
+from map_reduce import run_parallel, default_concurrency
+from document_loader import StructuredDocument
+from section_retrieval import match_sections, build_focused_text, get_section_index, Selection
+from wire_format import expand_deck
+from stage_profiles import stage_config
+
+# Outline-first generation for detailed ("Chi tiết") decks.
+# One long call writing every slide hits the output-token limit and keeps all generation on
+# one request. Instead, a short call plans the deck as sections, then each section's slides
+# are written concurrently across the key pool (run_parallel, bounded concurrency) and the
+# results are merged back in outline order into the usual {"title", "slides"} structure.
+# For DOCX/EPUB each section call only receives the document sections that match it.
+#
+# Input cost: without a structured document (PDFs, or text the user already focused) every
+# section call re-sends the whole source, so the input is (sections + 1) x the source tokens.
+# Automatic outline mode is therefore text-only, and whole-source runs (outline_first=True on a
+# PDF) are capped at MAX_WHOLE_SOURCE_SECTIONS: at most 5x the single-call input.
+
+# Below this many prompt tokens a single call is fast enough and keeps the deck most coherent
+OUTLINE_MIN_TOKENS = 8_000
+# Bounds on the planned outline
+MAX_OUTLINE_SECTIONS = 16
+MAX_WHOLE_SOURCE_SECTIONS = 4
+MAX_SLIDES_PER_SECTION = 12
+# Document sections (best BM25 matches) sent with each section call
+SECTION_SOURCE_SECTIONS = 6
+
+Section = namedtuple("Section", ["index", "title", "summary", "slide_count"])
+
+OUTLINE_INSTRUCTION = """
+Bạn là chuyên gia thiết kế bài thuyết trình. Hãy lập DÀN Ý cho một bài thuyết trình chi tiết từ tài liệu.
+Chưa viết nội dung slide. Chia bài thành các phần theo trình tự của tài liệu, bao phủ toàn bộ ý quan trọng.
+
+Trả về JSON hợp lệ:
+{
+  "title": "TÊN BÀI THUYẾT TRÌNH (VIẾT HOA)",
+  "sections": [
+    {"title": "Tên phần", "summary": "Phần này trình bày gì (1-2 câu, nêu các ý chính)", "slide_count": 4}
+  ]
+}
+"""
+
+OUTLINE_PROMPT = "Hãy lập dàn ý (tối đa {max_sections} phần, mỗi phần 2-{max_slides} slide) cho bài thuyết trình chi tiết."
+
+SECTION_PROMPT = """
+Bài thuyết trình "{deck_title}" gồm các phần:
+{outline}
+
+Hãy viết các slide cho PHẦN {number}: "{title}" ({summary}).
+- Khoảng {slide_count} slide, chỉ nội dung của phần này (các phần khác do người khác viết).
+"""
+
+# Appended to the slide rules (ai_engine.SYSTEM_INSTRUCTION) for section calls, in place of the
+# whole-deck instructions (detail level, "every idea of the document", deck title)
+SECTION_INSTRUCTION = """
+CHẾ ĐỘ VIẾT THEO PHẦN (thay cho các yêu cầu về cả bài ở trên):
+- Bạn chỉ viết slide cho MỘT phần trong dàn ý; các phần khác được viết song song.
+- KHÔNG tạo slide tiêu đề, giới thiệu, mục lục hay kết luận của cả bài.
+- "Tất cả các ý quan trọng" là các ý của phần này: đi sâu vào nội dung, số liệu, ví dụ của phần.
+- Trả về JSON {"slides": [...]} chỉ gồm các slide của phần này, không cần tên bài.
+"""
+
+
+def should_use_outline(mime_type: str, prompt_tokens: int | None) -> bool:
+    """
+    Text documents above OUTLINE_MIN_TOKENS. Never PDFs: every section call would re-attach
+    the whole file (pass outline_first=True to accept that, capped at MAX_WHOLE_SOURCE_SECTIONS).
+    """
+    if mime_type == "application/pdf":
+        return False
+    return prompt_tokens is not None and prompt_tokens >= OUTLINE_MIN_TOKENS
+
+
+def parse_outline(text: str, max_sections: int = MAX_OUTLINE_SECTIONS) -> tuple[str, list[Section]]:
+    """(deck title, sections) from the outline response; sections without a title are dropped."""
+    data = robust_json_parse(text)
+    if isinstance(data, list):
+        data = {"sections": data}
+    sections = []
+    for raw in (data.get("sections") or [])[:max_sections]:
+        if not isinstance(raw, dict) or not str(raw.get("title", "")).strip():
+            continue
+        try:
+            slide_count = int(raw.get("slide_count") or 3)
+        except (TypeError, ValueError):
+            slide_count = 3
+        slide_count = max(1, min(slide_count, MAX_SLIDES_PER_SECTION))
+        sections.append(Section(len(sections), str(raw["title"]).strip(), str(raw.get("summary", "")).strip(), slide_count))
+    if not sections:
+        raise ValueError("Dàn ý trống: AI không trả về phần nào.")
+    return str(data.get("title") or "Bài thuyết trình AI"), sections
+
+
+def _section_parts(section: Section, source_parts: list, document: StructuredDocument | None) -> list:
+    """The source for one section call: its matching document sections, else the whole source."""
+    if document is not None and len(document) > 1:
+        indices = match_sections(document, f"{section.title} {section.summary}", SECTION_SOURCE_SECTIONS)
+        if indices:
+            focused = build_focused_text(document, Selection(indices, "outline section"))
+            return [types.Part.from_text(text=f"Nội dung tài liệu:\n{focused}")]
+    return list(source_parts)
+
+
+def _slides_from_response(text: str) -> list[dict]:
+    """Slides of one section call, in either wire format (compact arrays are expanded)."""
+    data = robust_json_parse(text)
+    if isinstance(data, dict) and "slides" not in data and "s" not in data:
+        raise ValueError("Lỗi đọc dữ liệu từ AI: phần không có danh sách slide.")
+    return expand_deck(data)["slides"]
+
+
+def generate_outlined_deck(api_keys: list[str], source_parts: list, section_instruction: str,
+                           document: StructuredDocument | None = None, max_concurrency: int | None = None,
+                           progress_callback=None, cancel_check=None, generate_fn=None) -> tuple[dict, str]:
+    """
+    Outline call, then one call per section in parallel.
+    source_parts: the document as analyze_document would send it (PDF part or text part).
+    section_instruction: system instruction for the section calls (slide rules + SECTION_INSTRUCTION).
+    document: the structured text document, to give each section call only its sections. None
+        (PDF, focused text) sends source_parts with every call, over at most MAX_WHOLE_SOURCE_SECTIONS sections.
+    Returns: ({"title", "slides"}, model), model naming every model that contributed.
+    """
+    generate_fn = generate_fn or generate_content_v2
+    concurrency = max_concurrency or default_concurrency(api_keys)
+    max_sections = MAX_OUTLINE_SECTIONS if document is not None and len(document) > 1 else MAX_WHOLE_SOURCE_SECTIONS
+
+    outline_config, outline_models = stage_config("outline", system_instruction=OUTLINE_INSTRUCTION,
+                                                  response_mime_type="application/json")
+    outline_text, outline_model = generate_fn(
+        api_keys,
+        list(source_parts) + [types.Part.from_text(
+            text=OUTLINE_PROMPT.format(max_sections=max_sections, max_slides=MAX_SLIDES_PER_SECTION))],
+        outline_config,
+        model_list=outline_models,
+        cancel_check=cancel_check,
+    )
+    deck_title, sections = parse_outline(outline_text, max_sections)
+    planned = sum(s.slide_count for s in sections)
+    safe_print(f"🗂️ Outline: {len(sections)} sections, ~{planned} slides, concurrency={concurrency}")
+    if progress_callback:
+        progress_callback("Outline", 1, 1, f"{len(sections)} phần, ~{planned} slide")
+
+    outline = "\n".join(f"{s.index + 1}. {s.title}" for s in sections)
+    if document is not None and len(document) > 1:
+        # Built once here, not by every section worker at the same time
+        get_section_index(document)
+    config, models = stage_config("slides", system_instruction=section_instruction, response_mime_type="application/json")
+
+    def write_section(i, section):
+        if cancel_check and cancel_check():
+            raise ValueError("Operation cancelled by user.")
+        prompt = SECTION_PROMPT.format(deck_title=deck_title, outline=outline, number=i + 1, title=section.title,
+                                       summary=section.summary or "theo dàn ý", slide_count=section.slide_count)
+        parts = _section_parts(section, source_parts, document) + [types.Part.from_text(text=prompt)]
+        text, model = generate_fn(rotate_keys(api_keys, i), parts, config, model_list=models, cancel_check=cancel_check)
+        return _slides_from_response(text), model
+
+    results = run_parallel(sections, write_section, concurrency, "Slides", progress_callback, cancel_check)
+    slides = [slide for section_slides, _ in results for slide in section_slides]
+    models = [outline_model] + [model for _, model in results]
+    return {"title": deck_title, "slides": slides}, "+".join(dict.fromkeys(m for m in models if m))
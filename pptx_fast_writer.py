@@ -0,0 +1,261 @@
+import re
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from xml.sax.saxutils import escape
+from lxml import etree
+import pptx
+from pptx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from pptx.opc.oxml import serialize_part_xml
+from pptx.opc.package import Part, _Relationships
+from pptx.opc.packuri import PackURI
+from pptx.oxml import parse_xml
+from pptx.oxml.presentation import CT_SlideIdList
+from pptx.oxml.slide import CT_NotesSlide
+from pptx.oxml.simpletypes import ST_TextSpacingPoint
+from pptx.shapes.shapetree import SlideShapeFactory
+from pptx.slide import NotesSlide
+from pptx.util import Pt
+from utils import safe_print
+from cache_store import content_hash
+from slide_engine import (
+    PreparedTemplate, LayoutPlan, fill_content_slide, measure_content_slide, clean_slide_title,
+    paragraph_spacing, markdown_runs, write_slide_notes, TITLE_LEFT, TITLE_TOP, BODY_SIDE_MARGIN, TITLE_BODY_GAP,
+)
+
+# Streaming writer for very large decks (500+ slides from "Chi tiết" mode).
+# Each content slide is a lightweight part whose XML is produced only when the package
+# writes it into the zip, by splicing strings into the layout's precompiled empty slide
+# (PreparedTemplate.content_slide_xml). No python-pptx Slide/Shape objects are built.
+#
+# The string builder mirrors what fill_content_slide writes through python-pptx. It is
+# checked against it once per template on a probe slide; slides it cannot express
+# (control characters, empty title or bullets) are rendered through fill_content_slide.
+# Rendered XML is kept per template by slide content, so re-saving a deck after a few slides
+# were regenerated only renders those slides. Speaker notes are streamed the same way, from
+# the empty notes page python-pptx would clone from the notes master.
+
+# add_content_slides uses python-pptx internals (CT_SlideIdList._next_id/_add_sldId,
+# _Relationships._add_relationship). requirements.txt pins the tested range; on any other
+# version create_pptx falls back to prs.slides.add_slide.
+TESTED_PPTX_VERSIONS = ((1, 0),)
+
+TITLE_MARKER = "SLIDEGENIUS_TITLE"
+BODY_MARKER = "SLIDEGENIUS_BODY"
+# Text python-pptx would escape or split (line breaks, tabs, other control characters)
+UNSAFE_TEXT_RE = re.compile(r'[\x00-\x1f\x7f]')
+
+PROBE_SLIDE = {
+    "title": "Slide 1: Kiểm tra <mẫu> & bố cục",
+    "content": ["Một câu **in đậm** ở giữa", "**Mở đầu đậm** rồi thường", "Câu thường"],
+}
+
+# Rendered slides kept per template
+RENDER_CACHE_SIZE = 4096
+
+BOLD_RUN_PROPS = '<a:rPr b="1"><a:solidFill><a:srgbClr val="0070C0"/></a:solidFill></a:rPr>'
+
+
+def _xfrm(x, y, cx, cy) -> str:
+    return f'<a:xfrm><a:off x="{int(x)}" y="{int(y)}"/><a:ext cx="{int(cx)}" cy="{int(cy)}"/></a:xfrm>'
+
+
+def _title_xml(clean_title: str, title_height, plan: LayoutPlan) -> str:
+    return (
+        f'<p:spPr>{_xfrm(TITLE_LEFT, TITLE_TOP, plan.title_width, title_height)}</p:spPr>'
+        '<p:txBody><a:bodyPr wrap="square" anchor="t" tIns="0" bIns="0"><a:normAutofit/></a:bodyPr><a:lstStyle/>'
+        f'<a:p><a:pPr algn="l"><a:defRPr sz="{Pt(plan.title_font_pt).centipoints}" b="1"/></a:pPr>'
+        f'<a:r><a:t>{escape(clean_title)}</a:t></a:r></a:p></p:txBody>'
+    )
+
+
+def _body_xml(content: list, title_height, font_size_pt: float, plan: LayoutPlan) -> str:
+    spacing = ST_TextSpacingPoint.convert_to_xml(Pt(paragraph_spacing(font_size_pt)))
+    list_style = (
+        f'<a:lstStyle><a:lvl1pPr><a:spcBef><a:spcPts val="{spacing}"/></a:spcBef>'
+        f'<a:spcAft><a:spcPts val="{spacing}"/></a:spcAft>'
+        f'<a:defRPr sz="{Pt(font_size_pt).centipoints}"/></a:lvl1pPr></a:lstStyle>'
+    )
+    paragraphs = []
+    for item in content:
+        runs = [
+            f'<a:r>{BOLD_RUN_PROPS if is_bold else ""}<a:t>{escape(text)}</a:t></a:r>'
+            for is_bold, text in markdown_runs(str(item))
+        ]
+        paragraphs.append(f'<a:p>{"".join(runs)}</a:p>')
+    top = TITLE_TOP + title_height + TITLE_BODY_GAP
+    return (
+        f'<p:spPr>{_xfrm(BODY_SIDE_MARGIN, top, plan.body_width, plan.body_max_height - title_height)}</p:spPr>'
+        f'<p:txBody><a:bodyPr wrap="square"><a:normAutofit/></a:bodyPr>{list_style}'
+        f'{"".join(paragraphs)}</p:txBody>'
+    )
+
+
+def _can_splice(slide_data: dict) -> bool:
+    title = clean_slide_title(slide_data.get("title", ""))
+    content = [str(c) for c in slide_data.get("content", [])]
+    if not title or not content or UNSAFE_TEXT_RE.search(title):
+        return False
+    # Bullets without text serialize as empty paragraphs (<a:p/>)
+    return all(markdown_runs(item) and not UNSAFE_TEXT_RE.search(item) for item in content)
+
+
+def _render_with_pptx(slide_xml: bytes, slide_data: dict, plan: LayoutPlan) -> bytes:
+    sld = parse_xml(slide_xml)
+    placeholders = {sp.ph_idx: SlideShapeFactory(sp, None) for sp in sld.cSld.spTree.iter_ph_elms()}
+    fill_content_slide(placeholders.get(plan.title_idx), placeholders.get(plan.body_idx), slide_data, plan)
+    return serialize_part_xml(sld)
+
+
+class SlideXmlTemplate:
+    """The layout's empty slide cut around its title and body shape properties."""
+
+    def __init__(self, slide_xml: bytes, plan: LayoutPlan):
+        self.slide_xml = slide_xml
+        self.plan = plan
+        self._rendered = OrderedDict()
+        self._rendered_lock = threading.Lock()
+        self.pieces = self._compile()
+        if self.pieces is not None:
+            probe = _render_with_pptx(slide_xml, PROBE_SLIDE, plan)
+            if self.render(PROBE_SLIDE) != probe:
+                safe_print("⚠️ Fast writer: spliced XML differs from python-pptx for this template, using the object model.")
+                self.pieces = None
+
+    def _compile(self):
+        if self.plan.title_idx is None or self.plan.body_idx is None:
+            return None
+        sld = parse_xml(self.slide_xml)
+        shapes = {sp.ph_idx: sp for sp in sld.cSld.spTree.iter_ph_elms()}
+        title_sp, body_sp = shapes.get(self.plan.title_idx), shapes.get(self.plan.body_idx)
+        if title_sp is None or body_sp is None:
+            return None
+        for sp, marker in ((title_sp, TITLE_MARKER), (body_sp, BODY_MARKER)):
+            # Everything after nvSpPr (spPr, txBody, style) is regenerated
+            for child in list(sp)[1:]:
+                sp.remove(child)
+            sp.append(etree.Comment(marker))
+        xml = serialize_part_xml(sld).decode('utf-8')
+        head, rest = xml.split(f"<!--{TITLE_MARKER}-->")
+        if BODY_MARKER not in rest:
+            return None  # Body before title: not worth a second code path
+        middle, tail = rest.split(f"<!--{BODY_MARKER}-->")
+        return head, middle, tail
+
+    @property
+    def enabled(self) -> bool:
+        return self.pieces is not None
+
+    def render(self, slide_data: dict) -> bytes:
+        key = content_hash(json.dumps(slide_data, ensure_ascii=False, sort_keys=True, default=str))
+        with self._rendered_lock:
+            if key in self._rendered:
+                self._rendered.move_to_end(key)
+                return self._rendered[key]
+        xml = self._render(slide_data)
+        with self._rendered_lock:
+            self._rendered[key] = xml
+            if len(self._rendered) > RENDER_CACHE_SIZE:
+                self._rendered.popitem(last=False)
+        return xml
+
+    def _render(self, slide_data: dict) -> bytes:
+        clean_title, title_height, font_size_pt = measure_content_slide(slide_data, self.plan)
+        head, middle, tail = self.pieces
+        content = slide_data.get("content", [])
+        return (
+            head + _title_xml(clean_title, title_height, self.plan)
+            + middle + _body_xml(content, title_height, font_size_pt, self.plan) + tail
+        ).encode('utf-8')
+
+
+@lru_cache(maxsize=16)
+def get_slide_xml_template(slide_xml: bytes, plan: LayoutPlan) -> SlideXmlTemplate:
+    return SlideXmlTemplate(slide_xml, plan)
+
+
+class StreamedSlidePart(Part):
+    """Slide part whose XML is produced from slide_data at save time."""
+
+    def __init__(self, partname: PackURI, package, xml_template: SlideXmlTemplate, slide_data: dict):
+        super().__init__(partname, CT.PML_SLIDE, package)
+        self._xml_template = xml_template
+        self._slide_data = slide_data
+
+    @property
+    def blob(self) -> bytes:
+        if self._xml_template.enabled and _can_splice(self._slide_data):
+            return self._xml_template.render(self._slide_data)
+        return _render_with_pptx(self._xml_template.slide_xml, self._slide_data, self._xml_template.plan)
+
+
+class StreamedNotesPart(Part):
+    """Notes slide part whose XML is produced from the notes text at save time."""
+
+    def __init__(self, partname: PackURI, package, notes_xml: bytes, notes: str):
+        super().__init__(partname, CT.PML_NOTES_SLIDE, package)
+        self._notes_xml = notes_xml
+        self._notes = notes
+
+    @property
+    def blob(self) -> bytes:
+        notes_slide = NotesSlide(parse_xml(self._notes_xml), None)
+        write_slide_notes(notes_slide, self._notes)
+        return serialize_part_xml(notes_slide._element)
+
+
+def _empty_notes_xml(notes_master) -> bytes:
+    """The notes page NotesSlidePart.new builds: master placeholders cloned, no text."""
+    notes_slide = NotesSlide(CT_NotesSlide.new(), None)
+    notes_slide.clone_master_placeholders(notes_master)
+    return serialize_part_xml(notes_slide._element)
+
+
+def streaming_supported() -> bool:
+    """True when the installed python-pptx is a tested version exposing the internals used below."""
+    version = tuple(int(p) for p in re.findall(r'\d+', pptx.__version__)[:2])
+    return (version in TESTED_PPTX_VERSIONS
+            and hasattr(CT_SlideIdList, "_next_id") and hasattr(CT_SlideIdList, "_add_sldId")
+            and hasattr(_Relationships, "_add_relationship"))
+
+
+def add_content_slides(prs, prepared: PreparedTemplate, slides_content: list[dict]):
+    """
+    Appends content slides (and their speaker notes) to prs as streamed parts.
+    Mirrors python-pptx's Slides.add_slide and Slide.notes_slide (same partnames, rIds and
+    slide ids), minus their per-slide scans of existing relationships, ids and partnames,
+    which make large decks quadratic.
+    """
+    plan = prepared.content_plan
+    xml_template = get_slide_xml_template(prepared.content_slide_xml, plan)
+    layout_part = prs.slide_layouts[plan.layout_index].part
+    presentation_part = prs.part
+    package = presentation_part.package
+    sld_id_lst = prs.slides._sldIdLst
+    next_id = sld_id_lst._next_id
+    notes_master_part = notes_xml = None
+    notes_count = 0
+    for slide_data in slides_content:
+        partname = PackURI("/ppt/slides/slide%d.xml" % (len(sld_id_lst) + 1))
+        slide_part = StreamedSlidePart(partname, package, xml_template, slide_data)
+        slide_part.relate_to(layout_part, RT.SLIDE_LAYOUT)
+        # The part is new, so there is no existing relationship to reuse
+        rId = presentation_part.rels._add_relationship(RT.SLIDE, slide_part)
+        sld_id_lst._add_sldId(id=next_id, rId=rId)
+        next_id += 1
+
+        notes = slide_data.get("notes", "")
+        if not notes:
+            continue
+        if notes_master_part is None:
+            # Created (and related) at the first slide with notes, as python-pptx does
+            notes_master_part = presentation_part.notes_master_part
+            notes_xml = _empty_notes_xml(notes_master_part.notes_master)
+            notes_count = sum(1 for p in package.iter_parts() if p.partname.startswith("/ppt/notesSlides/"))
+        notes_count += 1
+        notes_part = StreamedNotesPart(PackURI("/ppt/notesSlides/notesSlide%d.xml" % notes_count), package,
+                                       notes_xml, str(notes))
+        notes_part.relate_to(notes_master_part, RT.NOTES_MASTER)
+        notes_part.relate_to(slide_part, RT.SLIDE)
+        slide_part.relate_to(notes_part, RT.NOTES_SLIDE)
@@ -0,0 +1,111 @@
+import hashlib
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.oxml.ns import qn
+from pptx.parts.slide import SlidePart, SlideLayoutPart, SlideMasterPart, NotesSlidePart, NotesMasterPart
+
+# Size reduction pass run on a finished deck before it is saved.
+# Corporate templates carry every slide layout, master and embedded image they were
+# designed with; the generated deck uses one or two layouts. python-pptx only writes parts
+# reachable through relationships, so dropping the unused layout/master relationships is
+# enough to drop them (and their themes and media) from the zip. Identical images kept by
+# different layouts are then pointed at a single media part.
+# Opt-in (create_pptx(slim=True)): users may want the template's other layouts to add slides.
+# Only public python-pptx API is used: proxies' .element, Part.related_part/relate_to/drop_rel.
+
+MEDIA_PREFIX = "/ppt/media/"
+R_NAMESPACE = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+# Part class -> the proxy property exposing its XML
+PART_PROXIES = {
+    SlidePart: "slide", SlideLayoutPart: "slide_layout", SlideMasterPart: "slide_master",
+    NotesSlidePart: "notes_slide", NotesMasterPart: "notes_master",
+}
+
+
+def _part_element(part):
+    """Root XML element of a slide/layout/master/notes part, None for other parts (streamed slides)."""
+    prop = PART_PROXIES.get(type(part))
+    return getattr(part, prop).element if prop else None
+
+
+def _used_layout_parts(presentation_part) -> set:
+    # Read from the relationships, not prs.slides: streamed slides (pptx_fast_writer.py)
+    # have no Slide object
+    return {
+        rel.target_part.part_related_by(RT.SLIDE_LAYOUT)
+        for rel in presentation_part.rels.values()
+        if rel.reltype == RT.SLIDE
+    }
+
+
+def _prune_layouts(prs, used_layouts: set) -> tuple[int, int]:
+    """Removes layouts no slide uses, then masters left without layouts. Returns (layouts, masters) removed."""
+    layouts_removed = masters_removed = 0
+    presentation_part = prs.part
+    master_id_lst = prs.element.find(qn('p:sldMasterIdLst'))
+    for master_id in list(master_id_lst):
+        master_rId = master_id.get(qn('r:id'))
+        master_part = presentation_part.related_part(master_rId)
+        layout_id_lst = master_part.slide_master.element.find(qn('p:sldLayoutIdLst'))
+        layout_ids = list(layout_id_lst) if layout_id_lst is not None else []
+        kept = 0
+        for layout_id in layout_ids:
+            rId = layout_id.get(qn('r:id'))
+            if master_part.related_part(rId) in used_layouts:
+                kept += 1
+                continue
+            layout_id_lst.remove(layout_id)
+            master_part.drop_rel(rId)
+            layouts_removed += 1
+        if not kept:
+            master_id_lst.remove(master_id)
+            presentation_part.drop_rel(master_rId)
+            masters_removed += 1
+    return layouts_removed, masters_removed
+
+
+def _dedupe_media(package) -> int:
+    """Points relationships to byte-identical media at one part. Returns the number of rels retargeted."""
+    canonical, keys = {}, {}
+    retargeted = 0
+    for part in list(package.iter_parts()):
+        element = _part_element(part)
+        if element is None:
+            continue
+        for rId, rel in list(part.rels.items()):
+            if rel.is_external or not rel.target_part.partname.startswith(MEDIA_PREFIX):
+                continue
+            media = rel.target_part
+            if media not in keys:
+                keys[media] = (media.content_type, hashlib.sha1(media.blob).hexdigest())
+            key = keys[media]
+            keep = canonical.setdefault(key, media)
+            if keep is not media:
+                # New (or existing) rel to the kept part, references rewritten, old rel dropped
+                new_rId = part.relate_to(keep, rel.reltype)
+                for node in element.iter():
+                    for attr, value in node.attrib.items():
+                        if value == rId and attr.startswith(R_NAMESPACE):
+                            node.set(attr, new_rId)
+                part.drop_rel(rId)
+                retargeted += 1
+    return retargeted
+
+
+def slim_presentation(prs) -> dict:
+    """
+    Drops unused layouts, masters and media from prs and deduplicates identical images.
+    Returns stats; bytes_saved is the uncompressed size of the parts that will no longer be written.
+    """
+    package = prs.part.package
+    parts_before = set(package.iter_parts())
+    layouts_removed, masters_removed = _prune_layouts(prs, _used_layout_parts(prs.part))
+    media_retargeted = _dedupe_media(package)
+    dropped = parts_before - set(package.iter_parts())
+    return {
+        "layouts_removed": layouts_removed,
+        "masters_removed": masters_removed,
+        "media_removed": sum(1 for p in dropped if p.partname.startswith(MEDIA_PREFIX)),
+        "media_retargeted": media_retargeted,
+        "parts_removed": len(dropped),
+        "bytes_saved": sum(len(p.blob) for p in dropped),
+    }
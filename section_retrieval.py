@@ -0,0 +1,212 @@
+import re
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+from utils import safe_print
+from document_loader import StructuredDocument
+from text_normalizer import estimate_tokens
+from cache_store import content_hash
+
+# Local BM25 retrieval over document sections.
+# When user_instructions ask to focus on a chapter or a topic, only the relevant
+# sections (plus a compact outline of the rest) are sent to the model.
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Sections scoring below this fraction of the best score are not selected
+RELATIVE_SCORE_CUTOFF = 0.35
+MAX_SELECTED_SECTIONS = 12
+# Focusing is only worth it if the selection is clearly smaller than the document
+MAX_SELECTED_FRACTION = 0.6
+# Number of per-document indexes kept in memory
+INDEX_CACHE_SIZE = 16
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+CHAPTER_REF_RE = re.compile(r'\b(chương|chapter|phần|part|mục|section)\s+(\d+|[ivxlc]+)\b', re.IGNORECASE)
+# "chương 3" must not match "Phần 3": references compare (kind, number)
+REF_KINDS = {"chương": "chapter", "chapter": "chapter", "phần": "part", "part": "part", "mục": "section", "section": "section"}
+FOCUS_CUE_RE = re.compile(
+    r'(tập\s+trung|chỉ\s+(?:nói|lấy|làm|tóm|về|phân)|chỉ\s+chương|riêng\s+(?:về|phần|chương)|'
+    r'xoay\s+quanh|về\s+chủ\s+đề|focus|only|specifically|about\s+the\s+topic)',
+    re.IGNORECASE
+)
+STOPWORDS = {
+    # Vietnamese
+    "và", "của", "là", "các", "những", "cho", "với", "trong", "về", "một", "này", "đó", "được", "có",
+    "không", "hãy", "tập", "trung", "chỉ", "vào", "phần", "chương", "nội", "dung", "tài", "liệu", "slide",
+    "bài", "thuyết", "trình", "tóm", "tắt", "nói", "lấy", "làm", "riêng", "xoay", "quanh", "chủ", "đề",
+    # English
+    "the", "a", "an", "and", "of", "to", "in", "on", "for", "with", "about", "only", "focus", "please",
+    "chapter", "part", "section", "topic", "is", "are", "this", "that", "specifically",
+}
+ROMAN = {"i": 1, "ii": 2, "iii": 3, "iv": 4, "v": 5, "vi": 6, "vii": 7, "viii": 8, "ix": 9, "x": 10,
+         "xi": 11, "xii": 12, "xiii": 13, "xiv": 14, "xv": 15, "xvi": 16, "xvii": 17, "xviii": 18, "xix": 19, "xx": 20}
+
+Selection = namedtuple("Selection", ["indices", "reason"])
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS and not t.isdigit()]
+
+
+class SectionIndex:
+    """
+    BM25 index over the sections of one document.
+    Postings are stored as flat NumPy arrays (COO: section id, term id, tf), so
+    scoring a query is a masked vector expression + one bincount.
+    """
+
+    def __init__(self, doc: StructuredDocument):
+        self.n_sections = len(doc)
+        section_tokens = [tokenize(doc.section_text(i)) for i in range(self.n_sections)]
+        lengths = np.array([len(t) for t in section_tokens], dtype=np.float64)
+        self.doc_lengths = lengths
+        self.avg_length = float(lengths.mean()) if len(lengths) and lengths.sum() else 1.0
+
+        flat = [tok for toks in section_tokens for tok in toks]
+        if not flat:
+            self.vocab = {}
+            self.rows = self.cols = np.zeros(0, dtype=np.int64)
+            self.tf = self.idf = np.zeros(0, dtype=np.float64)
+            return
+
+        terms, term_ids = np.unique(np.array(flat, dtype=object).astype(str), return_inverse=True)
+        self.vocab = {t: i for i, t in enumerate(terms.tolist())}
+        n_terms = len(terms)
+        section_ids = np.repeat(np.arange(self.n_sections, dtype=np.int64), lengths.astype(np.int64))
+
+        # (section, term) pairs -> term frequency
+        pair_keys, tf = np.unique(section_ids * n_terms + term_ids.astype(np.int64), return_counts=True)
+        self.rows = pair_keys // n_terms
+        self.cols = pair_keys % n_terms
+        self.tf = tf.astype(np.float64)
+
+        df = np.bincount(self.cols, minlength=n_terms).astype(np.float64)
+        self.idf = np.log(1.0 + (self.n_sections - df + 0.5) / (df + 0.5))
+
+    def score(self, query: str) -> np.ndarray:
+        """BM25 score of every section for the query (zeros if no term matches)."""
+        scores = np.zeros(self.n_sections, dtype=np.float64)
+        term_ids = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+        if not term_ids:
+            return scores
+        mask = np.isin(self.cols, np.array(term_ids, dtype=np.int64))
+        rows, cols, tf = self.rows[mask], self.cols[mask], self.tf[mask]
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lengths[rows] / self.avg_length)
+        weights = self.idf[cols] * tf * (BM25_K1 + 1.0) / (tf + norm)
+        return np.bincount(rows, weights=weights, minlength=self.n_sections)
+
+
+_index_cache = OrderedDict()
+# Section workers (outline_deck) look indexes up from several threads
+_index_lock = threading.Lock()
+
+def get_section_index(doc: StructuredDocument) -> SectionIndex:
+    """Returns the BM25 index for doc, cached per document hash."""
+    key = content_hash(doc.text)
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+    index = SectionIndex(doc)
+    with _index_lock:
+        _index_cache[key] = index
+        _index_cache.move_to_end(key)
+        if len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def _chapter_number(token: str) -> int | None:
+    token = token.lower()
+    if token.isdigit():
+        return int(token)
+    return ROMAN.get(token)
+
+
+def _with_subsections(doc: StructuredDocument, indices: list[int]) -> list[int]:
+    """Expands selected headings to the sub-sections below them."""
+    selected = set()
+    for i in indices:
+        selected.add(i)
+        j = i + 1
+        while j < len(doc) and doc.levels[j] > doc.levels[i]:
+            selected.add(j)
+            j += 1
+    return sorted(selected)
+
+
+def _chapter_refs(text: str) -> set[tuple[str, int]]:
+    refs = {(REF_KINDS[kind.lower()], _chapter_number(num)) for kind, num in CHAPTER_REF_RE.findall(text)}
+    return {(kind, n) for kind, n in refs if n is not None}
+
+
+def _match_chapter_refs(doc: StructuredDocument, user_instructions: str) -> list[int]:
+    refs = _chapter_refs(user_instructions)
+    if not refs:
+        return []
+    matched = [i for i, title in enumerate(doc.titles) if _chapter_refs(title) & refs]
+    return _with_subsections(doc, matched)
+
+
+def match_sections(doc: StructuredDocument, query: str, limit: int = MAX_SELECTED_SECTIONS) -> list[int]:
+    """Best BM25 sections for query (with their sub-sections), in document order; [] if nothing matches."""
+    scores = get_section_index(doc).score(query)
+    best = float(scores.max()) if len(scores) else 0.0
+    if best <= 0:
+        return []
+    ranked = np.argsort(-scores)[:limit]
+    return _with_subsections(doc, sorted(int(i) for i in ranked if scores[i] >= best * RELATIVE_SCORE_CUTOFF))
+
+
+def select_sections(doc: StructuredDocument, user_instructions: str) -> Selection | None:
+    """
+    Picks the sections the instructions focus on.
+    Returns None when the instructions are not a focus request or the selection
+    would not make the prompt meaningfully smaller. A chapter mention alone is not a
+    focus request ("giọng văn giống ví dụ ở chương 3"): a focus cue must be present.
+    """
+    if not user_instructions or len(doc) < 2 or not FOCUS_CUE_RE.search(user_instructions):
+        return None
+
+    indices = _match_chapter_refs(doc, user_instructions)
+    reason = "chapter reference"
+    if not indices:
+        indices = match_sections(doc, user_instructions)
+        reason = "BM25 topic match"
+
+    if not indices:
+        return None
+    selected_chars = sum(doc.ends[i] - doc.starts[i] for i in indices)
+    if selected_chars > MAX_SELECTED_FRACTION * max(1, len(doc.text)):
+        return None
+    return Selection(indices, reason)
+
+
+def build_focused_text(doc: StructuredDocument, selection: Selection) -> str:
+    """Selected sections in full, plus an outline of everything that was left out."""
+    selected = set(selection.indices)
+    outline = [("  " * max(0, doc.levels[i] - 1)) + f"- {doc.titles[i]}" for i in range(len(doc)) if i not in selected and doc.titles[i]]
+    blocks = []
+    if outline:
+        blocks.append("DÀN Ý CÁC PHẦN KHÁC CỦA TÀI LIỆU (chỉ để tham khảo bối cảnh):\n" + "\n".join(outline))
+    blocks.append("CÁC PHẦN LIÊN QUAN ĐẾN YÊU CẦU CỦA NGƯỜI DÙNG:")
+    for i in selection.indices:
+        blocks.append(doc.section_text(i).strip())
+    return "\n\n".join(b for b in blocks if b)
+
+
+def focus_document(doc: StructuredDocument, user_instructions: str) -> str | None:
+    """
+    Returns the focused prompt text, or None to keep the full document.
+    """
+    selection = select_sections(doc, user_instructions)
+    if selection is None:
+        return None
+    focused = build_focused_text(doc, selection)
+    safe_print(
+        f"🎯 Focused on {len(selection.indices)}/{len(doc)} sections ({selection.reason}): "
+        f"{estimate_tokens(doc.text)} -> {estimate_tokens(focused)} tokens"
+    )
+    return focused
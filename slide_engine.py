@@ -1,55 +1,519 @@
 import io
+import copy
+import threading
+from collections import OrderedDict, namedtuple
 from typing import Dict, Any
 from pptx import Presentation
-from pptx.util import Pt, Cm
+from pptx.util import Pt, Cm, Emu
 from pptx.enum.text import MSO_AUTO_SIZE, PP_ALIGN, MSO_ANCHOR
 from pptx.dml.color import RGBColor
+from pptx.enum.shapes import PP_PLACEHOLDER
+from pptx.oxml.ns import qn
+from pptx.oxml.simpletypes import ST_TextSpacingPoint
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.opc.oxml import serialize_part_xml
+from lxml import etree
 import re
+from cache_store import content_hash
+from pptx_slim import slim_presentation
+from utils import safe_print
+from text_metrics import count_lines, fit_font_size, text_block_height, paragraph_spacing, LINE_SPACING
 
-def create_pptx(json_data: Dict[str, Any], template_pptx_bytes: bytes | None = None) -> io.BytesIO:
+# Prepared templates kept in memory (the same few templates are used all day)
+TEMPLATE_CACHE_SIZE = 8
+
+# Title font: the template's own size, but never larger than this
+TITLE_FONT_SIZE = 36
+# Body font range for the manual scaling heuristic
+MAX_FONT_SIZE = 24
+MIN_FONT_SIZE = 10
+
+# Standard margins enforced on content slides
+TITLE_LEFT = Cm(1.0)
+TITLE_TOP = Cm(0.5)
+BODY_SIDE_MARGIN = Cm(1.5)
+# Balanced gap between title and body: 0.4cm (Enough separation, but connected)
+TITLE_BODY_GAP = Cm(0.4)
+BODY_BOTTOM_MARGIN = Cm(1.0)
+# Default text frame insets (bodyPr lIns/rIns and tIns/bIns)
+TEXT_INSET_LR = Pt(7.2)
+TEXT_INSET_TB = Pt(3.6)
+
+# Overflowing slides are split rather than shrunk below this size
+READABLE_FONT_SIZE = 16
+CONTINUATION_SUFFIX = " (tiếp)"
+
+# Decks with at least this many content slides use the streaming writer
+FAST_WRITER_MIN_SLIDES = 300
+
+SLIDE_PREFIX_RE = re.compile(r'^Slide\s+\d+[:.]?\s*', re.IGNORECASE)
+BOLD_SPLIT_RE = re.compile(r'(\*\*.*?\*\*)')
+
+# skeleton: freshly parsed Presentation with all template slides removed. It is never
+#   accessed after loading: python-pptx proxies keep references to sub-elements, which
+#   deepcopy would detach from their part's XML tree. Untouched, only part roots are shared.
+# placeholder_geometry: {layout_index: [(idx, type, left, top, width, height), ...]} in EMU
+# content_plan: LayoutPlan of the content layout
+# content_slide_xml: serialized empty slide of the content layout (placeholders cloned),
+#   the precompiled fragment used by pptx_fast_writer.py
+# slide_size: (width, height) of the slides in EMU
+PreparedTemplate = namedtuple("PreparedTemplate", [
+    "skeleton", "title_layout_index", "content_layout_index", "placeholder_geometry", "content_plan", "content_slide_xml",
+    "slide_size",
+])
+
+# Everything create_pptx needs to know about a layout, resolved once per template.
+# title_idx/body_idx: placeholder idx on slides built from the layout (None if missing)
+# title_font_pt/body_font_pt: sizes used for the layout math (template defaults, capped)
+# title_font_family/body_font_family: latin typeface (theme fonts resolved), None if unknown
+# body_indent: first-level bullet indent (marL) in EMU
+# title_width/body_width/body_max_height: usable box sizes in EMU with the standard margins
+LayoutPlan = namedtuple("LayoutPlan", [
+    "layout_index", "title_idx", "body_idx", "title_font_pt", "body_font_pt",
+    "title_font_family", "body_font_family", "body_indent",
+    "title_width", "body_width", "body_max_height",
+])
+
+_template_cache = OrderedDict()
+_template_lock = threading.Lock()
+
+
+def _clear_slides(prs):
+    # We need to remove the relationship (rId) to avoid corruption
+    xml_slides = prs.slides._sldIdLst
+    for s in list(xml_slides):
+        prs.part.drop_rel(s.rId)  # Critical: Remove the relationship
+        xml_slides.remove(s)      # Remove the slide entry
+
+
+def _find_layout_index(prs, preferred_index, needs_body=False) -> int:
+    """Index of a usable layout: preferred one if suitable, else the first with a body, else 0."""
+    layouts = prs.slide_layouts
+    # Try preferred index first
+    if preferred_index < len(layouts):
+        # Check if it has a body placeholder (usually idx 1)
+        if not needs_body or len(layouts[preferred_index].placeholders) > 1:
+            return preferred_index
+
+    # Fallback: Search for a suitable layout
+    for i, layout in enumerate(layouts):
+        if needs_body and len(layout.placeholders) > 1:
+            return i
+
+    # Last resort: just return first layout
+    return 0
+
+
+def _placeholder_geometry(layout) -> list[tuple]:
+    return [
+        (ph.placeholder_format.idx, ph.placeholder_format.type, ph.left, ph.top, ph.width, ph.height)
+        for ph in layout.placeholders
+    ]
+
+
+def _lvl1_styles(layout, placeholder, style_tag) -> list:
     """
-    Generates a PowerPoint presentation from JSON data.
-    Returns: BytesIO object of the .pptx file.
+    a:lvl1pPr elements a slide placeholder inherits from, nearest first:
+    layout placeholder lstStyle, matching master placeholder, master txStyles entry.
     """
+    sources = [placeholder._element.find(qn('p:txBody'))]
+    master = layout.slide_master
+    for master_ph in master.placeholders:
+        if master_ph.placeholder_format.type == placeholder.placeholder_format.type:
+            sources.append(master_ph._element.find(qn('p:txBody')))
+            break
+    tx_styles = master._element.find(qn('p:txStyles'))
+    if tx_styles is not None:
+        sources.append(tx_styles.find(qn(style_tag)))
+    return [lvl1 for source in sources if source is not None for lvl1 in source.iter(qn('a:lvl1pPr'))]
+
+
+def _inherited_value(styles, getter):
+    for lvl1 in styles:
+        value = getter(lvl1)
+        if value is not None:
+            return value
+    return None
+
+
+def _def_rpr_attr(lvl1, child, attr):
+    def_rpr = lvl1.find(qn('a:defRPr'))
+    if def_rpr is None:
+        return None
+    if child:
+        def_rpr = def_rpr.find(qn(child))
+        if def_rpr is None:
+            return None
+    return def_rpr.get(attr)
+
+
+def _theme_fonts(layout) -> dict:
+    """{'+mj-lt': major latin typeface, '+mn-lt': minor latin typeface} of the layout's theme."""
+    master = layout.slide_master
+    try:
+        theme = etree.fromstring(master.part.part_related_by(RT.THEME).blob)
+    except (KeyError, etree.XMLSyntaxError):
+        return {}
+    fonts = {}
+    for tag, key in (('a:majorFont', '+mj-lt'), ('a:minorFont', '+mn-lt')):
+        latin = theme.find(f".//{qn(tag)}/{qn('a:latin')}")
+        if latin is not None and latin.get('typeface'):
+            fonts[key] = latin.get('typeface')
+    return fonts
+
+
+def _font_info(layout, placeholder, style_tag, theme_fonts, default_theme_font):
+    """(size_pt, font_family, indent_emu) inherited by a placeholder's first level."""
+    if placeholder is None:
+        return None, None, 0
+    styles = _lvl1_styles(layout, placeholder, style_tag)
+    size = _inherited_value(styles, lambda lvl1: _def_rpr_attr(lvl1, None, 'sz'))
+    typeface = _inherited_value(styles, lambda lvl1: _def_rpr_attr(lvl1, 'a:latin', 'typeface')) or default_theme_font
+    family = theme_fonts.get(typeface, None if typeface.startswith('+') else typeface)
+    indent = _inherited_value(styles, lambda lvl1: lvl1.get('marL'))
+    return (int(size) / 100 if size else None), family, int(indent or 0)
+
+
+def _layout_plan(prs, layout_index) -> LayoutPlan:
+    layout = prs.slide_layouts[layout_index]
+    # Only these placeholders are cloned onto new slides (no date/footer/number)
+    placeholders = list(layout.iter_cloneable_placeholders())
+    title_ph = next((ph for ph in placeholders if ph.placeholder_format.idx == 0), None)
+
+    # Find the best placeholder for content
+    # Priority 1: explicitly identified "BODY" or "OBJECT" placeholders
+    candidates = []
+    for ph in placeholders:
+        ph_type = ph.placeholder_format.type
+        # Skip Title, Center Title, Subtitle
+        if ph_type in (PP_PLACEHOLDER.TITLE, PP_PLACEHOLDER.CENTER_TITLE, PP_PLACEHOLDER.SUBTITLE):
+            continue
+        if ph_type in (PP_PLACEHOLDER.BODY, PP_PLACEHOLDER.OBJECT):
+            candidates.append((0, ph)) # High priority
+        elif ph.placeholder_format.idx == 1:
+            candidates.append((1, ph)) # Medium priority
+        else:
+            candidates.append((2, ph)) # Low priority
+    body_ph = min(candidates, key=lambda c: c[0])[1] if candidates else None
+    # Fallback: if absolutely no specific body, just grab the one that isn't the title
+    if body_ph is None and len(placeholders) > 1:
+        body_ph = next((ph for ph in placeholders if ph is not title_ph), None)
+
+    theme_fonts = _theme_fonts(layout)
+    title_font, title_family, _ = _font_info(layout, title_ph, 'p:titleStyle', theme_fonts, '+mj-lt')
+    body_font, body_family, body_indent = _font_info(layout, body_ph, 'p:bodyStyle', theme_fonts, '+mn-lt')
+    return LayoutPlan(
+        layout_index=layout_index,
+        title_idx=0 if title_ph is not None else None,
+        body_idx=body_ph.placeholder_format.idx if body_ph is not None else None,
+        title_font_pt=min(title_font or TITLE_FONT_SIZE, TITLE_FONT_SIZE),
+        body_font_pt=min(body_font or MAX_FONT_SIZE, MAX_FONT_SIZE),
+        title_font_family=title_family,
+        body_font_family=body_family,
+        body_indent=Emu(body_indent),
+        title_width=Emu(prs.slide_width - 2 * TITLE_LEFT),
+        body_width=Emu(prs.slide_width - 2 * BODY_SIDE_MARGIN),
+        body_max_height=Emu(prs.slide_height - TITLE_TOP - TITLE_BODY_GAP - BODY_BOTTOM_MARGIN),
+    )
+
+
+def _prepare_template(template_pptx_bytes: bytes | None) -> PreparedTemplate:
     if template_pptx_bytes:
         prs = Presentation(io.BytesIO(template_pptx_bytes))
         # Clear existing slides from the template explicitly and safely
-        # We need to remove the relationship (rId) to avoid corruption
-        xml_slides = prs.slides._sldIdLst
-        slides = list(xml_slides)
-        
-        for s in slides:
-             rId = s.rId
-             prs.part.drop_rel(rId) # Critical: Remove the relationship
-             xml_slides.remove(s)   # Remove the slide entry
-            
+        _clear_slides(prs)
+        # Round-trip once so the dropped slides (and their media) are no longer in the package
+        buffer = io.BytesIO()
+        prs.save(buffer)
+        skeleton_bytes = buffer.getvalue()
         print(f"Template loaded and cleared. Remaining slides: {len(prs.slides)}")
-        
     else:
         prs = Presentation() # Uses default template
+        skeleton_bytes = None
+
+    # layout 0 usually title, content layout often index 1 (needs body)
+    title_index = _find_layout_index(prs, 0)
+    content_index = _find_layout_index(prs, 1, needs_body=True)
+    geometry = {i: _placeholder_geometry(prs.slide_layouts[i]) for i in {title_index, content_index}}
+    content_plan = _layout_plan(prs, content_index)
+    # prs is a scratch copy from here on: the skeleton is parsed separately below
+    content_slide_xml = serialize_part_xml(prs.slides.add_slide(prs.slide_layouts[content_index])._element)
+    skeleton = Presentation(io.BytesIO(skeleton_bytes)) if skeleton_bytes else Presentation()
+    slide_size = (Emu(prs.slide_width), Emu(prs.slide_height))
+    return PreparedTemplate(skeleton, title_index, content_index, geometry, content_plan, content_slide_xml, slide_size)
+
+
+def get_prepared_template(template_pptx_bytes: bytes | None = None) -> PreparedTemplate:
+    """Parses and clears a template once, cached by the SHA-256 of its bytes."""
+    key = content_hash(template_pptx_bytes) if template_pptx_bytes else "default"
+    with _template_lock:
+        if key in _template_cache:
+            _template_cache.move_to_end(key)
+            return _template_cache[key]
+    prepared = _prepare_template(template_pptx_bytes)
+    with _template_lock:
+        _template_cache[key] = prepared
+        if len(_template_cache) > TEMPLATE_CACHE_SIZE:
+            _template_cache.popitem(last=False)
+    return prepared
+
+
+def new_presentation(template_pptx_bytes: bytes | None = None):
+    """
+    Returns (prs, prepared): a fresh, empty Presentation for one deck.
+    The copy is a deepcopy of the cached skeleton (media blobs are shared, XML is not),
+    several times faster than re-parsing the template.
+    """
+    prepared = get_prepared_template(template_pptx_bytes)
+    return copy.deepcopy(prepared.skeleton), prepared
+
+
+def clear_template_cache():
+    with _template_lock:
+        _template_cache.clear()
+
+
+def clean_slide_title(raw_title: str) -> str:
+    # Remove "Slide 1:", "Slide 01", etc.
+    return SLIDE_PREFIX_RE.sub('', raw_title)
+
+
+def title_height_pt(title: str, plan: LayoutPlan) -> float:
+    """Height of the title box: measured lines of the bold title face, no extra padding."""
+    if plan.title_idx is None:
+        return 0.0
+    lines = count_lines(title, plan.title_width.pt - 2 * TEXT_INSET_LR.pt, plan.title_font_pt, plan.title_font_family, bold=True)
+    return lines * plan.title_font_pt * LINE_SPACING
+
+
+def body_text_box_pt(plan: LayoutPlan, title_height: float) -> tuple[float, float]:
+    """(width, height) in points available to body text under a title of title_height points."""
+    width = plan.body_width.pt - 2 * TEXT_INSET_LR.pt - plan.body_indent.pt
+    height = plan.body_max_height.pt - title_height - 2 * TEXT_INSET_TB.pt
+    return width, height
+
+
+def split_overflowing_slides(slides: list[dict], plan: LayoutPlan, min_font_size: float = READABLE_FONT_SIZE) -> list[dict]:
+    """
+    Splits slides whose bullets do not fit at min_font_size into "(tiếp)" continuation
+    slides, on bullet boundaries. A single bullet that is too long on its own keeps a
+    slide to itself (its font then shrinks toward MIN_FONT_SIZE). Notes stay on the first part.
+    """
+    return split_slides_with_sources(slides, plan, min_font_size)[0]
 
-    # Helper to find usable layouts
-    def get_layout(prs, preferred_index, needs_body=False):
-        # Try preferred index first
-        if preferred_index < len(prs.slide_layouts):
-            layout = prs.slide_layouts[preferred_index]
-            if not needs_body:
-                return layout
-            # Check if it has a body placeholder (usually idx 1)
-            if len(layout.placeholders) > 1:
-                return layout
-        
-        # Fallback: Search for a suitable layout
-        for layout in prs.slide_layouts:
-            if needs_body and len(layout.placeholders) > 1:
-                return layout
-        
-        # Last resort: just return first layout
-        return prs.slide_layouts[0]
+
+def split_slides_with_sources(slides: list[dict], plan: LayoutPlan,
+                              min_font_size: float = READABLE_FONT_SIZE) -> tuple[list[dict], list[int]]:
+    """split_overflowing_slides plus, per output slide, the index of the input slide it came from."""
+    if plan.body_idx is None:
+        return list(slides), list(range(len(slides)))
+    result, sources = [], []
+    for source, slide_data in enumerate(slides):
+        content = [str(c) for c in slide_data.get("content", [])]
+        title = clean_slide_title(slide_data.get("title", ""))
+        width, height = body_text_box_pt(plan, title_height_pt(title, plan))
+        if text_block_height(tuple(content), width, min_font_size, plan.body_font_family) <= height:
+            result.append(slide_data)
+            sources.append(source)
+            continue
+
+        base_title = title[:-len(CONTINUATION_SUFFIX)] if title.endswith(CONTINUATION_SUFFIX) else title
+        continuation_title = base_title + CONTINUATION_SUFFIX
+        _, continuation_height = body_text_box_pt(plan, title_height_pt(continuation_title, plan))
+        chunks, current = [], []
+        for item in content:
+            box_height = continuation_height if chunks else height
+            if current and text_block_height(tuple(current + [item]), width, min_font_size, plan.body_font_family) > box_height:
+                chunks.append(current)
+                current = []
+            current.append(item)
+        chunks.append(current)
+
+        for i, chunk in enumerate(chunks):
+            part = dict(slide_data, content=chunk)
+            if i:
+                part["title"] = continuation_title
+                part.pop("notes", None)
+            result.append(part)
+            sources.append(source)
+    return result, sources
+
+
+def rendered_slide_numbers(json_data: Dict[str, Any], template_pptx_bytes: bytes | None = None,
+                           auto_split: bool = True) -> list[int]:
+    """
+    For every slide create_pptx writes, in order, the 1-based number of the JSON slide it renders
+    (0 for the title slide). Continuation slides repeat their source's number, so the numbers
+    shown on the preview are the ones regenerate_slides expects.
+    """
+    slides = json_data.get("slides", [])
+    if auto_split:
+        _, sources = split_slides_with_sources(slides, get_prepared_template(template_pptx_bytes).content_plan)
+    else:
+        sources = list(range(len(slides)))
+    return [0] + [i + 1 for i in sources]
+
+
+def markdown_runs(text: str) -> list[tuple[bool, str]]:
+    """
+    Splits **bold** markdown into (is_bold, text) runs. Empty segments are dropped and
+    adjacent segments with the same formatting are merged ("**a****b**" is one run).
+    """
+    runs = []
+    for part in BOLD_SPLIT_RE.split(text):
+        is_bold = part.startswith('**') and part.endswith('**') and len(part) >= 4
+        if is_bold:
+            part = part[2:-2]
+        if not part:
+            continue
+        if runs and runs[-1][0] == is_bold:
+            runs[-1] = (is_bold, runs[-1][1] + part)
+        else:
+            runs.append((is_bold, part))
+    return runs
+
+
+def _set_body_list_style(text_frame, font_size_pt: float):
+    """Writes size and paragraph spacing as the level-1 defaults of the shape's a:lstStyle."""
+    txBody = text_frame._txBody
+    lst_style = txBody.find(qn('a:lstStyle'))
+    if lst_style is None:
+        lst_style = etree.Element(qn('a:lstStyle'))
+        txBody.find(qn('a:bodyPr')).addnext(lst_style)
+    for child in list(lst_style):
+        lst_style.remove(child)
+    spacing = ST_TextSpacingPoint.convert_to_xml(Pt(paragraph_spacing(font_size_pt)))
+    lvl1 = etree.SubElement(lst_style, qn('a:lvl1pPr'))
+    for tag in ('a:spcBef', 'a:spcAft'):
+        etree.SubElement(etree.SubElement(lvl1, qn(tag)), qn('a:spcPts'), val=spacing)
+    etree.SubElement(lvl1, qn('a:defRPr'), sz=str(Pt(font_size_pt).centipoints))
+
+
+def write_slide_notes(notes_slide, notes: str):
+    """Speaker notes into the notes placeholder (skipped if the notes master has none)."""
+    text_frame = notes_slide.notes_text_frame
+    if text_frame is not None:
+        text_frame.text = str(notes)
+
+
+def measure_content_slide(slide_data: Dict[str, Any], plan: LayoutPlan) -> tuple:
+    """
+    Layout values of one content slide: (clean_title, title_height, body_font_size_pt).
+    title_height is a Length (0 without a title placeholder).
+    """
+    clean_title = clean_slide_title(slide_data.get("title", ""))
+    # --- Layout Refinement: Advanced Dynamic Calculation ---
+    # Instead of a hard threshold, we calculate expected height based on:
+    # - Text Length (measured with real font metrics, see text_metrics.py)
+    # - Font Size (from the layout/master, see LayoutPlan)
+    # - Container Width
+    title_height = Pt(title_height_pt(clean_title, plan)) if plan.title_idx is not None else Cm(0)
+
+    # --- Hybrid Strategy: Measured Fit + Native Auto-Fit ---
+    # 1. We pick the largest size whose measured layout fits the box (text_metrics.py),
+    #    so the slide looks good immediately on open.
+    # 2. create_pptx sets TEXT_TO_FIT_SHAPE so PowerPoint handles future edits/overflows gracefully.
+    text_width_pt, text_height_pt = body_text_box_pt(plan, title_height.pt)
+    font_size_pt, _ = fit_font_size(
+        tuple(str(c) for c in slide_data.get("content", [])), text_width_pt, text_height_pt,
+        plan.body_font_pt, MIN_FONT_SIZE, plan.body_font_family
+    )
+    return clean_title, title_height, font_size_pt
+
+
+def fill_content_slide(title_shape, body_shape, slide_data: Dict[str, Any], plan: LayoutPlan):
+    """
+    Writes one content slide into its title/body placeholders (either may be None).
+    Only touches the shapes' XML, so it is shared by create_pptx and the fast writer.
+    """
+    clean_title, measured_title_height, body_font_size_pt = measure_content_slide(slide_data, plan)
+
+    # Set Title and Clean "Slide X:" prefix
+    title_height = Cm(0) # Default if no title exists
+    if title_shape is not None:
+        title_shape.text = clean_title
+        font_size_pt = plan.title_font_pt
+
+        # --- FIX: Set Width/Pos BEFORE calculation so math matches reality ---
+        # User wants "triệt để", so let's enforce standard margins to be safe.
+        title_shape.left = TITLE_LEFT
+        title_shape.width = plan.title_width
+        title_shape.top = TITLE_TOP
+        title_height = measured_title_height
+        title_shape.height = title_height
+
+        # Title Font Styling
+        tf_title = title_shape.text_frame
+        tf_title.word_wrap = True
+        tf_title.auto_size = MSO_AUTO_SIZE.TEXT_TO_FIT_SHAPE
+        tf_title.vertical_anchor = MSO_ANCHOR.TOP # Critical
+
+        p = tf_title.paragraphs[0]
+        p.font.size = Pt(font_size_pt)
+        p.font.bold = True
+        p.alignment = PP_ALIGN.LEFT
+
+        # Remove margins to make math accurate and remove "empty line" look
+        tf_title.margin_top = 0
+        tf_title.margin_bottom = 0 # Critical fix for "empty line" below
+
+    # Set Content (Body)
+    if body_shape is not None and hasattr(body_shape, "text_frame"):
+        # --- Layout Refinement: Adjust Margins & Top ---
+        # Body Top = Title Top (0.5) + Title Height + Gap (0.4)
+        margin_top = TITLE_TOP + title_height + TITLE_BODY_GAP
+
+        body_shape.left = BODY_SIDE_MARGIN
+        body_shape.top = margin_top
+        body_shape.width = plan.body_width
+        body_shape.height = plan.body_max_height - title_height
+
+        tf = body_shape.text_frame
+
+        content = slide_data.get("content", [])
+        font_size_pt = body_font_size_pt
+
+        # Apply calculated font size AND set AutoFit
+        tf.word_wrap = True
+        tf.auto_size = MSO_AUTO_SIZE.TEXT_TO_FIT_SHAPE # Re-enable Native Auto-Fit
+
+        # Clear default paragraph
+        tf.clear()
+
+        # Size and spacing are set once on the shape's list style and inherited by every
+        # paragraph/run; runs only carry the bold + emphasis color.
+        _set_body_list_style(tf, font_size_pt)
+        for i, item in enumerate(content):
+            # Reuse the first paragraph
+            p = tf.paragraphs[0] if i == 0 else tf.add_paragraph()
+            # The layout's first paragraph may be indented (reading p.level would add an empty pPr)
+            if p._p.pPr is not None and p._p.pPr.lvl:
+                p.level = 0
+
+            for is_bold, text in markdown_runs(str(item)):
+                run = p.add_run()
+                run.text = text
+                if is_bold:
+                    run.font.bold = True
+                    run.font.color.rgb = RGBColor(0, 112, 192) # Emphasis Blue
+
+
+def create_pptx(json_data: Dict[str, Any], template_pptx_bytes: bytes | None = None, auto_split: bool = True,
+                fast_writer: bool | None = None, slim: bool = False) -> io.BytesIO:
+    """
+    Generates a PowerPoint presentation from JSON data.
+    auto_split: move bullets that do not fit at READABLE_FONT_SIZE to "(tiếp)" slides.
+    fast_writer: stream content slides as pre-rendered XML parts (see pptx_fast_writer.py).
+        None = automatic from FAST_WRITER_MIN_SLIDES.
+    slim: drop the template's unused layouts, masters and media (see pptx_slim.py). Off by default:
+        the pruned layouts are gone for anyone adding slides to the deck later.
+    Returns: BytesIO object of the .pptx file.
+    """
+    prs, prepared = new_presentation(template_pptx_bytes)
 
     # 1. Main Title Slide
     # layout 0 usually title
-    title_layout = get_layout(prs, 0) 
+    title_layout = prs.slide_layouts[prepared.title_layout_index]
     slide = prs.slides.add_slide(title_layout)
     
     if slide.shapes.title:
@@ -65,226 +529,39 @@ def create_pptx(json_data: Dict[str, Any], template_pptx_bytes: bytes | None = N
 
     # 2. Content Slides
     slides_content = json_data.get("slides", [])
-    
-    # Try to find a content layout (often index 1, needs body)
-    content_layout = get_layout(prs, 1, needs_body=True)
-    
-    # ... existing code ...
-
-    for slide_data in slides_content:
-        slide = prs.slides.add_slide(content_layout)
-        
-        # Set Title and Clean "Slide X:" prefix
-        title_height = Cm(0) # Default if no title exists
-        if slide.shapes.title:
-            raw_title = slide_data.get("title", "")
-            # Remove "Slide 1:", "Slide 01", etc.
-            clean_title = re.sub(r'^Slide\s+\d+[:.]?\s*', '', raw_title, flags=re.IGNORECASE)
-            slide.shapes.title.text = clean_title
-            
-            # --- Layout Refinement: Advanced Dynamic Calculation ---
-            # Instead of a hard threshold, we calculate expected height based on:
-            # - Text Length
-            # - Font Size (Inherited or Default)
-            # - Container Width
-            
-            # 1. Determine Font Size (Points)
-            font_size_pt = 36 # Default
-            # Try to read from template shape style if available to be smarter
-            # (Limitation: python-pptx often returns None for inherited styles, so we default safe)
-            if slide.shapes.title.text_frame and slide.shapes.title.text_frame.paragraphs:
-                 p_font = slide.shapes.title.text_frame.paragraphs[0].font
-                 if p_font and p_font.size:
-                      font_size_pt = p_font.size.pt
-            
-            # --- FIX: Set Width/Pos BEFORE calculation so math matches reality ---
-            # User wants "triệt để", so let's enforce standard margins to be safe.
-            slide.shapes.title.left = Cm(1.0)
-            slide.shapes.title.width = prs.slide_width - Cm(2.0)
-            slide.shapes.title.top = Cm(0.5)
-
-            # 2. Determine Width (Points)
-            shape_width_pt = slide.shapes.title.width.pt
-            
-            # 3. Calculate Capacity
-            # Avg char width approx 0.55 of font size for mixed case variable width sans-serif
-            avg_char_width = font_size_pt * 0.55
-            chars_per_line = shape_width_pt / avg_char_width
-            
-            # 4. Estimate Lines
-            import math
-            # Add small buffer +1 for safety
-            estimated_lines = math.ceil(len(clean_title) / chars_per_line)
-            estimated_lines = max(1, estimated_lines) # At least 1 line
-            
-            # 5. Calculate Height
-            # LINE HEIGHT TUNING:
-            # User reported "empty line" effect. Reducing multiplier and removing padding.
-            # 1.1 is tight leading.
-            line_height_pt = font_size_pt * 1.1
-            # Remove extra padding (+0 instead of +12)
-            total_height_pt = (estimated_lines * line_height_pt)
-            
-            title_height = Pt(total_height_pt)
-            
-            # Apply Height
-            slide.shapes.title.height = title_height
-            
-            # Title Font Styling
-            if slide.shapes.title.text_frame:
-                tf_title = slide.shapes.title.text_frame
-                tf_title.word_wrap = True 
-                tf_title.auto_size = MSO_AUTO_SIZE.TEXT_TO_FIT_SHAPE 
-                tf_title.vertical_anchor = MSO_ANCHOR.TOP # Critical
-                
-                if tf_title.paragraphs:
-                    p = tf_title.paragraphs[0]
-                    p.font.size = Pt(font_size_pt)
-                    p.font.bold = True
-                    p.alignment = PP_ALIGN.LEFT 
-                    
-                    # Remove margins to make math accurate and remove "empty line" look
-                    tf_title.margin_top = 0
-                    tf_title.margin_bottom = 0 # Critical fix for "empty line" below
-                         
-        # Set Content (Body)
-        # Find the best placeholder for content
-        body_shape = None
-        
-        # Priority 1: explicitly identified "BODY" or "OBJECT" placeholders
-        from pptx.enum.shapes import PP_PLACEHOLDER
-        
-        candidates = []
-        for shape in slide.placeholders:
-            # Skip Title, Center Title, Subtitle
-            if shape.placeholder_format.type in [PP_PLACEHOLDER.TITLE, PP_PLACEHOLDER.CENTER_TITLE, PP_PLACEHOLDER.SUBTITLE]:
-                continue
-                
-            # Prefer Body (2) or Object (7)
-            if shape.placeholder_format.type in [PP_PLACEHOLDER.BODY, PP_PLACEHOLDER.OBJECT]:
-                candidates.append((0, shape)) # High priority
-            elif shape.placeholder_format.idx == 1:
-                candidates.append((1, shape)) # Medium priority
-            else:
-                candidates.append((2, shape)) # Low priority
-
-        # Sort by priority (asc) then by top/left position implicitly? No, just priority.
-        if candidates:
-            candidates.sort(key=lambda x: x[0])
-            body_shape = candidates[0][1]
-        
-        # Fallback: if absolutely no specific body, just grab the second placeholder if it exists
-        if not body_shape and len(slide.placeholders) > 1:
-             # Just grab the one that isn't the title (assuming title is [0] or type title)
-             for shape in slide.placeholders:
-                 if shape.element is not slide.shapes.title.element:
-                      body_shape = shape
-                      break
-
-        if body_shape and hasattr(body_shape, "text_frame"):
-            # --- Layout Refinement: Adjust Margins & Top ---
-            
-            margin_side = Cm(1.5)
-            # Body Top = Title Top (0.5) + Title Height + Larger Gap (0.5)
-            # Dynamic Calculation
-            # Balanced gap: 0.4cm (Enough separation, but connected)
-            gap = Cm(0.4) 
-            margin_top = Cm(0.5) + title_height + gap
-            
-            # Ensure we don't push off bottom
-            margin_bottom = Cm(1.0)
-            
-            body_shape.left = margin_side
-            body_shape.top = margin_top
-            body_shape.width = prs.slide_width - (margin_side * 2)
-            # Safe calculation for height
-            available_height = prs.slide_height - margin_top - margin_bottom
-            if available_height < Cm(5): # minimal safe height
-                 # If title is huge, shrink body drastically? 
-                 # Or just clamp.
-                 pass
-            
-            body_shape.height = available_height
-            
-            tf = body_shape.text_frame
-            tf.word_wrap = True
-            
-            # --- Hybrid Strategy: Manual Calc + Native Auto-Fit ---
-            # 1. We calculate a safe "base" font size manually so the slide looks good immediately on open.
-            # 2. We set TEXT_TO_FIT_SHAPE so PowerPoint handles future edits/overflows gracefully.
-            
-            # Constants for Heuristic
-            MAX_FONT_SIZE = 24
-            MIN_FONT_SIZE = 10
-            
-            # Estimate Capacity:
-            # Box dimensions: ~22cm wide x ~8cm high.
-            # At 24pt, line height ~30pt. Height 8cm=226pt -> ~7 lines.
-            # Width 22cm=623pt. Avg char width ~11pt -> ~56 chars/line.
-            # Total Chars @ 24pt = 7 * 56 = ~392 chars.
-            # Let's be conservative: 350 chars for 24pt.
-            # UPDATED: User reported overflow. Drastically reducing logical capacity for safer scaling.
-            BASE_CAPACITY_AT_24PT = 300 
-            
-            total_text_len = sum(len(str(c)) for c in slide_data.get("content", []))
-            
-            if total_text_len <= BASE_CAPACITY_AT_24PT:
-                font_size_pt = MAX_FONT_SIZE
-            else:
-                # Scaling formula
-                import math
-                ratio = BASE_CAPACITY_AT_24PT / total_text_len
-                scale_factor = math.sqrt(ratio)
-                font_size_pt = max(min(MAX_FONT_SIZE * scale_factor, MAX_FONT_SIZE), MIN_FONT_SIZE)
-            
-            # Apply calculated font size AND set AutoFit
-            tf.word_wrap = True
-            tf.auto_size = MSO_AUTO_SIZE.TEXT_TO_FIT_SHAPE # Re-enable Native Auto-Fit
-            
-            # Clear default paragraph
-            tf.clear()
-            
-            content = slide_data.get("content", [])
-            for i, item in enumerate(content):
-                # Reuse the first paragraph if it exists
-                if i == 0 and len(tf.paragraphs) == 1:
-                    p = tf.paragraphs[0]
-                else:
-                    p = tf.add_paragraph()
-                p.level = 0
-                
-                # Parse markdown
-                parts = re.split(r'(\*\*.*?\*\*)', str(item))
-                
-                for part in parts:
-                    if not part: continue
-                    
-                    run = p.add_run()
-                    # Check for bold marker
-                    if part.startswith('**') and part.endswith('**'):
-                        text_content = part[2:-2] # Strip **
-                        run.text = text_content
-                        run.font.bold = True
-                        run.font.color.rgb = RGBColor(0, 112, 192) # Emphasis Blue
-                    else:
-                        run.text = part
-                        
-                    run.font.size = Pt(font_size_pt) # Set the safe start size
-                
-                # Adjust spacing based on size
-                # Smaller text needs less spacing
-                spacing = max(3, font_size_pt * 0.3)
-                p.space_before = Pt(spacing)
-                p.space_after = Pt(spacing)
-        
-        # Set Speaker Notes
-        
-        # Set Speaker Notes
-        notes = slide_data.get("notes", "")
-        if notes:
-            if slide.has_notes_slide:
-                notes_slide = slide.notes_slide
-                notes_slide.notes_text_frame.text = notes
+    plan = prepared.content_plan
+    content_layout = prs.slide_layouts[plan.layout_index]
+    if auto_split:
+        slides_content = split_overflowing_slides(slides_content, plan)
+
+    if fast_writer is None:
+        fast_writer = len(slides_content) >= FAST_WRITER_MIN_SLIDES
+
+    if fast_writer:
+        from pptx_fast_writer import add_content_slides, streaming_supported
+        if not streaming_supported():
+            import pptx
+            safe_print(f"⚠️ Streaming writer not tested on python-pptx {pptx.__version__}; using add_slide.")
+            fast_writer = False
+    if fast_writer:
+        add_content_slides(prs, prepared, slides_content)
+    else:
+        for slide_data in slides_content:
+            slide = prs.slides.add_slide(content_layout)
+            placeholders = {ph.placeholder_format.idx: ph for ph in slide.placeholders}
+            fill_content_slide(placeholders.get(plan.title_idx), placeholders.get(plan.body_idx), slide_data, plan)
+
+            # Set Speaker Notes (notes_slide creates the notes page; new slides never have one)
+            notes = slide_data.get("notes", "")
+            if notes:
+                write_slide_notes(slide.notes_slide, notes)
+
+    if slim:
+        stats = slim_presentation(prs)
+        if stats["parts_removed"]:
+            safe_print(f"🗜️ Slimmed deck: -{stats['layouts_removed']} layouts, -{stats['masters_removed']} masters, "
+                       f"-{stats['media_removed']} media ({stats['media_retargeted']} duplicate refs), "
+                       f"{stats['bytes_saved'] / 1024:.0f} KB saved")
 
     # Save to BytesIO
     output = io.BytesIO()
@@ -0,0 +1,265 @@
+import io
+import json
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+from pptx.enum.shapes import PP_PLACEHOLDER
+from pptx.util import Emu, Pt
+from utils import safe_print
+from cache_store import content_hash
+from text_metrics import find_font_file, split_words, word_widths, line_starts, paragraph_spacing, LINE_SPACING
+from slide_engine import (
+    get_prepared_template, split_overflowing_slides, measure_content_slide, body_text_box_pt,
+    TITLE_LEFT, TITLE_TOP, BODY_SIDE_MARGIN, TITLE_BODY_GAP, TEXT_INSET_LR, TEXT_INSET_TB, TITLE_FONT_SIZE,
+)
+
+# PNG thumbnails of a deck, drawn without PowerPoint.
+# Each slide is drawn from the same geometry create_pptx writes (measure_content_slide,
+# LayoutPlan, the title layout's placeholders) with text wrapped by text_metrics, the way
+# layout_visualizer.draw_slide_ascii draws boxes, but as a raster image with the text in it.
+# Rendering runs in a small process pool; thumbnails are cached by the hash of what they show,
+# so re-previewing a deck after an edit only draws the slides that changed.
+
+THUMBNAIL_WIDTH = 320
+PREVIEW_WORKERS = 2
+PREVIEW_CACHE_SIZE = 2048
+
+BOX_COLOR = (203, 213, 225)
+OVERFLOW_COLOR = (220, 38, 38)
+TEXT_COLOR = (30, 41, 59)
+EMPHASIS_COLOR = (0, 112, 192)  # Same blue as bold runs in the deck
+FALLBACK_FONT_FAMILY = "DejaVu Sans"
+SUBTITLE_TEXT = "Được tạo bởi SlideGenius"
+
+_thumbnail_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class _GlyphFont:
+    """
+    PIL font with a per-character mask cache. Pillow rasterizes every glyph again on each
+    draw.text call; thumbnails repeat the same few dozen characters, so pasting cached
+    masks is an order of magnitude faster (no kerning, invisible at thumbnail size).
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self.glyphs = {}
+
+    def glyph(self, char: str) -> tuple:
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            mask, offset = self.font.getmask2(char, mode="L")
+            image = Image.frombytes("L", mask.size, bytes(mask)) if mask.size[0] and mask.size[1] else None
+            glyph = self.glyphs[char] = (image, offset, self.font.getlength(char))
+        return glyph
+
+    def length(self, text: str) -> float:
+        return sum(self.glyph(c)[2] for c in text)
+
+
+@lru_cache(maxsize=128)
+def _pil_font(family: str | None, bold: bool, size_px: int) -> _GlyphFont:
+    path = (family and find_font_file(family, bold)) or find_font_file(FALLBACK_FONT_FAMILY, bold)
+    if path:
+        try:
+            return _GlyphFont(ImageFont.truetype(path, size_px, layout_engine=ImageFont.Layout.BASIC))
+        except OSError:
+            pass
+    return _GlyphFont(ImageFont.load_default(size_px))
+
+
+class _Canvas:
+    """Slide-sized PIL image addressed in EMU."""
+
+    def __init__(self, slide_size: tuple, width_px: int):
+        self.scale = width_px / slide_size[0]
+        self.image = Image.new("RGB", (width_px, max(1, round(slide_size[1] * self.scale))), "white")
+        self.draw = ImageDraw.Draw(self.image)
+
+    def px(self, emu) -> int:
+        return round(emu * self.scale)
+
+    def box(self, left, top, width, height, color=BOX_COLOR):
+        self.draw.rectangle(
+            [self.px(left), self.px(top), self.px(left + width) - 1, self.px(top + height) - 1], outline=color
+        )
+
+    def text(self, x: float, y: int, text: str, font: _GlyphFont, color, width_px: float | None = None):
+        """
+        Draws text at pixel (x, y) (top-left). width_px: the measured width; advances are
+        scaled to it so a stand-in font (template font not installed) keeps the measured layout.
+        """
+        factor = width_px / font.length(text) if width_px and font.length(text) else 1.0
+        for char in text:
+            mask, offset, advance = font.glyph(char)
+            if mask is not None:
+                self.image.paste(color, (round(x) + offset[0], y + offset[1]), mask)
+            x += advance * factor
+
+    def paragraph(self, text: str, left, top, width_pt: float, size_pt: float, family: str | None,
+                  bold: bool = False, center_width=None):
+        """Draws text wrapped at width_pt starting at (left, top); returns the EMU y below it."""
+        words = split_words(text)
+        widths, space = word_widths(text, family, bold)
+        starts = line_starts(text, width_pt, size_pt, family, bold)
+        em_px = self.scale * Pt(size_pt)
+        line_height = Pt(size_pt * LINE_SPACING)
+        fonts = {b: _pil_font(family, b, max(1, round(em_px))) for b in (False, True)}
+        for line_no, (start, end) in enumerate(zip(starts, starts[1:] + [len(words)])):
+            y = self.px(top + line_height * line_no)
+            x = self.px(left)
+            if center_width is not None:
+                line_em = sum(widths[start:end]) + space * (end - start - 1)
+                x += max(0, (self.px(center_width) - line_em * em_px) / 2)
+            for (word, word_bold), width in zip(words[start:end], widths[start:end]):
+                color = EMPHASIS_COLOR if word_bold and not bold else TEXT_COLOR
+                self.text(x, y, word, fonts[bold or word_bold], color, width * em_px)
+                x += (width + space) * em_px
+        return top + line_height * len(starts)
+
+    def png(self) -> bytes:
+        buffer = io.BytesIO()
+        # Thumbnails are flat colors: fast compression is nearly as small
+        self.image.save(buffer, format="PNG", compress_level=1)
+        return buffer.getvalue()
+
+
+def _render_title_slide(title: str, geometry: list, slide_size: tuple, width_px: int) -> bytes:
+    canvas = _Canvas(slide_size, width_px)
+    title_ph = next((g for g in geometry if g[1] in (PP_PLACEHOLDER.TITLE, PP_PLACEHOLDER.CENTER_TITLE)), None)
+    texts = [(title_ph, title.upper(), TITLE_FONT_SIZE, True)]
+    # create_pptx writes the subtitle into the second placeholder
+    if len(geometry) > 1:
+        texts.append((geometry[1], SUBTITLE_TEXT, TITLE_FONT_SIZE / 2, False))
+    for ph, text, size_pt, bold in texts:
+        if ph is None or None in ph[2:]:
+            continue
+        _, _, left, top, width, height = ph
+        canvas.box(left, top, width, height)
+        text_width = Emu(width - 2 * TEXT_INSET_LR)
+        canvas.paragraph(text, left + TEXT_INSET_LR, top + TEXT_INSET_TB, text_width.pt, size_pt, None,
+                         bold=bold, center_width=text_width)
+    return canvas.png()
+
+
+def _render_content_slide(slide_data: dict, plan, slide_size: tuple, width_px: int) -> bytes:
+    canvas = _Canvas(slide_size, width_px)
+    clean_title, title_height, font_size_pt = measure_content_slide(slide_data, plan)
+    if plan.title_idx is not None:
+        canvas.box(TITLE_LEFT, TITLE_TOP, plan.title_width, title_height)
+        title_width_pt = plan.title_width.pt - 2 * TEXT_INSET_LR.pt
+        canvas.paragraph(clean_title, TITLE_LEFT + TEXT_INSET_LR, TITLE_TOP, title_width_pt,
+                         plan.title_font_pt, plan.title_font_family, bold=True)
+    if plan.body_idx is not None:
+        top = TITLE_TOP + title_height + TITLE_BODY_GAP
+        height = plan.body_max_height - title_height
+        text_width_pt, _ = body_text_box_pt(plan, title_height.pt)
+        left = BODY_SIDE_MARGIN + TEXT_INSET_LR + plan.body_indent
+        spacing = Pt(paragraph_spacing(font_size_pt))
+        y = top + TEXT_INSET_TB
+        bullet_font = _pil_font(plan.body_font_family, False, max(1, canvas.px(Pt(font_size_pt))))
+        for item in slide_data.get("content", []):
+            y += spacing
+            canvas.text(canvas.px(left - plan.body_indent), canvas.px(y), "•", bullet_font, TEXT_COLOR)
+            y = canvas.paragraph(str(item), left, y, text_width_pt, font_size_pt, plan.body_font_family) + spacing
+        # Text PowerPoint would have to shrink past the measured size shows as a red box
+        canvas.box(BODY_SIDE_MARGIN, top, plan.body_width, height,
+                   OVERFLOW_COLOR if y > top + height - TEXT_INSET_TB else BOX_COLOR)
+    return canvas.png()
+
+
+def _render_batch(jobs: list) -> list:
+    """Worker entry point: [(key, kind, args), ...] -> [(key, png), ...]."""
+    renderers = {"title": _render_title_slide, "content": _render_content_slide}
+    return [(key, renderers[kind](*args)) for key, kind, args in jobs]
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: forking the (multi-threaded) web server can copy held locks into the child
+            _executor = ProcessPoolExecutor(PREVIEW_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def warm_up():
+    """Starts the worker processes ahead of the first preview (imports take ~1s per process)."""
+    executor = _get_executor()
+    for _ in range(PREVIEW_WORKERS):
+        executor.submit(_render_batch, [])
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _preview_jobs(json_data: dict, template_pptx_bytes: bytes | None, auto_split: bool, width_px: int) -> list:
+    """[(key, kind, args), ...] for every slide create_pptx would produce, in deck order."""
+    prepared = get_prepared_template(template_pptx_bytes)
+    plan = prepared.content_plan
+    slide_size = tuple(int(v) for v in prepared.slide_size)
+    geometry = prepared.placeholder_geometry[prepared.title_layout_index]
+    title = json_data.get("title", "Bài thuyết trình AI")
+    jobs = [("title", (title, geometry, slide_size, width_px))]
+    slides = json_data.get("slides", [])
+    if auto_split:
+        slides = split_overflowing_slides(slides, plan)
+    jobs += [("content", (slide_data, plan, slide_size, width_px)) for slide_data in slides]
+
+    def key_of(kind, args):
+        # Geometry/plan are part of the key: the same slide looks different in another template
+        return content_hash(json.dumps([kind, args], ensure_ascii=False, default=int))
+
+    return [(key_of(kind, args), kind, args) for kind, args in jobs]
+
+
+def render_thumbnails(json_data: dict, template_pptx_bytes: bytes | None = None, auto_split: bool = True,
+                      width_px: int = THUMBNAIL_WIDTH, use_processes: bool = True) -> list[bytes]:
+    """
+    PNG thumbnails of the deck create_pptx(json_data, template_pptx_bytes, auto_split) builds,
+    title slide first. Only slides missing from the cache are drawn.
+    """
+    jobs = _preview_jobs(json_data, template_pptx_bytes, auto_split, width_px)
+    with _cache_lock:
+        missing = list({key: (key, kind, args) for key, kind, args in jobs if key not in _thumbnail_cache}.values())
+    rendered = []
+    if missing and use_processes:
+        executor = _get_executor()
+        batches = [missing[i::PREVIEW_WORKERS] for i in range(PREVIEW_WORKERS)]
+        try:
+            for future in [executor.submit(_render_batch, batch) for batch in batches if batch]:
+                rendered += future.result()
+        except (BrokenProcessPool, OSError) as e:
+            safe_print(f"⚠️ Preview workers unavailable, rendering in-process: {e}")
+            shutdown()
+            rendered = []
+    if missing and not rendered:
+        rendered = _render_batch(missing)
+
+    with _cache_lock:
+        for key, png in rendered:
+            _thumbnail_cache[key] = png
+        thumbnails = []
+        for key, _, _ in jobs:
+            _thumbnail_cache.move_to_end(key)
+            thumbnails.append(_thumbnail_cache[key])
+        while len(_thumbnail_cache) > PREVIEW_CACHE_SIZE:
+            _thumbnail_cache.popitem(last=False)
+    return thumbnails
+
+
+def clear_thumbnail_cache():
+    with _cache_lock:
+        _thumbnail_cache.clear()
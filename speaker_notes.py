@@ -0,0 +1,113 @@
+import os
+import json
+from collections import namedtuple
+from google.genai import types
+from utils import safe_print
+from ai_engine import generate_content_v2, rotate_keys, robust_json_parse
+from map_reduce import run_parallel, default_concurrency
+from deck_store import load_deck, save_deck
+from stage_profiles import stage_config
+
+# Speaker notes written after the deck, off the critical path.
+# With analyze_document(with_notes=False) the slide call only writes titles and bullets, which
+# cuts its output tokens; the .pptx is returned right away. Notes are then written from the
+# slides themselves in small batches (in parallel across the key pool) and saved as a revision
+# of the stored deck, which the UI offers as a second download.
+
+# Slides per notes call: small batches keep each response short and retries cheap
+NOTES_BATCH_SLIDES = 10
+
+NotesBatch = namedtuple("NotesBatch", ["index", "title", "slide_indices"])
+
+NOTES_INSTRUCTION = """
+Bạn là chuyên gia thuyết trình. Hãy viết GHI CHÚ cho người thuyết trình (speaker notes) cho từng slide:
+- 60-120 từ mỗi slide, văn nói tự nhiên, giải thích và mở rộng các ý trên slide, có ví dụ hoặc câu chuyển ý.
+- Không lặp lại nguyên văn các gạch đầu dòng. Tiếng Việt, chuyên nghiệp.
+- Trả về JSON: {"notes": ["ghi chú slide thứ nhất", "..."]} đúng thứ tự và đúng số lượng slide được gửi.
+"""
+
+NOTES_PROMPT = """
+Bài thuyết trình: "{deck_title}". Viết ghi chú cho {count} slide sau:
+{slides_json}
+"""
+
+
+def slides_missing_notes(deck: dict) -> list[int]:
+    return [i for i, slide in enumerate(deck.get("slides", [])) if not str(slide.get("notes") or "").strip()]
+
+
+def _notes_from_response(text: str) -> list[str]:
+    data = robust_json_parse(text)
+    if isinstance(data, dict):
+        data = data.get("notes", data.get("slides", []))
+    notes = []
+    for item in data if isinstance(data, list) else []:
+        notes.append(str(item.get("notes", "") if isinstance(item, dict) else item).strip())
+    return notes
+
+
+def fill_speaker_notes(key: str, api_key=None, api_keys: list[str] = None, max_concurrency: int | None = None,
+                       progress_callback=None, cancel_check=None, generate_fn=None) -> dict:
+    """
+    Writes notes for every slide of the stored deck `key` that has none and saves the result
+    as a revision of it. A failed batch leaves its slides without notes; the others are still saved.
+    Returns: the new stored record (the original one if nothing was missing).
+    Raises the batch error when every batch failed.
+    """
+    keys_to_use = []
+    if api_keys and len(api_keys) > 0:
+        keys_to_use = api_keys
+    elif api_key:
+        keys_to_use = [api_key]
+    else:
+        env_key = os.environ.get("GOOGLE_API_KEY")
+        if env_key:
+            keys_to_use = [env_key]
+    if not keys_to_use:
+        raise ValueError("Thiếu Google API Key.")
+    record = load_deck(key)
+    if record is None:
+        raise ValueError("Không tìm thấy bản slide đã lưu.")
+    deck = record["deck"]
+    missing = slides_missing_notes(deck)
+    if not missing:
+        return record
+
+    generate_fn = generate_fn or generate_content_v2
+    slides = [dict(slide) for slide in deck.get("slides", [])]
+    batches = [
+        NotesBatch(b, f"slide {missing[start] + 1}-{missing[min(start + NOTES_BATCH_SLIDES, len(missing)) - 1] + 1}",
+                   missing[start:start + NOTES_BATCH_SLIDES])
+        for b, start in enumerate(range(0, len(missing), NOTES_BATCH_SLIDES))
+    ]
+    config, models = stage_config("notes", system_instruction=NOTES_INSTRUCTION, response_mime_type="application/json")
+
+    def write_batch(i, batch):
+        targets = [{"title": slides[j].get("title", ""), "content": slides[j].get("content", [])} for j in batch.slide_indices]
+        prompt = NOTES_PROMPT.format(deck_title=deck.get("title", ""), count=len(targets),
+                                     slides_json=json.dumps(targets, ensure_ascii=False, indent=1))
+        text, _ = generate_fn(rotate_keys(keys_to_use, i), [types.Part.from_text(text=prompt)], config,
+                              model_list=models, cancel_check=cancel_check)
+        return _notes_from_response(text)
+
+    concurrency = max_concurrency or default_concurrency(keys_to_use)
+    safe_print(f"📝 Writing speaker notes for {len(missing)} slides in {len(batches)} batches...")
+    results = run_parallel(batches, write_batch, concurrency, "Notes", progress_callback, cancel_check,
+                           return_exceptions=True)
+    failed = [r for r in results if isinstance(r, Exception)]
+    if len(failed) == len(batches):
+        raise failed[0]
+
+    written = 0
+    for batch, notes in zip(batches, results):
+        if isinstance(notes, Exception):
+            continue
+        # A short answer leaves the remaining slides of the batch without notes
+        for j, note in zip(batch.slide_indices, notes):
+            if note:
+                slides[j]["notes"] = note
+                written += 1
+    safe_print(f"📝 Speaker notes written for {written}/{len(missing)} slides.")
+    new_key = save_deck(dict(deck, slides=slides), record["document_hash"], record["options"], record["model"],
+                        parent=key)
+    return load_deck(new_key)
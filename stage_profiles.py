@@ -0,0 +1,118 @@
+import os
+import json
+import threading
+from collections import namedtuple
+from google.genai import types
+from utils import safe_print
+
+# Per-stage generation profiles.
+# Every pipeline stage (slide analysis, outline, Librarian, Analyst, Editor...) used the same
+# model chain with ad hoc temperatures, so a cheap classification waited on the strongest model.
+# A profile declares, per stage: the model preference list (None = ai_engine.ROBUST_MODEL_LIST),
+# temperature, max output tokens and thinking budget (None = model default).
+# DEFAULT_PROFILES below is the only place defaults live. PROFILES_FILE (JSON, same keys as
+# StageProfile) holds overrides only: the stages/fields it lists replace the defaults, everything
+# else keeps them. It is reloaded when the file's mtime changes, so edits apply without a restart.
+# A file that fails to parse is logged and the last good profiles stay in use.
+
+PROFILES_FILE = os.environ.get(
+    "SLIDEGENIUS_STAGE_PROFILES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "stage_profiles.json"))
+
+StageProfile = namedtuple("StageProfile", ["models", "temperature", "max_output_tokens", "thinking_budget"])
+
+# Fast models first: for short, structured answers (classification)
+FAST_MODEL_LIST = ["gemini-2.5-flash", "gemini-3-flash-preview", "gemini-2.0-flash", "gemini-1.5-flash"]
+
+DEFAULT_PROFILES = {
+    "slides": StageProfile(None, 0.7, None, None),
+    "outline": StageProfile(None, 0.3, None, None),
+    "notes": StageProfile(None, 0.7, None, None),
+    "map": StageProfile(None, 0.3, None, None),
+    "summary": StageProfile(None, 0.4, None, None),
+    "summary_v1": StageProfile(None, 0.5, None, None),
+    "deep_dive": StageProfile(None, 0.4, None, None),
+    "commentary": StageProfile(None, 0.4, None, None),
+    "librarian": StageProfile(FAST_MODEL_LIST, 0.3, None, None),
+    "analyst": StageProfile(None, 0.6, None, None),
+    "editor": StageProfile(None, 0.6, None, None),
+}
+# Stages missing from DEFAULT_PROFILES and from the file
+FALLBACK_PROFILE = StageProfile(None, 0.7, None, None)
+
+_lock = threading.Lock()
+_loaded = {"path": None, "mtime": None, "profiles": DEFAULT_PROFILES}
+
+
+def _optional(value, kind, field: str, stage: str):
+    if value is None:
+        return None
+    if kind is float and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+    if not isinstance(value, kind) or isinstance(value, bool):
+        raise ValueError(f"stage '{stage}': '{field}' must be {kind.__name__}")
+    return value
+
+
+def parse_profiles(raw: dict) -> dict[str, StageProfile]:
+    """Defaults overridden by the file's stages/fields. Raises ValueError on a malformed entry."""
+    if not isinstance(raw, dict):
+        raise ValueError("profiles file must hold a JSON object of stages")
+    profiles = dict(DEFAULT_PROFILES)
+    for stage, fields in raw.items():
+        if not isinstance(fields, dict):
+            raise ValueError(f"stage '{stage}' must be an object")
+        unknown = set(fields) - set(StageProfile._fields)
+        if unknown:
+            raise ValueError(f"stage '{stage}': unknown fields {sorted(unknown)}")
+        base = profiles.get(stage, FALLBACK_PROFILE)._asdict()
+        if "models" in fields:
+            models = fields["models"]
+            if models is not None and (not isinstance(models, list) or not all(isinstance(m, str) for m in models)):
+                raise ValueError(f"stage '{stage}': 'models' must be a list of model names")
+            base["models"] = models or None
+        for field, kind in (("temperature", float), ("max_output_tokens", int), ("thinking_budget", int)):
+            if field in fields:
+                base[field] = _optional(fields[field], kind, field, stage)
+        profiles[stage] = StageProfile(**base)
+    return profiles
+
+
+def load_profiles() -> dict[str, StageProfile]:
+    """Current profiles, re-read when PROFILES_FILE changed on disk."""
+    path = PROFILES_FILE
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    with _lock:
+        if _loaded["path"] == path and _loaded["mtime"] == mtime:
+            return _loaded["profiles"]
+        profiles = DEFAULT_PROFILES
+        if mtime is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    profiles = parse_profiles(json.load(f))
+                safe_print(f"⚙️ Stage profiles loaded from {path}")
+            except (OSError, ValueError) as e:
+                safe_print(f"⚠️ Stage profiles not reloaded ({path}): {e}")
+                profiles = _loaded["profiles"]
+        _loaded.update(path=path, mtime=mtime, profiles=profiles)
+        return profiles
+
+
+def get_profile(stage: str) -> StageProfile:
+    return load_profiles().get(stage, FALLBACK_PROFILE)
+
+
+def stage_config(stage: str, **config) -> tuple[types.GenerateContentConfig, list[str] | None]:
+    """
+    (GenerateContentConfig, model_list) for one call of a stage.
+    config: the call's own fields (system_instruction, response_mime_type...); the profile adds the rest.
+    """
+    profile = get_profile(stage)
+    if profile.max_output_tokens is not None:
+        config.setdefault("max_output_tokens", profile.max_output_tokens)
+    if profile.thinking_budget is not None:
+        config.setdefault("thinking_config", types.ThinkingConfig(thinking_budget=profile.thinking_budget))
+    config.setdefault("temperature", profile.temperature)
+    return types.GenerateContentConfig(**config), (list(profile.models) if profile.models else None)
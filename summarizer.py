@@ -4,9 +4,16 @@ import json
 import time
 import random
 import concurrent.futures
+import threading
 from google import genai
 from google.genai import types
-from document_loader import load_document
+from document_loader import load_structured_document, extract_metadata
+from book_classifier import classify_locally, librarian_from_metadata, FICTION, NON_FICTION
+from text_normalizer import normalize_document_for_prompt
+from map_reduce import condense_document, should_map_reduce, default_concurrency, run_parallel
+from cache_store import cache_get, cache_put, content_hash, keep_on_size_prune
+from section_retrieval import focus_document
+from text_compressor import compress_for_prompt
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import simpleSplit
@@ -19,7 +26,10 @@ from reportlab.lib import colors
 from reportlab.lib import colors
 import re
 from utils import safe_print
-from ai_engine import generate_with_retry_v2, generate_content_v2
+from ai_engine import generate_with_retry_v2, generate_content_v2, rotate_keys, last_output_tokens
+from wire_format import (COMPACT_SUMMARY_INSTRUCTION, COMPACT_DEEP_DIVE_INSTRUCTION, COMPACT_COMMENTARY_FORMAT,
+                         expand_summary, expand_deep_dive, log_wire_stats)
+from stage_profiles import stage_config, get_profile
 
 # Try to register a font that supports Vietnamese if possible
 # Typically Arial or Times New Roman. 
@@ -90,6 +100,12 @@ Yêu cầu:
 
 PROMPT_SUMMARIZE_DOCUMENT = "Hãy tóm tắt tài liệu này theo cấu trúc JSON đã yêu cầu."
 
+# Token budgets for the extractive pre-compression (text_compressor.py), per pipeline.
+# Summaries need full coverage, so they rely on map-reduce instead (None = off).
+SUMMARY_TOKEN_BUDGET = None
+# The review sends the whole book to both the Librarian and the Analyst
+REVIEW_TOKEN_BUDGET = 150_000
+
 # New Prompts for Deep Dive (Single Shot)
 # New Prompts for Deep Dive (Single Shot)
 # New Prompts for Deep Dive (Single Shot)
@@ -142,6 +158,72 @@ LƯU Ý:
 - JSON: Không được lỗi cú pháp.
 """
 
+# Staged Deep Dive: the single-shot prompt writes 5-7 essays of 200-300 words in one response,
+# which is slow and often truncated. A skeleton call writes everything but the commentaries,
+# then each core idea's commentary is written by its own call, concurrently across the key pool.
+PROMPT_DEEP_DIVE_SKELETON = """
+Hãy đóng vai một "Người Sưu Tầm Trí Tuệ" (Wisdom Collector) và lập KHUNG cho bản tóm tắt sách theo phong cách "Big Ideas".
+Phần phân tích chi tiết của từng ý tưởng sẽ được viết ở bước sau, CHƯA viết ở đây.
+
+Bạn PHẢI trả về kết quả dưới dạng JSON hợp lệ với cấu trúc sau:
+
+{
+  "metadata": {
+    "title": "Tên sách",
+    "slogan": "Một câu slogan ngắn gọn hoặc mô tả thu hút về sách",
+    "author": "Tên tác giả"
+  },
+  "big_ideas": ["Ý tưởng lớn 1 (3-5 từ, giật gân)", "... (5-7 ý)"],
+  "introduction": {
+    "text": "Đoạn giới thiệu 100-150 từ. Bối cảnh, tầm quan trọng, giọng văn hào hứng.",
+    "best_quote": "Trích dẫn hay nhất hoặc bao quát nhất của cuốn sách"
+  },
+  "core_ideas": [
+    {
+      "title": "TÊN Ý TƯỞNG LỚN 1",
+      "quote": "Trích dẫn nguyên văn đắt giá nhất liên quan đến ý tưởng này.",
+      "brief": "1-2 câu: ý tưởng này nói gì và phần phân tích nên đào sâu vào đâu."
+    },
+    "... (5-7 ý tưởng cốt lõi, ý cuối cùng là HÀNH ĐỘNG)"
+  ],
+  "about_author": "Tóm tắt tiểu sử tác giả ngắn gọn.",
+  "about_creator": "SlideGenius AI: Chúng tôi cam kết chắt lọc những tinh hoa tri thức để giúp bạn tiết kiệm thời gian."
+}
+
+LƯU Ý:
+- Ngôn ngữ: Tiếng Việt (trừ các tên riêng).
+- JSON: Không được lỗi cú pháp.
+"""
+
+PROMPT_DEEP_DIVE_COMMENTARY = """
+Sách: "{book_title}" ({author}). Các ý tưởng cốt lõi của bản tóm tắt:
+{ideas}
+
+Hãy viết phần PHÂN TÍCH CHUYÊN SÂU (200-300 từ) cho ý tưởng {number}: "{title}".
+Trích dẫn: "{quote}"
+Định hướng: {brief}
+
+Viết thành một bài tiểu luận ngắn: 1. Giải thích cơ chế/nguyên lý của ý tưởng dưới góc độ khoa học/tâm lý học.
+2. So sánh với các học thuyết khác. 3. Đưa ra ví dụ áp dụng cụ thể và các bẫy tư duy cần tránh.
+Không lặp lại nội dung của các ý tưởng khác. Tiếng Việt, giọng văn truyền cảm hứng, sâu sắc, trực diện.
+
+{answer_format}
+"""
+
+COMMENTARY_JSON_FORMAT = 'Trả về JSON hợp lệ: {"commentary": "..."}'
+
+# Fixed closing paragraph of every Deep Dive (the compact format fills it in locally)
+ABOUT_CREATOR = "SlideGenius AI: Chúng tôi cam kết chắt lọc những tinh hoa tri thức để giúp bạn tiết kiệm thời gian."
+# What the third element of a compact core idea holds, per Deep Dive prompt
+COMPACT_COMMENTARY_DETAIL = "Phân tích chuyên sâu 200-300 từ"
+COMPACT_BRIEF_DETAIL = "1-2 câu: ý tưởng này nói gì và phần phân tích nên đào sâu vào đâu"
+
+# Staged Deep Dive returns what is finished when this many seconds have passed (None = wait for all).
+# Off by default: with one key the commentaries run one after another and would overrun any fixed budget.
+DEEP_DIVE_DEADLINE_SECONDS = None
+# PDF note under an idea whose commentary did not finish in time (its short brief is printed instead)
+TRUNCATED_IDEA_NOTE = "(Bản tóm lược ngắn: phần phân tích chi tiết chưa hoàn thành trước hạn giờ.)"
+
 def robust_json_parse(text):
     """Parses JSON robustly (reused logic)."""
     text = text.strip()
@@ -198,18 +280,15 @@ def summarize_document(file_bytes: bytes, mime_type: str, api_key: str = None, a
         parts.append(types.Part.from_text(text=base_prompt))
     else:
         # Load text for DOCX/EPUB
-        text_content = load_document(file_bytes, mime_type)
+        text_content = normalize_document_for_prompt(load_structured_document(file_bytes, mime_type)).text
         full_prompt = f"Nội dung tài liệu:\n{text_content}\n\n{base_prompt}"
         parts.append(types.Part.from_text(text=full_prompt))
 
-    config = types.GenerateContentConfig(
-        system_instruction=SUMMARIZER_SYSTEM_INSTRUCTION,
-        response_mime_type="application/json",
-        temperature=0.5
-    )
+    config, models = stage_config("summary_v1", system_instruction=SUMMARIZER_SYSTEM_INSTRUCTION,
+                                  response_mime_type="application/json")
 
     try:
-        response_text, _ = generate_content_v2(keys_to_use, parts, config, cancel_check=cancel_check)
+        response_text, _ = generate_content_v2(keys_to_use, parts, config, model_list=models, cancel_check=cancel_check)
         return robust_json_parse(response_text)
     except Exception as e:
         raise ValueError(f"Tóm tắt thất bại: {str(e)}")
@@ -550,6 +629,9 @@ def save_summary_to_pdf(summary_data: dict, output_filename: str = "summary.pdf"
                 # Render HTML/XML formatting in commentary
                 xml_commentary = markdown_to_xml(commentary)
                 elements.append(Paragraph(xml_commentary, body_style))
+                if idea.get("truncated"):
+                    elements.append(Paragraph(f"<i>{TRUNCATED_IDEA_NOTE}</i>",
+                        ParagraphStyle('TruncatedNote', parent=body_style, fontSize=9, textColor=colors.grey)))
                 
             elements.append(Spacer(1, 10))
             elements.append(Paragraph("---", ParagraphStyle('Line', parent=body_style, alignment=TA_CENTER)))
@@ -637,9 +719,41 @@ def save_summary_to_pdf(summary_data: dict, output_filename: str = "summary.pdf"
     doc.build(story, onFirstPage=add_footer, onLaterPages=add_footer)
     return os.path.abspath(output_filename)
 
-def summarize_document_v2(file_bytes, mime_type, api_key=None, api_keys=None, user_instructions="", cancel_check=None):
+def _load_text_for_prompt(file_bytes, mime_type, keys_to_use, map_reduce=None, max_concurrency=None, progress_callback=None, cancel_check=None, user_instructions="",
+                          token_budget=None) -> str:
+    """
+    Loads + normalizes DOCX/EPUB/TXT text for the single-shot prompts.
+    Focused instructions ("chỉ chương 3") keep only the relevant sections (see section_retrieval.py).
+    token_budget: extractive TextRank compression down to this many tokens (see text_compressor.py).
+    Long books (or map_reduce=True) are condensed chunk-by-chunk first (see map_reduce.py).
+    Not used for PDFs: they are attached as-is (no text extraction dependency), so a long PDF
+    book still goes out as one request, without normalization, focus, compression or map-reduce.
+    """
+    document = normalize_document_for_prompt(load_structured_document(file_bytes, mime_type))
+    focused_text = focus_document(document, user_instructions)
+    if focused_text is not None:
+        return focused_text
+    document = compress_for_prompt(document, token_budget)
+    text_content = document.text
+    if map_reduce or (map_reduce is None and should_map_reduce(text_content)):
+        safe_print("Document exceeds one context window. Using Map-Reduce mode...")
+        notes = condense_document(
+            document, keys_to_use,
+            max_concurrency=max_concurrency,
+            progress_callback=progress_callback,
+            cancel_check=cancel_check
+        )
+        text_content = f"(Ghi chú đã tổng hợp theo từng phần của tài liệu gốc)\n\n{notes}"
+    return text_content
+
+def summarize_document_v2(file_bytes, mime_type, api_key=None, api_keys=None, user_instructions="", cancel_check=None,
+                          map_reduce=None, max_concurrency=None, progress_callback=None, token_budget=SUMMARY_TOKEN_BUDGET,
+                          compact_wire=False):
     """
     Summarizes document content using Gemini.
+    map_reduce: None = automatic for books beyond one context window, True/False to force.
+    token_budget: compress the text extractively to this many tokens first (None = off).
+    compact_wire: ask for the compact response format (wire_format.py) and expand it locally.
     """
     # 1. Prepare Key List
     keys_to_use = []
@@ -658,15 +772,13 @@ def summarize_document_v2(file_bytes, mime_type, api_key=None, api_keys=None, us
     # Prepare Context
     parts = []
     if mime_type == "application/pdf":
+        # Sent whole: the text pipeline (focus, compression, map-reduce) only covers DOCX/EPUB/TXT
+        safe_print(f"PDF attached as-is ({len(file_bytes) // 1024} KB); map-reduce and compression do not apply.")
         parts.append(types.Part.from_bytes(data=file_bytes, mime_type="application/pdf"))
-    elif mime_type == "text/plain":
-         try:
-            text_content = file_bytes.decode('utf-8')
-         except:
-            text_content = file_bytes.decode('latin-1') # Fallback
-         parts.append(types.Part.from_text(text=f"Content:\n{text_content}"))
     else:
-        text_content = load_document(file_bytes, mime_type)
+        # DOCX/EPUB/TXT
+        text_content = _load_text_for_prompt(file_bytes, mime_type, keys_to_use, map_reduce, max_concurrency, progress_callback, cancel_check, user_instructions,
+                                             token_budget=token_budget)
         parts.append(types.Part.from_text(text=f"Content:\n{text_content}"))
 
     # Add the system instruction and prompt
@@ -674,15 +786,17 @@ def summarize_document_v2(file_bytes, mime_type, api_key=None, api_keys=None, us
     parts.append(types.Part.from_text(text=full_prompt))
 
     # Config
-    config = types.GenerateContentConfig(
-        system_instruction=SUMMARIZER_SYSTEM_INSTRUCTION,
-        response_mime_type="application/json",
-        temperature=0.4
+    config, models = stage_config(
+        "summary",
+        system_instruction=SUMMARIZER_SYSTEM_INSTRUCTION + (COMPACT_SUMMARY_INSTRUCTION if compact_wire else ""),
+        response_mime_type="application/json"
     )
 
     try:
         # Use rotation function which handles client creation internally
-        response_text, model_name = generate_content_v2(keys_to_use, parts, config, cancel_check=cancel_check)
+        started = time.perf_counter()
+        response_text, model_name = generate_content_v2(keys_to_use, parts, config, model_list=models, cancel_check=cancel_check)
+        log_wire_stats("Summary", compact_wire, response_text, time.perf_counter() - started, last_output_tokens())
     except Exception as e:
         raise ValueError(f"Summarization failed: {str(e)}")
 
@@ -695,6 +809,8 @@ def summarize_document_v2(file_bytes, mime_type, api_key=None, api_keys=None, us
             else:
                  safe_print("Warning: JSON response is a list. Wrapping in dict.")
                  data = {"overview": str(data)}
+        if compact_wire:
+            data = expand_summary(data)
                  
     except Exception as e:
         safe_print(f"JSON Parsing Failed: {e}")
@@ -711,9 +827,115 @@ def summarize_document_v2(file_bytes, mime_type, api_key=None, api_keys=None, us
         "used_model": model_name
     }
 
-def summarize_book_deep_dive(file_bytes: bytes, mime_type: str, api_key: str = None, api_keys: list[str] = None, cancel_check=None) -> dict:
+def _commentary_from_response(text: str) -> str:
+    try:
+        data = robust_json_parse(text)
+        if isinstance(data, dict):
+            return str(data.get("commentary", "")).strip()
+    except Exception:
+        pass
+    # Plain prose instead of JSON is still a usable commentary
+    return text.strip()
+
+def _write_commentaries(keys_to_use, context_parts, data, max_concurrency=None, deadline=None,
+                        progress_callback=None, cancel_check=None, compact_wire=False) -> list[str | None]:
+    """
+    Writes core_ideas[i].commentary concurrently. Stops waiting at the deadline (time.monotonic() value).
+    compact_wire: the essays come back as plain text instead of {"commentary": ...}.
+    Returns: commentary per idea, None where unfinished or failed.
+    """
+    ideas = data["core_ideas"]
+    metadata = data.get("metadata") or {}
+    outline = "\n".join(f"{i + 1}. {idea.get('title', '')}" for i, idea in enumerate(ideas))
+    config, models = stage_config("commentary", response_mime_type="text/plain" if compact_wire else "application/json")
+
+    def write(i, idea):
+        prompt = PROMPT_DEEP_DIVE_COMMENTARY.format(
+            book_title=metadata.get("title", ""), author=metadata.get("author", ""), ideas=outline, number=i + 1,
+            title=idea.get("title", ""), quote=idea.get("quote", ""), brief=idea.get("brief", "") or idea.get("title", ""),
+            answer_format=COMPACT_COMMENTARY_FORMAT if compact_wire else COMMENTARY_JSON_FORMAT,
+        )
+        started = time.perf_counter()
+        text, _ = generate_content_v2(rotate_keys(keys_to_use, i), context_parts + [types.Part.from_text(text=prompt)],
+                                      config, model_list=models, cancel_check=cancel_check)
+        log_wire_stats(f"Commentary {i + 1}", compact_wire, text, time.perf_counter() - started, last_output_tokens())
+        return _commentary_from_response(text)
+
+    concurrency = max_concurrency or default_concurrency(keys_to_use)
+    results = run_parallel(ideas, write, concurrency, "Commentary", progress_callback, cancel_check,
+                           deadline=deadline, return_exceptions=True)
+    # Failed and unfinished essays are both None: the caller falls back to the brief
+    return [r if isinstance(r, str) else None for r in results]
+
+def _summarize_deep_dive_staged(keys_to_use, context_parts, max_concurrency=None, deadline_seconds=None,
+                                progress_callback=None, cancel_check=None, compact_wire=False) -> tuple[dict, str]:
+    """Skeleton call, then one commentary call per core idea. Returns (deep dive data, skeleton model)."""
+    deadline = None if deadline_seconds is None else time.monotonic() + deadline_seconds
+    config, models = stage_config("deep_dive", response_mime_type="application/json")
+    prompt = PROMPT_DEEP_DIVE_SKELETON
+    if compact_wire:
+        prompt += COMPACT_DEEP_DIVE_INSTRUCTION.format(detail=COMPACT_BRIEF_DETAIL)
+    try:
+        started = time.perf_counter()
+        response_text, model_name = generate_content_v2(
+            keys_to_use, context_parts + [types.Part.from_text(text=prompt)], config, model_list=models,
+            cancel_check=cancel_check
+        )
+        log_wire_stats("Skeleton", compact_wire, response_text, time.perf_counter() - started, last_output_tokens())
+    except Exception as e:
+        raise ValueError(f"Deep Dive failed: {str(e)}")
+    try:
+        data = robust_json_parse(response_text)
+        if compact_wire:
+            data = expand_deep_dive(data, "brief", ABOUT_CREATOR)
+    except Exception as e:
+        safe_print(f"JSON Parsing Failed: {e}")
+        safe_print(f"Raw Output: {response_text[:200]}")
+        raise ValueError("Could not parse Deep Dive JSON response.")
+
+    data["core_ideas"] = [idea for idea in data.get("core_ideas", []) if isinstance(idea, dict)]
+    safe_print(f"Deep Dive skeleton: {len(data['core_ideas'])} core ideas. Writing commentaries in parallel...")
+    if progress_callback:
+        progress_callback("Skeleton", 1, 1, f"{len(data['core_ideas'])} ý tưởng cốt lõi")
+    commentaries = _write_commentaries(keys_to_use, context_parts, data, max_concurrency, deadline,
+                                       progress_callback, cancel_check, compact_wire)
+    missing = 0
+    for idea, commentary in zip(data["core_ideas"], commentaries):
+        brief = idea.pop("brief", "")
+        if not commentary:
+            # Unfinished at the deadline (or failed): the skeleton's brief keeps the idea readable
+            missing += 1
+            commentary = brief
+            idea["truncated"] = True
+        idea["commentary"] = commentary
+    data["missing_commentaries"] = missing
+    return data, model_name
+
+def _merge_file_metadata(metadata: dict, file_metadata, mime_type: str) -> dict:
+    """
+    Title/author from the file where the model left them empty. An EPUB's dc:creator is the
+    book's author and wins over the model's guess; a DOCX author is whoever saved the file.
+    """
+    metadata = dict(metadata or {})
+    if file_metadata.title and not str(metadata.get("title") or "").strip():
+        metadata["title"] = file_metadata.title
+    if file_metadata.creator and (mime_type == "application/epub+zip" or not str(metadata.get("author") or "").strip()):
+        metadata["author"] = file_metadata.creator
+    return metadata
+
+def summarize_book_deep_dive(file_bytes: bytes, mime_type: str, api_key: str = None, api_keys: list[str] = None, cancel_check=None,
+                             map_reduce=None, max_concurrency=None, progress_callback=None, token_budget=SUMMARY_TOKEN_BUDGET,
+                             staged=True, deadline_seconds=DEEP_DIVE_DEADLINE_SECONDS, compact_wire=False) -> dict:
     """
     Executes the 4-step deep dive summarization workflow.
+    map_reduce: None = automatic for books beyond one context window, True/False to force.
+    token_budget: compress the text extractively to this many tokens first (None = off).
+    staged: skeleton call + one parallel call per core idea commentary (False = single-shot prompt).
+    deadline_seconds: staged mode returns the commentaries finished by then; the others keep
+        their short brief, are flagged "truncated" (noted in the PDF) and counted in "missing_commentaries".
+        None (default) waits for every commentary.
+    compact_wire: ask for the compact response format (wire_format.py) and expand it locally.
+    The file's own metadata (EPUB OPF, DOCX core properties) fills in "metadata"; see _merge_file_metadata.
     """
     # 1. Prepare Key List
     keys_to_use = []
@@ -732,34 +954,54 @@ def summarize_book_deep_dive(file_bytes: bytes, mime_type: str, api_key: str = N
     # Prepare Context
     parts = []
     if mime_type == "application/pdf":
+        # Sent whole: the text pipeline (focus, compression, map-reduce) only covers DOCX/EPUB/TXT
+        safe_print(f"PDF attached as-is ({len(file_bytes) // 1024} KB); map-reduce and compression do not apply.")
         parts.append(types.Part.from_bytes(data=file_bytes, mime_type="application/pdf"))
-    elif mime_type == "text/plain":
-         try:
-            text_content = file_bytes.decode('utf-8')
-         except:
-            text_content = file_bytes.decode('latin-1') # Fallback
-         parts.append(types.Part.from_text(text=f"Content:\n{text_content}"))
     else:
-        text_content = load_document(file_bytes, mime_type)
+        # DOCX/EPUB/TXT
+        text_content = _load_text_for_prompt(file_bytes, mime_type, keys_to_use, map_reduce, max_concurrency, progress_callback, cancel_check,
+                                             token_budget=token_budget)
         parts.append(types.Part.from_text(text=f"Content:\n{text_content}"))
 
+    file_metadata = extract_metadata(file_bytes, mime_type)
+
+    if staged:
+        data, model_name = _summarize_deep_dive_staged(keys_to_use, parts, max_concurrency, deadline_seconds,
+                                                       progress_callback, cancel_check, compact_wire)
+        safe_print("Deep Dive Completed.")
+        return {
+            "mode": "deep_dive",
+            "metadata": _merge_file_metadata(data.get("metadata", {}), file_metadata, mime_type),
+            "big_ideas": data.get("big_ideas", []),
+            "introduction": data.get("introduction", {}),
+            "core_ideas": data.get("core_ideas", []),
+            "about_author": data.get("about_author", ""),
+            "about_creator": data.get("about_creator", ""),
+            "missing_commentaries": data.get("missing_commentaries", 0),
+            "used_model": model_name
+        }
+
     # Add the single shot prompt
-    parts.append(types.Part.from_text(text=PROMPT_DEEP_DIVE_FULL))
+    prompt = PROMPT_DEEP_DIVE_FULL
+    if compact_wire:
+        prompt += COMPACT_DEEP_DIVE_INSTRUCTION.format(detail=COMPACT_COMMENTARY_DETAIL)
+    parts.append(types.Part.from_text(text=prompt))
 
     # Config
-    config = types.GenerateContentConfig(
-        response_mime_type="application/json",
-        temperature=0.4
-    )
+    config, models = stage_config("deep_dive", response_mime_type="application/json")
 
     try:
-        response_text, model_name = generate_content_v2(keys_to_use, parts, config, cancel_check=cancel_check)
+        started = time.perf_counter()
+        response_text, model_name = generate_content_v2(keys_to_use, parts, config, model_list=models, cancel_check=cancel_check)
+        log_wire_stats("Deep Dive", compact_wire, response_text, time.perf_counter() - started, last_output_tokens())
     except Exception as e:
         raise ValueError(f"Deep Dive failed: {str(e)}")
 
     # Parse JSON
     try:
         data = robust_json_parse(response_text)
+        if compact_wire:
+            data = expand_deep_dive(data, "commentary", ABOUT_CREATOR)
     except Exception as e:
         safe_print(f"JSON Parsing Failed: {e}")
         safe_print(f"Raw Output: {response_text[:200]}")
@@ -768,7 +1010,7 @@ def summarize_book_deep_dive(file_bytes: bytes, mime_type: str, api_key: str = N
     safe_print("Deep Dive Completed.")
     return {
         "mode": "deep_dive",
-        "metadata": data.get("metadata", {}),
+        "metadata": _merge_file_metadata(data.get("metadata", {}), file_metadata, mime_type),
         "big_ideas": data.get("big_ideas", []),
         "introduction": data.get("introduction", {}),
         "core_ideas": data.get("core_ideas", []),
@@ -882,56 +1124,107 @@ Create the review using the following structure. Use icons/emojis where appropri
 *Generated by SlideGenius Expert Review Engine*
 """
 
+def _review_analyst(keys_to_use, parts, category: str, cancel_check=None, generate_fn=None) -> tuple[str, str]:
+    """Step 2 call for a category (Fiction -> literary critique, anything else -> research analysis)."""
+    generate_fn = generate_fn or generate_content_v2
+    prompt_analyst = PROMPT_REVIEW_ANALYST_FICTION if category == FICTION else PROMPT_REVIEW_ANALYST_NON_FICTION
+    config_text, models = stage_config("analyst", response_mime_type="text/plain")
+    return generate_fn(keys_to_use, parts + [types.Part.from_text(text=prompt_analyst)], config_text,
+                       model_list=models, cancel_check=cancel_check)
+
+# Librarian/Analyst outputs stored per document (cache_store.py), reused across review languages
+REVIEW_CACHE_NAMESPACE = "review_analysis"
+keep_on_size_prune(REVIEW_CACHE_NAMESPACE)
+REVIEW_ANALYSIS_FIELDS = ("librarian_data", "model1_name", "analyst_output", "model2_name")
+
 class PartialCompletionError(Exception):
     def __init__(self, message, partial_data):
         super().__init__(message)
         self.partial_data = partial_data
 
-def review_book_syntopic(file_bytes: bytes, mime_type: str, api_key: str = None, api_keys: list[str]=None, language: str = "Tiếng Việt", cancel_check=None, resume_state: dict = None) -> dict:
+def _review_cache_key(file_bytes: bytes, token_budget, use_local_metadata: bool) -> str:
+    # Prompts, the Librarian/Analyst stage profiles and the metadata shortcut are part of the key:
+    # changing any of them invalidates the stored analyses
+    profiles = repr((tuple(get_profile("librarian")), tuple(get_profile("analyst"))))
+    return content_hash(f"{content_hash(file_bytes)}|{token_budget}|{use_local_metadata}|{profiles}|"
+                        f"{PROMPT_REVIEW_LIBRARIAN}{PROMPT_REVIEW_ANALYST_FICTION}{PROMPT_REVIEW_ANALYST_NON_FICTION}")
+
+def _review_analysis(file_bytes: bytes, mime_type: str, keys_to_use: list[str], cancel_check=None, resume_state: dict = None,
+                     token_budget=REVIEW_TOKEN_BUDGET, use_local_metadata=True, speculative=True, reuse_analysis=True) -> dict:
     """
-    Executes the 3-step Syntopic Layered Analysis for Book Review.
-    Supports RESUME functionality via resume_state.
+    Steps 1-2 (Librarian, Analyst): they do not depend on the review language.
+    reuse_analysis: take them from the per-document store when this book was analysed before,
+        and store them once both are done (not when the Librarian's answer was unreadable and
+        the default classification was used).
+    Returns: the checkpoint state (librarian_data, model1_name, analyst_output, model2_name).
+    Raises PartialCompletionError with the state reached so far.
     """
-    # 1. Prepare Key List
-    keys_to_use = []
-    if api_keys and len(api_keys) > 0:
-        keys_to_use = api_keys
-    elif api_key:
-        keys_to_use = [api_key]
-    else:
-        env_key = os.environ.get("GOOGLE_API_KEY")
-        if env_key:
-            keys_to_use = [env_key]
+    current_state = resume_state.copy() if resume_state else {}
+    cache_key = _review_cache_key(file_bytes, token_budget, use_local_metadata)
+    if reuse_analysis and not current_state.get("analyst_output"):
+        stored = cache_get(REVIEW_CACHE_NAMESPACE, cache_key)
+        if stored:
+            safe_print("Skipping Steps 1-2: reusing the stored Librarian/Analyst outputs for this document.")
+            return dict(stored)
 
-    if not keys_to_use:
-        raise ValueError("Missing API Key.")
-    
     # Load Content (Only if we need it for steps not yet done)
     # Metadata for efficiency: If we are at Step 3, we technically don't need the book content if we trust Step 1/2 outputs. 
     # But Step 2 needs it.
     
     parts = None
+    document = None
     if not resume_state or not resume_state.get("analyst_output"):
         if mime_type == "application/pdf":
             parts = [types.Part.from_bytes(data=file_bytes, mime_type="application/pdf")]
         else:
-            text_content = load_document(file_bytes, mime_type)
+            document = normalize_document_for_prompt(load_structured_document(file_bytes, mime_type))
+            text_content = compress_for_prompt(document, token_budget, source="review").text
             parts = [types.Part.from_text(text=f"Content:\n{text_content}")]
 
-    # Recover State
-    current_state = resume_state.copy() if resume_state else {}
-    
     # --- STEP 1: LIBRARIAN (Classification) ---
     librarian_data = current_state.get("librarian_data")
     model1 = current_state.get("model1_name", "skipped")
+
+    local = None
+    if not librarian_data and mime_type != "application/pdf":
+        file_metadata = extract_metadata(file_bytes, mime_type)
+        local = classify_locally(file_metadata, document.text if document is not None else "")
+        if use_local_metadata and local.confident:
+            librarian_data = librarian_from_metadata(file_metadata, local, mime_type)
+            model1 = "local-metadata"
+            safe_print(f"Step 1: Librarian skipped ({local.reason}) -> {local.category} / {local.genre}")
+            current_state["librarian_data"] = librarian_data
+            current_state["model1_name"] = model1
+        elif use_local_metadata:
+            safe_print(f"Step 1: Local classification not confident ({local.reason}). Asking the Librarian.")
     
+    # Speculative Analyst: runs alongside the Librarian on the next key, only when the metadata or
+    # the text suggest a category (a blind guess would waste an Analyst call on every Fiction book)
+    speculation = None
+    discarded = threading.Event()
+    if not librarian_data and speculative and local and local.category and not current_state.get("analyst_output"):
+        guess = local.category
+        safe_print(f"Step 2 (speculative): Analyst started as {guess} while the Librarian classifies...")
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        speculative_cancel = lambda: discarded.is_set() or bool(cancel_check and cancel_check())
+        speculation = (guess, executor, executor.submit(_review_analyst, rotate_keys(keys_to_use, 1), parts, guess,
+                                                        speculative_cancel, generate_content_v2))
+
+    def stop_speculation():
+        # The flag stops the discarded call's retries and key/model fallbacks; a request already
+        # on the wire still completes in the background and its result is dropped
+        if speculation:
+            discarded.set()
+            speculation[1].shutdown(wait=False, cancel_futures=True)
+
     if not librarian_data:
         try:
             safe_print("Step 1: Librarian Agent (Classifying)...")
-            config_json = types.GenerateContentConfig(response_mime_type="text/plain", temperature=0.3)
+            config_json, models = stage_config("librarian", response_mime_type="text/plain")
             
             parts_step1 = parts + [types.Part.from_text(text=PROMPT_REVIEW_LIBRARIAN)]
-            resp1_text, model1 = generate_content_v2(keys_to_use, parts_step1, config_json, cancel_check=cancel_check)
+            resp1_text, model1 = generate_content_v2(keys_to_use, parts_step1, config_json, model_list=models,
+                                                     cancel_check=cancel_check)
             
             try:
                 librarian_data = robust_json_parse(resp1_text)
@@ -939,14 +1232,19 @@ def review_book_syntopic(file_bytes: bytes, mime_type: str, api_key: str = None,
                 genre = librarian_data.get("genre", "General")
                 safe_print(f"-> Classified as: {category} / {genre}")
             except:
-                librarian_data = {"category": "Non-Fiction", "genre": "General"}
-                safe_print("-> Librarian failed to JSON. Defaulting.")
+                # The local classification beats a blind default (and keeps a matching speculation)
+                fallback = local.category if local and local.category else NON_FICTION
+                librarian_data = {"category": fallback, "genre": "General"}
+                safe_print(f"-> Librarian failed to JSON. Defaulting to {fallback}.")
+                # A guessed classification must not be stored for reuse
+                current_state["librarian_fallback"] = True
             
             # Save Checkpoint
             current_state["librarian_data"] = librarian_data
             current_state["model1_name"] = model1
             
         except Exception as e:
+            stop_speculation()
             raise PartialCompletionError(f"Lỗi ở Bước 1 (Librarian): {str(e)}", current_state)
 
     else:
@@ -958,17 +1256,16 @@ def review_book_syntopic(file_bytes: bytes, mime_type: str, api_key: str = None,
     
     if not analyst_output:
         try:
-            safe_print("Step 2: Analyst Agent (Deep Analysis)...")
-            
-            if librarian_data.get("category") == "Fiction":
-                prompt_analyst = PROMPT_REVIEW_ANALYST_FICTION
+            category = FICTION if librarian_data.get("category") == FICTION else NON_FICTION
+            if speculation and speculation[0] == category:
+                safe_print(f"Step 2: Speculative Analyst matches the classification ({category}). Waiting for it...")
+                resp2_text, model2 = speculation[2].result()
             else:
-                prompt_analyst = PROMPT_REVIEW_ANALYST_NON_FICTION
-                
-            parts_step2 = parts + [types.Part.from_text(text=prompt_analyst)]
-            
-            config_text = types.GenerateContentConfig(response_mime_type="text/plain", temperature=0.6)
-            resp2_text, model2 = generate_content_v2(keys_to_use, parts_step2, config_text, cancel_check=cancel_check)
+                if speculation:
+                    safe_print(f"Step 2: Speculative Analyst discarded ({speculation[0]} != {category}).")
+                    stop_speculation()
+                safe_print("Step 2: Analyst Agent (Deep Analysis)...")
+                resp2_text, model2 = _review_analyst(keys_to_use, parts, category, cancel_check)
             analyst_output = resp2_text
             
             # Save Checkpoint
@@ -977,36 +1274,127 @@ def review_book_syntopic(file_bytes: bytes, mime_type: str, api_key: str = None,
             
         except Exception as e:
             raise PartialCompletionError(f"Lỗi ở Bước 2 (Analyst): {str(e)}", current_state)
+        finally:
+            stop_speculation()
     else:
          safe_print("Skipping Step 2 (Already Done).")
 
-    # --- STEP 3: EDITOR (Synthesis) ---
+    if reuse_analysis and not current_state.get("librarian_fallback"):
+        cache_put(REVIEW_CACHE_NAMESPACE, cache_key, {k: current_state[k] for k in REVIEW_ANALYSIS_FIELDS})
+    return current_state
+
+def _review_editor(keys_to_use: list[str], analysis: dict, language: str, cancel_check=None) -> dict:
+    """Step 3 for one language. Returns: the review (mode "syntopic_review")."""
     # Editor uses the partials, not the raw book (as decided previously to save tokens/context)
     safe_print(f"Step 3: Editor Agent (Writing Review in {language})...")
-    
-    try:
-        final_prompt = PROMPT_REVIEW_EDITOR.format(
-            librarian_output=json.dumps(librarian_data, ensure_ascii=False),
-            analyst_output=analyst_output,
-            language=language
-        )
-        
-        parts_step3 = [types.Part.from_text(text=final_prompt)] 
-        
-        config_text = types.GenerateContentConfig(response_mime_type="text/plain", temperature=0.6)
-        review_markdown, model3 = generate_content_v2(keys_to_use, parts_step3, config_text, cancel_check=cancel_check)
-        
-    except Exception as e:
-         # Even if Step 3 fails, we have Step 1 and 2.
-         raise PartialCompletionError(f"Lỗi ở Bước 3 (Editor): {str(e)}", current_state)
-    
-    safe_print("Syntopic Review Completed.")
-    
+    librarian_data = analysis["librarian_data"]
+    final_prompt = PROMPT_REVIEW_EDITOR.format(
+        librarian_output=json.dumps(librarian_data, ensure_ascii=False),
+        analyst_output=analysis["analyst_output"],
+        language=language
+    )
+    config_text, models = stage_config("editor", response_mime_type="text/plain")
+    review_markdown, model3 = generate_content_v2(keys_to_use, [types.Part.from_text(text=final_prompt)], config_text,
+                                                  model_list=models, cancel_check=cancel_check)
     return {
         "mode": "syntopic_review",
         "category": librarian_data.get("category"),
         "genre": librarian_data.get("genre"),
+        "language": language,
         "review_markdown": review_markdown,
-        "used_model": f"{model1}->{model2}->{model3}"
+        "used_model": f"{analysis.get('model1_name', 'skipped')}->{analysis.get('model2_name', 'skipped')}->{model3}"
     }
 
+def review_book_syntopic(file_bytes: bytes, mime_type: str, api_key: str = None, api_keys: list[str]=None, language: str = "Tiếng Việt", cancel_check=None, resume_state: dict = None,
+                         token_budget=REVIEW_TOKEN_BUDGET, use_local_metadata=True, speculative=True, reuse_analysis=True) -> dict:
+    """
+    Executes the 3-step Syntopic Layered Analysis for Book Review.
+    Supports RESUME functionality via resume_state.
+    token_budget: the book is sent to both Librarian and Analyst, so it is compressed to this size first.
+    use_local_metadata: skip the Librarian call when the file's subject metadata classifies the
+        book confidently (book_classifier.py).
+    speculative: when the Librarian has to run and the local metadata/text suggest a category,
+        start the Analyst for it at the same time; its result is used if the Librarian agrees and
+        discarded (the right Analyst then runs) if not. Without a local guess nothing is speculated.
+    reuse_analysis: Librarian/Analyst outputs are stored per document; another language only
+        reruns the Editor (see review_book_languages for several at once).
+    """
+    # 1. Prepare Key List
+    keys_to_use = []
+    if api_keys and len(api_keys) > 0:
+        keys_to_use = api_keys
+    elif api_key:
+        keys_to_use = [api_key]
+    else:
+        env_key = os.environ.get("GOOGLE_API_KEY")
+        if env_key:
+            keys_to_use = [env_key]
+
+    if not keys_to_use:
+        raise ValueError("Missing API Key.")
+    
+    analysis = _review_analysis(file_bytes, mime_type, keys_to_use, cancel_check, resume_state, token_budget,
+                                use_local_metadata, speculative, reuse_analysis)
+    try:
+        review = _review_editor(keys_to_use, analysis, language, cancel_check)
+    except Exception as e:
+        # Even if Step 3 fails, we have Step 1 and 2.
+        raise PartialCompletionError(f"Lỗi ở Bước 3 (Editor): {str(e)}", analysis)
+
+    safe_print("Syntopic Review Completed.")
+    return review
+
+def review_book_languages(file_bytes: bytes, mime_type: str, languages: list[str], api_key: str = None, api_keys: list[str] = None,
+                          cancel_check=None, resume_state: dict = None, token_budget=REVIEW_TOKEN_BUDGET, max_concurrency=None,
+                          progress_callback=None, reuse_analysis=True) -> dict:
+    """
+    One review per language: the Librarian/Analyst run once (or come from the per-document store),
+    then one Editor call per language, concurrently across the key pool.
+    reuse_analysis: False runs the Librarian/Analyst again instead of using the stored outputs.
+    Returns: {language: review}, in the order given.
+    Raises PartialCompletionError when an Editor call fails; its partial_data holds the analysis and
+    the finished reviews ("reviews"), and resuming with it only reruns the missing languages.
+    """
+    keys_to_use = []
+    if api_keys and len(api_keys) > 0:
+        keys_to_use = api_keys
+    elif api_key:
+        keys_to_use = [api_key]
+    else:
+        env_key = os.environ.get("GOOGLE_API_KEY")
+        if env_key:
+            keys_to_use = [env_key]
+
+    if not keys_to_use:
+        raise ValueError("Missing API Key.")
+
+    languages = list(dict.fromkeys(languages)) or ["Tiếng Việt"]
+    analysis = _review_analysis(file_bytes, mime_type, keys_to_use, cancel_check, resume_state, token_budget,
+                                reuse_analysis=reuse_analysis)
+    reviews = dict(analysis.pop("reviews", None) or {})
+    pending = [language for language in languages if language not in reviews]
+    if len(pending) < len(languages):
+        safe_print(f"Skipping Step 3 for {len(languages) - len(pending)} language(s) (Already Done).")
+    concurrency = max_concurrency or default_concurrency(keys_to_use)
+    try:
+        results = run_parallel(
+            pending, lambda i, language: _review_editor(rotate_keys(keys_to_use, i), analysis, language, cancel_check),
+            concurrency, "Editor", progress_callback, cancel_check, return_exceptions=True
+        )
+    except Exception as e:
+        raise PartialCompletionError(f"Lỗi ở Bước 3 (Editor): {str(e)}", dict(analysis, reviews=reviews))
+
+    failed = {}
+    for language, result in zip(pending, results):
+        if isinstance(result, Exception):
+            failed[language] = result
+        else:
+            reviews[language] = result
+    if failed:
+        first_error = next(iter(failed.values()))
+        raise PartialCompletionError(f"Lỗi ở Bước 3 (Editor, {', '.join(failed)}): {str(first_error)}",
+                                     dict(analysis, reviews=reviews))
+
+    safe_print(f"Syntopic Review Completed in {len(languages)} languages.")
+    return {language: reviews[language] for language in languages}
+
@@ -0,0 +1,94 @@
+import io
+import os
+import tempfile
+import cache_store
+import summarizer
+from ebooklib import epub
+from document_loader import extract_metadata, DocumentMetadata, EMPTY_METADATA
+from book_classifier import classify_subject, classify_text, classify_locally, librarian_from_metadata, FICTION, NON_FICTION
+
+NOVEL = ("“Anh đi đâu vậy?” cô hỏi.\n— Ra bến tàu, anh đáp rồi mỉm cười.\n" * 40
+         + "Con đường vắng lặng dưới mưa, hắn bước đi không ngoảnh lại. " * 20)
+ESSAY = ("Theo nghiên cứu của Đại học Harvard, 40% hành vi mỗi ngày là thói quen. "
+         "Ví dụ, dữ liệu cho thấy phương pháp lặp lại giúp cải thiện 1% mỗi ngày. " * 40)
+
+def _epub(subjects) -> bytes:
+    book = epub.EpubBook()
+    book.set_identifier("id")
+    book.set_title("Atomic Habits")
+    book.add_author("James Clear")
+    for subject in subjects:
+        book.add_metadata("DC", "subject", subject)
+    chapter = epub.EpubHtml(title="Chương 1", file_name="c1.xhtml")
+    chapter.content = "<h1>Chương 1</h1><p>" + ESSAY + "</p>"
+    book.add_item(chapter)
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = ["nav", chapter]
+    path = os.path.join(tempfile.mkdtemp(), "book.epub")
+    epub.write_epub(path, book)
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_metadata_and_local_classification():
+    meta = extract_metadata(_epub(["Self-Help", "Psychology"]), "application/epub+zip")
+    assert (meta.title, meta.creator, meta.subjects) == ("Atomic Habits", "James Clear", ("Self-Help", "Psychology"))
+    assert extract_metadata(b"not a zip", "application/epub+zip") == EMPTY_METADATA
+    assert extract_metadata(b"%PDF", "application/pdf") == EMPTY_METADATA
+
+    assert classify_subject("FICTION / Science Fiction / General") == FICTION
+    assert classify_subject("Nonfiction") == NON_FICTION and classify_subject("Literary Criticism") == NON_FICTION
+    assert classify_subject("Khoa học viễn tưởng") == FICTION and classify_subject("Sách hay") is None
+    # Only headings that name a category vote; BISAC headings by their top level
+    for subject in ("Romance languages", "Novelty books", "Mystery plays", "Fiction writing"):
+        assert classify_subject(subject) is None, subject
+    assert classify_subject("Business & Economics / Fiction writing") == NON_FICTION
+    assert classify_subject("Historical fiction") == FICTION and classify_subject("Tiểu thuyết lịch sử") == FICTION
+    assert classify_text(NOVEL) == FICTION and classify_text(ESSAY) == NON_FICTION
+
+    local = classify_locally(meta, ESSAY)
+    assert local.confident and (local.category, local.genre) == (NON_FICTION, "Self-Help")
+    # The text is a second opinion: it can only block the fast path
+    assert not classify_locally(meta, NOVEL).confident
+    assert not classify_locally(DocumentMetadata("", "", ("Fiction", "History"), "", ""), "").confident
+    assert not classify_locally(EMPTY_METADATA, ESSAY).confident
+    # One hit among subjects that name no category is not enough
+    few = DocumentMetadata("", "", ("Fiction", "Linguistics", "Grammar", "Phonetics"), "", "")
+    assert not classify_locally(few, "").confident
+
+    # DOCX core properties name the tool that saved the file, not the book's author
+    docx_meta = DocumentMetadata("Atomic Habits", "python-docx", ("Self-Help",), "generated by python-docx", "")
+    local = classify_locally(docx_meta, "")
+    data = librarian_from_metadata(docx_meta, local, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+    assert "author" not in data and "core_theme" not in data and data["title"] == "Atomic Habits"
+    assert librarian_from_metadata(docx_meta, local, "application/epub+zip")["author"] == "python-docx"
+    print("[PASS] Metadata extracted and classified locally")
+
+def test_review_skips_librarian_with_confident_metadata():
+    prompts = []
+    def fake_generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        prompts.append(parts[-1].text)
+        return '{"category": "Fiction", "genre": "Drama"}', "model"
+
+    original, old_dir = summarizer.generate_content_v2, cache_store.CACHE_DIR
+    summarizer.generate_content_v2 = fake_generate
+    cache_store.CACHE_DIR = tempfile.mkdtemp()
+    cache_store.clear_memory_cache()
+    try:
+        result = summarizer.review_book_syntopic(_epub(["Self-Help"]), "application/epub+zip", api_key="k")
+        assert len(prompts) == 2 and summarizer.PROMPT_REVIEW_LIBRARIAN not in prompts
+        assert result["category"] == NON_FICTION and result["used_model"].startswith("local-metadata->")
+        assert "Atomic Habits" in prompts[-1]  # the Editor sees the file's title
+
+        prompts.clear()
+        summarizer.review_book_syntopic(_epub([]), "application/epub+zip", api_key="k", speculative=False)
+        assert prompts[0] == summarizer.PROMPT_REVIEW_LIBRARIAN and len(prompts) == 3
+    finally:
+        summarizer.generate_content_v2 = original
+        cache_store.CACHE_DIR = old_dir
+        cache_store.clear_memory_cache()
+    print("[PASS] Librarian call skipped only when the metadata is confident")
+
+if __name__ == "__main__":
+    test_metadata_and_local_classification()
+    test_review_skips_librarian_with_confident_metadata()
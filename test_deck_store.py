@@ -0,0 +1,181 @@
+import io
+import os
+import json
+import time
+import tempfile
+import cache_store
+import ai_engine
+from pptx import Presentation
+from deck_store import save_deck, load_deck, find_deck, list_decks, deck_options, DECK_NAMESPACE
+from slide_engine import create_pptx
+from bench_slide_engine import make_deck, make_template
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+def _with_temp_cache(fn):
+    old_dir = cache_store.CACHE_DIR
+    cache_store.CACHE_DIR = tempfile.mkdtemp()
+    cache_store.clear_memory_cache()
+    try:
+        fn()
+    finally:
+        cache_store.CACHE_DIR = old_dir
+        cache_store.clear_memory_cache()
+
+def test_versions_are_kept_per_document_and_options():
+    def run():
+        overview, detailed = deck_options("Tóm tắt"), deck_options("Chi tiết", "  Chương 3  ")
+        first = save_deck({"title": "A", "slides": []}, "doc1", overview, "gemini-2.5-flash")
+        second = save_deck({"title": "B", "slides": [{"title": "x", "content": []}]}, "doc1", detailed, "gemini-2.5-pro")
+        cache_store.clear_memory_cache()  # force the disk path
+
+        assert [v["key"] for v in list_decks("doc1")] == [second, first]
+        assert find_deck("doc1")["deck"]["title"] == "B"
+        assert find_deck("doc1", deck_options("Tóm tắt"))["model"] == "gemini-2.5-flash"
+        assert find_deck("doc1", deck_options("Chi tiết", "Chương 3"))["key"] == second
+        assert find_deck("doc1", deck_options("Chi tiết")) is None and find_deck("doc2") is None
+        # Rerunning with the same document, options and model adds a version
+        third = save_deck({"title": "A2", "slides": []}, "doc1", overview, "gemini-2.5-flash")
+        assert third != first and load_deck(first)["deck"]["title"] == "A"
+        assert find_deck("doc1", overview)["key"] == third
+        cache_store.cache_put(DECK_NAMESPACE, third, dict(load_deck(third), schema=0))
+        # Records from another schema version are ignored
+        cache_store.cache_put(DECK_NAMESPACE, second, dict(load_deck(second), schema=0))
+        assert find_deck("doc1")["key"] == first
+    _with_temp_cache(run)
+    print("[PASS] Stored decks found by document + options")
+
+def test_analyze_document_stores_its_deck():
+    def fake_generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        return json.dumps({"title": "Thói quen", "slides": [{"title": "S1", "content": ["Ý chính"]}]}), "fake-model"
+
+    def run():
+        original = ai_engine.generate_content_v2
+        ai_engine.generate_content_v2 = fake_generate
+        try:
+            from docx import Document
+            buffer = io.BytesIO()
+            document = Document()
+            document.add_paragraph("Thói quen nhỏ tạo ra kết quả lớn.")
+            document.save(buffer)
+            file_bytes = buffer.getvalue()
+            deck = ai_engine.analyze_document(file_bytes, "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                                              api_key="k", detail_level="Tóm tắt")
+        finally:
+            ai_engine.generate_content_v2 = original
+        record = find_deck(cache_store.content_hash(file_bytes), deck_options("Tóm tắt", "", ai_engine.SLIDE_TOKEN_BUDGET))
+        assert record["deck"] == deck and record["model"] == "fake-model"
+    _with_temp_cache(run)
+    print("[PASS] analyze_document saved its deck")
+
+def test_rerender_with_new_template_is_fast():
+    def run():
+        save_deck(make_deck(40), "doc", deck_options("Tóm tắt"), "m")
+        start = time.perf_counter()
+        record = find_deck("doc", deck_options("Tóm tắt"))
+        pptx = create_pptx(record["deck"], make_template())
+        elapsed = time.perf_counter() - start
+        assert len(Presentation(pptx).slides) >= 41
+        assert elapsed < 1, f"Re-render took {elapsed:.2f}s"
+        print(f"[PASS] 40-slide re-render in {elapsed:.2f}s")
+    _with_temp_cache(run)
+
+def _docx_book() -> bytes:
+    from docx import Document
+    buffer = io.BytesIO()
+    document = Document()
+    for heading, body in [("Chương 1: Hệ thống", "Hệ thống quan trọng hơn mục tiêu. "),
+                          ("Chương 2: Môi trường", "Sắp xếp không gian sống để thói quen tốt trở nên rõ ràng. "),
+                          ("Chương 3: Quy tắc hai phút", "Bắt đầu thói quen mới trong hai phút. ")]:
+        document.add_heading(heading, 1)
+        document.add_paragraph(body * 30)
+    document.save(buffer)
+    return buffer.getvalue()
+
+def test_regenerate_slides_saves_a_spliced_revision():
+    prompts = []
+
+    def fake_generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        prompts.append("\n".join(p.text for p in parts if p.text))
+        return json.dumps({"slides": [{"title": "Không gian sống", "content": ["**Môi trường** định hình hành vi"]},
+                                      {"title": "Không gian sống (tiếp)", "content": []}]}), "fake-model"
+
+    def run():
+        file_bytes = _docx_book()
+        deck = {"title": "Thói quen", "slides": [{"title": f"S{i}", "content": [f"Ý {i}"]} for i in range(1, 5)]}
+        deck["slides"][1] = {"title": "Môi trường", "content": ["Sắp xếp không gian sống"]}
+        options = deck_options("Tóm tắt")
+        original_key = save_deck(deck, cache_store.content_hash(file_bytes), options, "m")
+
+        original = ai_engine.generate_content_v2
+        ai_engine.generate_content_v2 = fake_generate
+        try:
+            record = ai_engine.regenerate_slides(original_key, 2, 2, file_bytes, DOCX_MIME, api_key="k",
+                                                 instructions="Thêm ví dụ")
+        finally:
+            ai_engine.generate_content_v2 = original
+
+        # Only the matching section is sent, with the outline and the user's request
+        assert "Sắp xếp không gian sống để thói quen" in prompts[0]
+        assert "Hệ thống quan trọng hơn mục tiêu" not in prompts[0]
+        assert "4. S4" in prompts[0] and "Thêm ví dụ" in prompts[0]
+
+        titles = [s["title"] for s in record["deck"]["slides"]]
+        assert titles == ["S1", "Không gian sống", "Không gian sống (tiếp)", "S3", "S4"]
+        assert record["deck"]["slides"][2]["content"]  # empty content filled like analyze_document does
+        assert record["parent"] == original_key and record["model"] == "fake-model"
+        # The revision is what the UI finds next; the original is kept
+        assert find_deck(cache_store.content_hash(file_bytes), options)["key"] == record["key"]
+        assert load_deck(original_key)["deck"] == deck
+
+        try:
+            ai_engine.regenerate_slides(original_key, 4, 5, file_bytes, DOCX_MIME, api_key="k")
+            assert False, "out-of-range slides accepted"
+        except ValueError:
+            pass
+    _with_temp_cache(run)
+    print("[PASS] Regenerated slides spliced into a new deck revision")
+
+def test_fast_writer_renders_only_changed_slides():
+    import pptx_fast_writer
+    deck = make_deck(30, seed=7)
+    template = make_template()
+    create_pptx(deck, template, fast_writer=True)
+    rendered = []
+    original = pptx_fast_writer.SlideXmlTemplate._render
+
+    def counting_render(self, slide_data):
+        rendered.append(slide_data["title"])
+        return original(self, slide_data)
+
+    pptx_fast_writer.SlideXmlTemplate._render = counting_render
+    try:
+        edited = ai_engine.splice_slides(deck, 5, 5, [{"title": "Slide mới", "content": ["Nội dung **mới**"]}])
+        pptx = create_pptx(edited, template, fast_writer=True)
+    finally:
+        pptx_fast_writer.SlideXmlTemplate._render = original
+    assert rendered == ["Slide mới"]
+    assert Presentation(pptx).slides[5].shapes.title.text == "Slide mới"
+    print("[PASS] Re-save after a splice renders 1 slide")
+
+def test_stored_decks_survive_size_pruning():
+    def run():
+        key = save_deck({"title": "A", "slides": []}, "doc1", deck_options("Tóm tắt"), "gemini-2.5-flash")
+        hour_ago = time.time() - 3600
+        os.utime(cache_store._path(DECK_NAMESPACE, key), (hour_ago, hour_ago))  # older than the chunk notes
+        for i in range(5):
+            cache_store.cache_put("map_notes", cache_store.content_hash(str(i)), "x" * 1000)
+        # A budget the chunk notes alone exceed: they are evicted, the deck stays
+        assert cache_store.prune_disk_cache(max_mb=1500 / (1024 * 1024)) == 4
+        cache_store.clear_memory_cache()
+        assert load_deck(key)["deck"]["title"] == "A" and find_deck("doc1")["key"] == key
+    _with_temp_cache(run)
+    print("[PASS] Size pruning evicts chunk notes, not stored decks")
+
+if __name__ == "__main__":
+    test_versions_are_kept_per_document_and_options()
+    test_analyze_document_stores_its_deck()
+    test_rerender_with_new_template_is_fast()
+    test_regenerate_slides_saves_a_spliced_revision()
+    test_fast_writer_renders_only_changed_slides()
+    test_stored_decks_survive_size_pruning()
@@ -0,0 +1,61 @@
+import re
+import json
+import time
+import summarizer
+
+IDEAS = ["HỆ THỐNG", "MÔI TRƯỜNG", "BẢN SẮC", "QUY TẮC HAI PHÚT", "HÀNH ĐỘNG"]
+BOOK = ("Thói quen nhỏ tạo ra kết quả lớn. " * 50).encode("utf-8")
+
+def _fake_generate(delays):
+    def generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        prompt = parts[-1].text
+        if "lập KHUNG" in prompt:
+            return json.dumps({
+                "metadata": {"title": "Atomic Habits", "author": "James Clear"},
+                "big_ideas": IDEAS,
+                "introduction": {"text": "Giới thiệu", "best_quote": "Trích dẫn"},
+                "core_ideas": [{"title": t, "quote": "q", "brief": f"Tóm lược {t}"} for t in IDEAS],
+            }), "skeleton-model"
+        number = int(re.search(r"cho ý tưởng (\d+)", prompt).group(1))
+        time.sleep(delays[number - 1])
+        return json.dumps({"commentary": f"Phân tích {number}"}), "commentary-model"
+    return generate
+
+def _deep_dive(delays, **kwargs):
+    original = summarizer.generate_content_v2
+    summarizer.generate_content_v2 = _fake_generate(delays)
+    try:
+        return summarizer.summarize_book_deep_dive(BOOK, "text/plain", api_keys=["k1", "k2", "k3", "k4", "k5"],
+                                                   map_reduce=False, **kwargs)
+    finally:
+        summarizer.generate_content_v2 = original
+
+def test_staged_deep_dive_writes_commentaries_in_parallel():
+    start = time.perf_counter()
+    result = _deep_dive([0.2] * len(IDEAS))
+    elapsed = time.perf_counter() - start
+    assert [idea["commentary"] for idea in result["core_ideas"]] == [f"Phân tích {i}" for i in range(1, 6)]
+    assert all("brief" not in idea for idea in result["core_ideas"])
+    assert result["metadata"]["title"] == "Atomic Habits" and result["missing_commentaries"] == 0
+    assert result["used_model"] == "skeleton-model"
+    assert elapsed < 0.6, f"commentaries ran serially ({elapsed:.2f}s)"
+
+    # Same dict shape as the single-shot mode (what save_summary_to_pdf reads)
+    assert {"mode", "metadata", "big_ideas", "introduction", "core_ideas", "about_author", "about_creator"} <= set(result)
+    assert all(set(idea) == {"title", "quote", "commentary"} for idea in result["core_ideas"])
+    print(f"[PASS] 5 commentaries in {elapsed:.2f}s")
+
+def test_deadline_returns_finished_commentaries():
+    start = time.perf_counter()
+    result = _deep_dive([0.05, 0.05, 2.0, 0.05, 2.0], deadline_seconds=0.5)
+    elapsed = time.perf_counter() - start
+    commentaries = [idea["commentary"] for idea in result["core_ideas"]]
+    assert commentaries == ["Phân tích 1", "Phân tích 2", "Tóm lược BẢN SẮC", "Phân tích 4", "Tóm lược HÀNH ĐỘNG"]
+    assert result["missing_commentaries"] == 2
+    assert [bool(idea.get("truncated")) for idea in result["core_ideas"]] == [False, False, True, False, True]
+    assert elapsed < 1.5, f"deadline not honoured ({elapsed:.2f}s)"
+    print(f"[PASS] Deadline: 3/5 commentaries returned after {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    test_staged_deep_dive_writes_commentaries_in_parallel()
+    test_deadline_returns_finished_commentaries()
@@ -0,0 +1,99 @@
+import io
+import time
+import docx
+from docx.enum.text import WD_BREAK
+from ebooklib import epub
+from document_loader import (
+    load_structured_document, load_document, load_structured_text, StructuredDocument
+)
+from text_normalizer import normalize_document
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+def _make_docx():
+    d = docx.Document()
+    d.add_paragraph("Lời nói đầu của tác giả.")
+    d.add_heading("Chương 1: Khởi đầu", level=1)
+    d.add_paragraph("Nội dung chương một.")
+    d.add_heading("1.1 Bối cảnh", level=2)
+    p = d.add_paragraph("Chi tiết bối cảnh.")
+    p.add_run().add_break(WD_BREAK.PAGE)
+    d.add_heading("Chương 2: Phát triển", level=1)
+    d.add_paragraph("Nội dung chương hai.")
+    out = io.BytesIO()
+    d.save(out)
+    return out.getvalue()
+
+def _make_epub():
+    book = epub.EpubBook()
+    book.set_identifier("id123")
+    book.set_title("Sách thử")
+    chapters = []
+    for i in range(1, 4):
+        c = epub.EpubHtml(title=f"Chương {i}", file_name=f"chap_{i}.xhtml", lang="vi")
+        c.content = f"<h1>Chương {i}</h1><p>{'Nội dung rất dài của chương. ' * 5}</p>"
+        book.add_item(c)
+        chapters.append(c)
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = ["nav"] + chapters
+    out = io.BytesIO()
+    epub.write_epub(out, book)
+    return out.getvalue()
+
+def test_docx_sections():
+    doc = load_structured_document(_make_docx(), DOCX_MIME)
+
+    assert load_document(_make_docx(), DOCX_MIME) == doc.text, "Flat API must be a view over the structured doc"
+    titles = [s.title for s in doc.sections()]
+    assert titles == ["", "Chương 1: Khởi đầu", "1.1 Bối cảnh", "Chương 2: Phát triển"], titles
+    assert [s.level for s in doc.sections()] == [0, 1, 2, 1]
+    # Sections are contiguous and cover the whole text
+    assert doc.starts[0] == 0 and doc.ends[-1] == len(doc.text)
+    for i in range(1, len(doc)):
+        assert doc.starts[i] == doc.ends[i - 1]
+    assert doc.section_text(3).startswith("Chương 2: Phát triển")
+    # Page number known after the explicit page break
+    assert doc.section(1).page == 1 and doc.section(3).page == 2
+    print("[PASS] DOCX sections")
+
+def test_epub_sections():
+    doc = load_structured_document(_make_epub(), "application/epub+zip")
+    chapter_titles = [s.title for s in doc.sections() if s.title.startswith("Chương")]
+    assert chapter_titles == ["Chương 1", "Chương 2", "Chương 3"], chapter_titles
+    for s in doc.sections():
+        assert s.page is None
+        assert doc.section_text(s.index).strip()
+    print("[PASS] EPUB sections")
+
+def test_plain_text_and_normalization():
+    text = "Header\n# Phần 1\nAAA\n\fBBB\nChương 2 Kết thúc\nCCC"
+    doc = load_structured_text(text)
+    assert [s.title for s in doc.sections()] == ["", "Phần 1", "Chương 2 Kết thúc"]
+    assert doc.section(2).page == 2
+
+    toc = StructuredDocument.from_parts([
+        ("Mục lục", 1, "Mục lục\nChương 1 .... 3\nChương 2 .... 9", None),
+        ("Chương 1", 1, "Chương 1\nNội dung   một.", None),
+    ])
+    normalized, stats = normalize_document(toc)
+    assert normalized.titles == ["Chương 1"]
+    assert normalized.text == "Chương 1\nNội dung một."
+    assert stats["toc_lines"] == 3
+    print("[PASS] Plain text + normalization")
+
+def test_thousand_chapters_is_cheap():
+    parts = [(f"Chương {i}", 1, f"Nội dung chương {i}.", None) for i in range(1000)]
+    start = time.perf_counter()
+    doc = StructuredDocument.from_parts(parts)
+    elapsed = time.perf_counter() - start
+    assert len(doc) == 1000
+    assert doc.section_text(999) == "Nội dung chương 999."
+    assert elapsed < 0.5
+    print(f"[PASS] 1000 chapters built in {elapsed * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    test_docx_sections()
+    test_epub_sections()
+    test_plain_text_and_normalization()
+    test_thousand_chapters_is_cheap()
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import random
+import tempfile
+import threading
+from document_loader import StructuredDocument, load_structured_text
+import cache_store
+import map_reduce
+from map_reduce import chunk_document, condense_document
+
+def _book(chapters=12, chars_per_chapter=4000):
+    parts = [(f"Chương {i}", 1, f"Chương {i}\n" + ("Nội dung. " * (chars_per_chapter // 10)), None) for i in range(1, chapters + 1)]
+    return StructuredDocument.from_parts(parts)
+
+def test_chunks_follow_section_boundaries():
+    doc = _book()
+    chunks = chunk_document(doc, max_tokens=2500)  # min 2.5k chars -> one chapter per chunk
+    assert len(chunks) == 12, len(chunks)
+    assert chunks[0].title == "Chương 1"
+    for chunk in chunks:
+        # Every chunk starts at a chapter heading
+        assert chunk.text.startswith("Chương")
+    # Oversized sections are split on paragraph/space boundaries
+    big = StructuredDocument.from_parts([("Chương 1", 1, "Một câu dài. " * 5000, None)])
+    pieces = chunk_document(big, max_tokens=1000)
+    assert len(pieces) > 1 and all(len(p.text) <= 4000 for p in pieces)
+    print(f"[PASS] {len(chunks)} chunks on section boundaries")
+
+def _paragraphs(seed, count=400):
+    rng = random.Random(seed)
+    words = ["thói", "quen", "hệ", "thống", "mục", "tiêu", "kết", "quả", "nhỏ", "lớn", "mỗi", "ngày"]
+    return ["Đoạn %d. " % i + " ".join(rng.choice(words) for _ in range(rng.randint(40, 120))) for i in range(count)]
+
+def test_content_defined_boundaries_survive_edits():
+    paragraphs = _paragraphs(1)
+    original = chunk_document(load_structured_text("\n".join(paragraphs)), max_tokens=4000)
+
+    edited_paragraphs = list(paragraphs)
+    edited_paragraphs[200] = edited_paragraphs[200] + " Câu mới được thêm vào bản sửa."
+    edited_paragraphs.insert(201, "Một đoạn hoàn toàn mới trong phiên bản 2.")
+    edited = chunk_document(load_structured_text("\n".join(edited_paragraphs)), max_tokens=4000)
+
+    before = {c.text for c in original}
+    after = {c.text for c in edited}
+    changed = len(after - before)
+    assert len(original) >= 5
+    # Boundaries resynchronize a few chunks after the edit; everything else is reused
+    assert changed <= 4, f"Only chunks around the edit should change ({changed} of {len(edited)})"
+    assert [c.text for c in original[:12]] == [c.text for c in edited[:12]]
+    assert [c.text for c in original[-8:]] == [c.text for c in edited[-8:]]
+    print(f"[PASS] {changed}/{len(edited)} chunks changed after a local edit")
+
+def test_cache_reruns_only_changed_chunks():
+    calls = []
+
+    def fake_generate(keys, parts, config, model_list=None, cancel_check=None):
+        calls.append(parts[0].text)
+        return json.dumps({"summary": parts[0].text[:30], "key_points": [], "quotes": []}), "fake-model"
+
+    old_dir = cache_store.CACHE_DIR
+    cache_store.CACHE_DIR = tempfile.mkdtemp()
+    cache_store.clear_memory_cache()
+    try:
+        doc = _book()
+        condense_document(doc, ["k1"], generate_fn=fake_generate, chunk_tokens=2500)
+        first_run = len(calls)
+
+        parts = [(doc.titles[i], 1, doc.section_text(i), None) for i in range(len(doc))]
+        parts[5] = (parts[5][0], 1, parts[5][2] + "\nMột trang được sửa.", None)
+        calls.clear()
+        cache_store.clear_memory_cache()  # force the disk path
+        condense_document(StructuredDocument.from_parts(parts), ["k1"], generate_fn=fake_generate, chunk_tokens=2500)
+    finally:
+        cache_store.CACHE_DIR = old_dir
+        cache_store.clear_memory_cache()
+
+    assert first_run == 12
+    assert len(calls) == 1 and "Một trang được sửa." in calls[0]
+    print("[PASS] Edited document re-ran 1 of 12 map calls")
+
+def test_map_runs_concurrently_and_reduces_in_order():
+    doc = _book()
+    calls = []
+    active = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def fake_generate(keys, parts, config, model_list=None, cancel_check=None):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+            calls.append(keys[0])
+        time.sleep(0.05)
+        with lock:
+            active["now"] -= 1
+        text = parts[0].text
+        return json.dumps({"summary": text[:40], "key_points": ["ý"], "quotes": []}), "fake-model"
+
+    progress = []
+    old_target = map_reduce.REDUCE_TARGET_TOKENS
+    map_reduce.REDUCE_TARGET_TOKENS = 50  # force one hierarchical reduce level
+    try:
+        start = time.perf_counter()
+        notes = condense_document(
+            doc, ["k1", "k2", "k3"], max_concurrency=3,
+            progress_callback=lambda stage, done, total, label: progress.append((stage, done, total)),
+            generate_fn=fake_generate, chunk_tokens=2500, use_cache=False
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        map_reduce.REDUCE_TARGET_TOKENS = old_target
+
+    map_progress = [p for p in progress if p[0] == "Map"]
+    assert [p[1] for p in map_progress] == list(range(1, 13))
+    assert any(p[0].startswith("Reduce") for p in progress)
+    assert active["max"] == 3, "Map should use the configured concurrency"
+    assert set(calls) == {"k1", "k2", "k3"}, "Chunks should be spread over the key pool"
+    # 12 map calls at 3-way concurrency + 2 reduce calls: well under the 14 serial calls
+    assert elapsed < 14 * 0.05
+    assert notes.startswith("### [Nhóm 1/")
+    print(f"[PASS] Map-reduce with {active['max']} workers in {elapsed:.2f}s")
+
+def test_cache_is_bounded_and_skips_fallback_notes():
+    calls = []
+
+    def fallback_generate(keys, parts, config, model_list=None, cancel_check=None):
+        calls.append(parts[0].text)
+        return json.dumps({"summary": "ok", "key_points": [], "quotes": []}), map_reduce.ROBUST_MODEL_LIST[1]
+
+    old_dir, old_entries = cache_store.CACHE_DIR, cache_store.MEMORY_MAX_ENTRIES
+    cache_store.CACHE_DIR = tempfile.mkdtemp()
+    cache_store.MEMORY_MAX_ENTRIES = 3
+    cache_store.clear_memory_cache()
+    try:
+        for i in range(5):
+            cache_store.cache_put("t", cache_store.content_hash(str(i)), "x" * 1000)
+        assert len(cache_store._memory) == 3
+        # Oldest entries go first once the directory is over its size cap
+        old = cache_store._path("t", cache_store.content_hash("0"))
+        os.utime(old, (1, 1))
+        assert cache_store.prune_disk_cache(max_mb=3500 / (1024 * 1024)) == 2
+        assert not os.path.exists(old)
+        os.utime(cache_store._path("t", cache_store.content_hash("4")), (1, 1))
+        cache_store.clear_memory_cache()
+        assert cache_store.cache_get("t", cache_store.content_hash("4")) is None, "Expired entries are misses"
+
+        # Notes from a fallback model are used for this run but not stored
+        doc = _book(chapters=3)
+        condense_document(doc, ["k1"], generate_fn=fallback_generate, chunk_tokens=2500)
+        condense_document(doc, ["k1"], generate_fn=fallback_generate, chunk_tokens=2500)
+        assert len(calls) == 6
+    finally:
+        cache_store.CACHE_DIR, cache_store.MEMORY_MAX_ENTRIES = old_dir, old_entries
+        cache_store.clear_memory_cache()
+    print("[PASS] Bounded cache, fallback notes not stored")
+
+def test_run_parallel_deadline_and_failures_keep_finished_items():
+    def worker(i, delay):
+        time.sleep(delay)
+        if i == 1:
+            raise RuntimeError("boom")
+        return i
+
+    start = time.perf_counter()
+    results = map_reduce.run_parallel([0.01, 0.01, 2.0, 0.01], worker, 4, "Test",
+                                      deadline=time.monotonic() + 0.3, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    assert results[0] == 0 and results[3] == 3
+    assert isinstance(results[1], RuntimeError)
+    assert results[2] is None, "unfinished item should stay empty"
+    assert elapsed < 1.0, f"deadline not honoured ({elapsed:.2f}s)"
+
+    try:
+        map_reduce.run_parallel([0.01, 0.01], worker, 2, "Test")
+        assert False, "failures should raise without return_exceptions"
+    except RuntimeError:
+        pass
+    print(f"[PASS] run_parallel deadline after {elapsed:.2f}s, failure kept in its slot")
+
+if __name__ == "__main__":
+    test_chunks_follow_section_boundaries()
+    test_content_defined_boundaries_survive_edits()
+    test_cache_reruns_only_changed_chunks()
+    test_map_runs_concurrently_and_reduces_in_order()
+    test_cache_is_bounded_and_skips_fallback_notes()
+    test_run_parallel_deadline_and_failures_keep_finished_items()
@@ -0,0 +1,115 @@
+import io
+import re
+import json
+import time
+import tempfile
+import threading
+import cache_store
+import ai_engine
+from document_loader import StructuredDocument
+from outline_deck import generate_outlined_deck, parse_outline, should_use_outline, MAX_SLIDES_PER_SECTION, MAX_WHOLE_SOURCE_SECTIONS
+
+TOPICS = ["Hệ thống quan trọng hơn mục tiêu", "Môi trường định hình hành vi",
+          "Quy tắc hai phút cho thói quen mới", "Bản sắc cá nhân quyết định thói quen"]
+
+def _fake_generate(calls, delay=0.2):
+    lock = threading.Lock()
+
+    def generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        prompt = "\n".join(p.text for p in parts if p.text)
+        with lock:
+            calls.append(prompt)
+        if "Hãy lập dàn ý" in prompt:
+            sections = [{"title": t, "summary": t, "slide_count": 2} for t in TOPICS]
+            return json.dumps({"title": "THÓI QUEN", "sections": sections}), "outline-model"
+        number = int(re.search(r"PHẦN (\d+):", prompt).group(1))
+        # Later sections finish first: the merge must still follow the outline
+        time.sleep(delay * (len(TOPICS) - number + 1) / len(TOPICS))
+        return json.dumps({"slides": [{"title": f"{number}.{j}", "content": ["Ý"]} for j in (1, 2)]}), "section-model"
+
+    return generate
+
+def _book() -> StructuredDocument:
+    return StructuredDocument.from_parts([
+        (f"Chương {i + 1}", 1, f"Chương {i + 1}\n" + (topic + ". ") * 30, None) for i, topic in enumerate(TOPICS)
+    ])
+
+def test_sections_run_in_parallel_and_merge_in_order():
+    calls = []
+    doc = _book()
+    start = time.perf_counter()
+    deck, model = generate_outlined_deck(["k1", "k2", "k3", "k4"], [], "system", document=doc,
+                                         generate_fn=_fake_generate(calls))
+    elapsed = time.perf_counter() - start
+    assert deck["title"] == "THÓI QUEN"
+    assert [s["title"] for s in deck["slides"]] == [f"{i}.{j}" for i in range(1, 5) for j in (1, 2)]
+    assert model == "outline-model+section-model"
+    # Serial would take 0.5s (0.2 + 0.15 + 0.1 + 0.05)
+    assert elapsed < 0.35, f"sections did not run in parallel ({elapsed:.2f}s)"
+    # Each section call carries its own chapter, not the others
+    section_call = next(c for c in calls if "PHẦN 2:" in c)
+    assert "Môi trường định hình hành vi. " in section_call and "Quy tắc hai phút cho thói quen mới. " not in section_call
+    print(f"[PASS] 4 sections in {elapsed:.2f}s, merged in outline order")
+
+def test_outline_is_clamped():
+    title, sections = parse_outline(json.dumps({"sections": [
+        {"title": "A", "slide_count": 500}, {"title": " "}, {"title": "B", "slide_count": "nhiều"}]}))
+    assert title == "Bài thuyết trình AI"
+    assert [(s.index, s.title, s.slide_count) for s in sections] == [(0, "A", MAX_SLIDES_PER_SECTION), (1, "B", 3)]
+    print("[PASS] Outline parsed and clamped")
+
+def test_analyze_document_detailed_uses_outline():
+    from docx import Document
+    buffer = io.BytesIO()
+    document = Document()
+    for i, topic in enumerate(TOPICS):
+        document.add_heading(f"Chương {i + 1}", 1)
+        document.add_paragraph((topic + ". ") * 30)
+    document.save(buffer)
+
+    calls, instructions = [], []
+    fake = _fake_generate(calls, delay=0)
+
+    def generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        instructions.append(config.system_instruction)
+        return fake(api_keys, parts, config, model_list, cancel_check)
+
+    old_dir, original = cache_store.CACHE_DIR, ai_engine.generate_content_v2
+    cache_store.CACHE_DIR = tempfile.mkdtemp()
+    cache_store.clear_memory_cache()
+    ai_engine.generate_content_v2 = generate
+    try:
+        deck = ai_engine.analyze_document(buffer.getvalue(), "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                                          api_key="k", detail_level="Chi tiết", outline_first=True)
+    finally:
+        ai_engine.generate_content_v2 = original
+        cache_store.CACHE_DIR = old_dir
+        cache_store.clear_memory_cache()
+    assert len(calls) == 1 + len(TOPICS)
+    assert len(deck["slides"]) == 2 * len(TOPICS)
+    # Section calls get the per-section instruction, not the whole-deck one
+    assert all("CHẾ ĐỘ VIẾT THEO PHẦN" in i and "YÊU CẦU CHI TIẾT" not in i for i in instructions[1:])
+    print("[PASS] Detailed analyze_document ran outline + sections")
+
+def test_whole_source_runs_are_capped_and_use_the_section_instruction():
+    from google.genai import types
+    assert not should_use_outline("application/pdf", None), "PDFs would be re-attached to every section call"
+    calls = []
+
+    def generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        calls.append(config.system_instruction)
+        if "Hãy lập dàn ý" in parts[-1].text:
+            return json.dumps({"title": "T", "sections": [{"title": f"P{i}"} for i in range(10)]}), "m"
+        return json.dumps({"slides": [{"title": "S", "content": ["Ý"]}]}), "m"
+
+    pdf = [types.Part.from_bytes(data=b"%PDF-1.4", mime_type="application/pdf")]
+    deck, _ = generate_outlined_deck(["k"], pdf, "SECTION RULES", generate_fn=generate)
+    assert len(deck["slides"]) == MAX_WHOLE_SOURCE_SECTIONS and len(calls) == 1 + MAX_WHOLE_SOURCE_SECTIONS
+    assert calls[1:] == ["SECTION RULES"] * MAX_WHOLE_SOURCE_SECTIONS
+    print(f"[PASS] Whole-source outline capped at {MAX_WHOLE_SOURCE_SECTIONS} sections")
+
+if __name__ == "__main__":
+    test_sections_run_in_parallel_and_merge_in_order()
+    test_outline_is_clamped()
+    test_analyze_document_detailed_uses_outline()
+    test_whole_source_runs_are_capped_and_use_the_section_instruction()
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import cache_store
+import summarizer
+import stage_profiles
+
+ESSAY = ("Theo nghiên cứu của Đại học Harvard, 40% hành vi mỗi ngày là thói quen. "
+         "Ví dụ, dữ liệu cho thấy phương pháp lặp lại giúp cải thiện 1% mỗi ngày. " * 40).encode("utf-8")
+
+NOVEL = ("“Anh đi đâu vậy?” cô hỏi.\n— Ra bến tàu, anh đáp rồi mỉm cười.\n" * 40
+         + "Con đường vắng lặng dưới mưa, hắn bước đi không ngoảnh lại. " * 20).encode("utf-8")
+
+def _fake_generate(category, calls, delay=0.3):
+    lock = threading.Lock()
+
+    def generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        prompt = parts[-1].text
+        if prompt == summarizer.PROMPT_REVIEW_LIBRARIAN:
+            # category None: an answer that is not JSON
+            name, text = "librarian", '{"category": "%s", "genre": "Test"}' % category if category else "Thể loại?"
+        elif prompt == summarizer.PROMPT_REVIEW_ANALYST_FICTION:
+            name, text = "analyst-fiction", "FICTION ANALYSIS"
+        elif prompt == summarizer.PROMPT_REVIEW_ANALYST_NON_FICTION:
+            name, text = "analyst-non-fiction", "NON-FICTION ANALYSIS"
+        else:
+            # The Editor echoes its prompt, so tests can see which analysis it received
+            name, text = "editor", prompt
+        with lock:
+            calls.append(name)
+        if name != "editor":
+            time.sleep(delay)
+        return text, name
+
+    return generate
+
+def _review(category, calls, review_fn=None, fresh_cache=True, file_bytes=ESSAY, **kwargs):
+    review_fn = review_fn or summarizer.review_book_syntopic
+    original, old_dir = summarizer.generate_content_v2, cache_store.CACHE_DIR
+    summarizer.generate_content_v2 = _fake_generate(category, calls)
+    if fresh_cache:
+        cache_store.CACHE_DIR = tempfile.mkdtemp()
+        cache_store.clear_memory_cache()
+    try:
+        start = time.perf_counter()
+        result = review_fn(file_bytes, "text/plain", api_keys=["k1", "k2"], **kwargs)
+        return result, time.perf_counter() - start
+    finally:
+        summarizer.generate_content_v2 = original
+        if fresh_cache:
+            cache_store.CACHE_DIR = old_dir
+            cache_store.clear_memory_cache()
+
+def test_speculative_analyst_runs_with_the_librarian():
+    calls = []
+    result, elapsed = _review("Non-Fiction", calls)
+    assert sorted(calls) == ["analyst-non-fiction", "editor", "librarian"]
+    assert "NON-FICTION ANALYSIS" in result["review_markdown"]
+    assert result["used_model"] == "librarian->analyst-non-fiction->editor"
+    # Serial Librarian -> Analyst takes 0.6s
+    assert elapsed < 0.5, f"Analyst did not overlap the Librarian ({elapsed:.2f}s)"
+
+    calls.clear()
+    _, serial = _review("Non-Fiction", calls, speculative=False)
+    assert calls == ["librarian", "analyst-non-fiction", "editor"] and serial >= 0.6
+
+    # No metadata and a text too short to classify: no blind guess
+    calls.clear()
+    _review("Non-Fiction", calls, file_bytes="Một cuốn sách. ".encode("utf-8") * 20)
+    assert calls == ["librarian", "analyst-non-fiction", "editor"]
+    print(f"[PASS] Speculative review {elapsed:.2f}s vs serial {serial:.2f}s")
+
+def test_wrong_speculation_is_discarded():
+    calls = []
+    result, _ = _review("Fiction", calls)
+    # The text guess (Non-Fiction) lost: the Fiction Analyst ran and only its output reached the Editor
+    assert "analyst-fiction" in calls and result["category"] == "Fiction"
+    assert "FICTION ANALYSIS" in result["review_markdown"] and "NON-FICTION ANALYSIS" not in result["review_markdown"]
+    assert result["used_model"] == "librarian->analyst-fiction->editor"
+    print("[PASS] Mismatched speculative Analyst discarded")
+
+def test_other_languages_rerun_only_the_editor():
+    old_dir = cache_store.CACHE_DIR
+    cache_store.CACHE_DIR = tempfile.mkdtemp()
+    cache_store.clear_memory_cache()
+    try:
+        calls = []
+        first, _ = _review("Non-Fiction", calls, fresh_cache=False, language="Tiếng Việt")
+        assert sorted(calls) == ["analyst-non-fiction", "editor", "librarian"]
+
+        # Same document, another language: the stored analysis is reused
+        calls.clear()
+        english, _ = _review("Non-Fiction", calls, fresh_cache=False, language="English")
+        assert calls == ["editor"]
+        assert english["language"] == "English" and "Write the final output in English" in english["review_markdown"]
+        assert english["used_model"] == first["used_model"]
+
+        calls.clear()
+        reviews, _ = _review("Non-Fiction", calls, review_fn=summarizer.review_book_languages, fresh_cache=False,
+                             languages=["English", "Français", "Deutsch"])
+        assert calls == ["editor"] * 3 and list(reviews) == ["English", "Français", "Deutsch"]
+        assert all(f"Write the final output in {lang}" in r["review_markdown"] for lang, r in reviews.items())
+    finally:
+        cache_store.CACHE_DIR = old_dir
+        cache_store.clear_memory_cache()
+    print("[PASS] Language switch reran only the Editor")
+
+def test_languages_share_one_analysis():
+    calls = []
+    reviews, _ = _review("Fiction", calls, review_fn=summarizer.review_book_languages, languages=["Tiếng Việt", "English"])
+    assert calls.count("librarian") == 1 and calls.count("analyst-fiction") == 1 and calls.count("editor") == 2
+    assert all("FICTION ANALYSIS" in r["review_markdown"] for r in reviews.values())
+    print("[PASS] Two languages for one Librarian + one Analyst")
+
+def test_fallback_classification_is_not_stored_and_reanalysis_reruns():
+    old_dir = cache_store.CACHE_DIR
+    cache_store.CACHE_DIR = tempfile.mkdtemp()
+    cache_store.clear_memory_cache()
+    try:
+        # Unreadable Librarian answer: the default classification is used but not stored
+        calls = []
+        _review(None, calls, fresh_cache=False, speculative=False)
+        calls.clear()
+        _review("Non-Fiction", calls, fresh_cache=False, speculative=False)
+        assert calls == ["librarian", "analyst-non-fiction", "editor"]
+
+        # Now stored; re-analysis asks for the Librarian/Analyst again
+        calls.clear()
+        _review("Non-Fiction", calls, fresh_cache=False, review_fn=summarizer.review_book_languages,
+                languages=["English"], reuse_analysis=False)
+        assert sorted(calls) == ["analyst-non-fiction", "editor", "librarian"]
+    finally:
+        cache_store.CACHE_DIR = old_dir
+        cache_store.clear_memory_cache()
+    print("[PASS] Fallback classification not stored, re-analysis reruns Steps 1-2")
+
+def test_failed_language_keeps_the_finished_reviews():
+    calls = []
+    fake = _fake_generate("Non-Fiction", calls)
+    def flaky(api_keys, parts, config, model_list=None, cancel_check=None):
+        if "Write the final output in Français" in parts[-1].text:
+            calls.append("editor-failed")
+            raise ValueError("quota")
+        return fake(api_keys, parts, config, model_list, cancel_check)
+
+    original = summarizer.generate_content_v2
+    summarizer.generate_content_v2 = flaky
+    try:
+        try:
+            summarizer.review_book_languages(ESSAY, "text/plain", ["English", "Français"], api_keys=["k1", "k2"],
+                                             reuse_analysis=False)
+            assert False, "the failed language should raise"
+        except summarizer.PartialCompletionError as e:
+            partial = e.partial_data
+        assert list(partial["reviews"]) == ["English"] and partial["analyst_output"] == "NON-FICTION ANALYSIS"
+
+        calls.clear()
+        summarizer.generate_content_v2 = fake
+        reviews = summarizer.review_book_languages(ESSAY, "text/plain", ["English", "Français"], api_keys=["k1", "k2"],
+                                                   resume_state=partial)
+    finally:
+        summarizer.generate_content_v2 = original
+    assert calls == ["editor"], "resume should only write the missing language"
+    assert list(reviews) == ["English", "Français"] and reviews["English"] == partial["reviews"]["English"]
+    print("[PASS] Editor failure keeps the finished languages; resume writes only the rest")
+
+def test_discarded_speculation_is_cancelled_and_fallback_uses_local_guess():
+    checks = {}
+    def generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        prompt = parts[-1].text
+        if prompt == summarizer.PROMPT_REVIEW_LIBRARIAN:
+            time.sleep(0.1)
+            return '{"category": "Fiction", "genre": "Drama"}', "librarian"
+        if prompt == summarizer.PROMPT_REVIEW_ANALYST_NON_FICTION:
+            time.sleep(0.4)
+            # What generate_content_v2 would see before its next retry
+            checks["speculation_cancelled"] = cancel_check()
+            return "NON-FICTION ANALYSIS", "analyst-non-fiction"
+        return ("FICTION ANALYSIS", "analyst-fiction") if prompt == summarizer.PROMPT_REVIEW_ANALYST_FICTION else (prompt, "editor")
+
+    original = summarizer.generate_content_v2
+    summarizer.generate_content_v2 = generate
+    try:
+        summarizer.review_book_syntopic(ESSAY, "text/plain", api_keys=["k1", "k2"], reuse_analysis=False)
+        time.sleep(0.5)
+    finally:
+        summarizer.generate_content_v2 = original
+    assert checks["speculation_cancelled"] is True
+
+    # Unreadable Librarian answer: the local guess (Fiction text) is the fallback, speculation kept
+    calls = []
+    result, _ = _review(None, calls, file_bytes=NOVEL)
+    assert result["category"] == "Fiction" and sorted(calls) == ["analyst-fiction", "editor", "librarian"]
+    print("[PASS] Discarded speculation cancelled; Librarian fallback follows the local guess")
+
+def test_stored_analysis_follows_profiles_and_metadata_flag():
+    old_dir, old_file = cache_store.CACHE_DIR, stage_profiles.PROFILES_FILE
+    cache_store.CACHE_DIR = tempfile.mkdtemp()
+    cache_store.clear_memory_cache()
+    stage_profiles.PROFILES_FILE = os.path.join(cache_store.CACHE_DIR, "profiles.json")
+    try:
+        calls = []
+        _review("Non-Fiction", calls, fresh_cache=False)
+        calls.clear()
+        _review("Non-Fiction", calls, fresh_cache=False)
+        assert calls == ["editor"]
+
+        # Another Analyst profile or the metadata shortcut turned off: not the stored analysis
+        with open(stage_profiles.PROFILES_FILE, "w", encoding="utf-8") as f:
+            json.dump({"analyst": {"temperature": 0.1}}, f)
+        calls.clear()
+        _review("Non-Fiction", calls, fresh_cache=False)
+        assert "librarian" in calls and "analyst-non-fiction" in calls
+        calls.clear()
+        _review("Non-Fiction", calls, fresh_cache=False, use_local_metadata=False)
+        assert "librarian" in calls and "analyst-non-fiction" in calls
+    finally:
+        cache_store.CACHE_DIR, stage_profiles.PROFILES_FILE = old_dir, old_file
+        cache_store.clear_memory_cache()
+    print("[PASS] Stored analyses keyed by stage profiles and the metadata flag")
+
+if __name__ == "__main__":
+    test_speculative_analyst_runs_with_the_librarian()
+    test_wrong_speculation_is_discarded()
+    test_other_languages_rerun_only_the_editor()
+    test_languages_share_one_analysis()
+    test_fallback_classification_is_not_stored_and_reanalysis_reruns()
+    test_failed_language_keeps_the_finished_reviews()
+    test_discarded_speculation_is_cancelled_and_fallback_uses_local_guess()
+    test_stored_analysis_follows_profiles_and_metadata_flag()
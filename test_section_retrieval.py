@@ -0,0 +1,87 @@
+import time
+import concurrent.futures
+import section_retrieval
+from document_loader import StructuredDocument
+from section_retrieval import select_sections, focus_document, get_section_index
+from text_normalizer import estimate_tokens
+
+TOPICS = {
+    1: "Thói quen nguyên tử là những thay đổi nhỏ mang lại kết quả lớn theo thời gian.",
+    2: "Hệ thống quan trọng hơn mục tiêu. Người chiến thắng và kẻ thua cuộc có cùng mục tiêu.",
+    3: "Bản sắc cá nhân quyết định thói quen. Hãy tập trung vào con người bạn muốn trở thành.",
+    4: "Môi trường thiết kế hành vi. Sắp xếp không gian sống để thói quen tốt trở nên rõ ràng.",
+    5: "Quy tắc hai phút giúp bắt đầu thói quen mới mà không cần nhiều động lực.",
+}
+
+def _book(extra=()):
+    parts = []
+    for i, body in TOPICS.items():
+        parts.append((f"Chương {i}: Phần nội dung", 1, f"Chương {i}: Phần nội dung\n" + (body + " ") * 40, None))
+        parts.append((f"{i}.1 Ví dụ", 2, f"{i}.1 Ví dụ\n" + "Một ví dụ minh họa cụ thể cho ý tưởng trên. " * 20, None))
+    return StructuredDocument.from_parts(parts + list(extra))
+
+def test_chapter_reference_selects_chapter_and_subsections():
+    doc = _book()
+    selection = select_sections(doc, "Chỉ tập trung vào chương 3 thôi")
+    assert selection is not None
+    assert [doc.titles[i] for i in selection.indices] == ["Chương 3: Phần nội dung", "3.1 Ví dụ"]
+    print("[PASS] Chapter 3 + subsection selected")
+
+def test_chapter_reference_needs_focus_cue_and_matching_kind():
+    doc = _book([("Phần 3. Phụ lục", 1, "Phần 3. Phụ lục\n" + "Bảng tra cứu. " * 20, None)])
+    assert select_sections(doc, "Viết giọng văn giống ví dụ ở chương 3, trình bày đầy đủ cả cuốn sách") is None
+    selection = select_sections(doc, "Only chapter 3, please")
+    assert [doc.titles[i] for i in selection.indices] == ["Chương 3: Phần nội dung", "3.1 Ví dụ"]
+    print("[PASS] Chapter mention without a focus cue keeps the whole book")
+
+def test_topic_query_uses_bm25():
+    doc = _book()
+    selection = select_sections(doc, "Tập trung vào môi trường và không gian sống")
+    assert selection is not None and selection.reason == "BM25 topic match"
+    assert doc.titles[selection.indices[0]].startswith("Chương 4")
+
+    focused = focus_document(doc, "Tập trung vào môi trường và không gian sống")
+    assert "DÀN Ý" in focused and "- Chương 1: Phần nội dung" in focused
+    assert estimate_tokens(focused) < estimate_tokens(doc.text) / 2
+    print(f"[PASS] Focused prompt: {estimate_tokens(doc.text)} -> {estimate_tokens(focused)} tokens")
+
+def test_non_focus_instructions_keep_full_document():
+    doc = _book()
+    assert select_sections(doc, "Viết ngắn gọn, giọng văn trang trọng") is None
+    assert select_sections(doc, "") is None
+    print("[PASS] Generic instructions keep the whole document")
+
+def test_index_is_cached_and_fast():
+    parts = [(f"Chương {i}", 1, f"Chương {i}\n" + f"từ{i % 97} nội dung chung về thói quen và hệ thống " * 60, None) for i in range(1000)]
+    doc = StructuredDocument.from_parts(parts)
+    start = time.perf_counter()
+    index = get_section_index(doc)
+    build = time.perf_counter() - start
+    assert get_section_index(doc) is index
+    start = time.perf_counter()
+    scores = index.score("từ42")
+    query = time.perf_counter() - start
+    assert scores.argmax() % 97 == 42
+    assert build < 5 and query < 0.1
+    print(f"[PASS] 1000-section index built in {build:.2f}s, query {query * 1000:.1f} ms")
+
+def test_index_cache_is_safe_across_threads():
+    docs = [_book([(f"Phụ lục {n}", 1, f"Phụ lục {n}\n" + "Bảng tra cứu. " * 5, None)]) for n in range(6)]
+    old_size = section_retrieval.INDEX_CACHE_SIZE
+    section_retrieval.INDEX_CACHE_SIZE = 2  # constant eviction while other threads look up
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+            indexes = list(pool.map(lambda n: get_section_index(docs[n % len(docs)]), range(300)))
+    finally:
+        section_retrieval.INDEX_CACHE_SIZE = old_size
+    assert all(index.n_sections == len(docs[0]) for index in indexes)
+    assert len(section_retrieval._index_cache) <= 2
+    print("[PASS] Index cache lookups and evictions from 8 threads")
+
+if __name__ == "__main__":
+    test_chapter_reference_selects_chapter_and_subsections()
+    test_chapter_reference_needs_focus_cue_and_matching_kind()
+    test_topic_query_uses_bm25()
+    test_non_focus_instructions_keep_full_document()
+    test_index_is_cached_and_fast()
+    test_index_cache_is_safe_across_threads()
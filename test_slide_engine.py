@@ -0,0 +1,219 @@
+import io
+import zipfile
+from lxml import etree
+from pptx import Presentation
+from pptx.oxml.ns import qn
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.oxml.shapes.picture import CT_Picture
+from pptx.parts.image import Image, ImagePart
+from PIL import Image as PILImage
+import slide_engine
+from slide_engine import (
+    create_pptx, get_prepared_template, clear_template_cache, split_overflowing_slides, rendered_slide_numbers,
+    body_text_box_pt, title_height_pt, clean_slide_title, markdown_runs, READABLE_FONT_SIZE,
+)
+from text_metrics import text_block_height
+
+DECK = {
+    "title": "Thói quen nguyên tử",
+    "slides": [
+        {"title": "Slide 1: Hệ thống", "content": ["Hệ thống quan trọng hơn **mục tiêu**.", "Thay đổi nhỏ, kết quả lớn."], "notes": "Ghi chú"},
+        {"title": "Môi trường", "content": ["Thiết kế môi trường cho thói quen tốt."]},
+    ],
+}
+
+def _template_with_slides(count=3) -> bytes:
+    prs = Presentation()
+    for i in range(count):
+        slide = prs.slides.add_slide(prs.slide_layouts[1])
+        slide.shapes.title.text = f"Slide mẫu {i}"
+    buffer = io.BytesIO()
+    prs.save(buffer)
+    return buffer.getvalue()
+
+def test_template_is_prepared_once_and_copied_per_deck():
+    clear_template_cache()
+    template = _template_with_slides()
+    calls = []
+    original = slide_engine._prepare_template
+    slide_engine._prepare_template = lambda data: calls.append(1) or original(data)
+    try:
+        first = Presentation(create_pptx(DECK, template))
+        second = Presentation(create_pptx(DECK, template))
+    finally:
+        slide_engine._prepare_template = original
+
+    assert len(calls) == 1, "Template should be parsed and cleared only once"
+    prepared = get_prepared_template(template)
+    assert prepared.content_layout_index in prepared.placeholder_geometry
+    # A copy from the cache produces the same slides as a freshly parsed template
+    clear_template_cache()
+    fresh = Presentation(create_pptx(DECK, template))
+    for cached_slide, fresh_slide in zip(second.slides, fresh.slides):
+        assert etree.tostring(cached_slide._element) == etree.tostring(fresh_slide._element)
+    # Template slides are dropped, each deck has title + 2 content slides
+    assert len(first.slides) == len(second.slides) == 3
+    assert first.slides[1].shapes.title.text == "Hệ thống"
+    print("[PASS] Template prepared once, fresh deck per call")
+
+def test_default_template_is_cached():
+    clear_template_cache()
+    assert get_prepared_template(None) is get_prepared_template(None)
+    assert len(Presentation(create_pptx(DECK)).slides) == 3
+    print("[PASS] Default template cached")
+
+def test_layout_plan_reads_template_defaults():
+    clear_template_cache()
+    plan = get_prepared_template(None).content_plan
+    assert (plan.title_idx, plan.body_idx) == (0, 1)
+    # Default template: 44pt titles / 32pt body are capped to the engine limits
+    assert (plan.title_font_pt, plan.body_font_pt) == (36, 24)
+
+    prs = Presentation()
+    title_style = prs.slide_masters[0]._element.find(qn('p:txStyles')).find(qn('p:titleStyle'))
+    title_style.find(qn('a:lvl1pPr')).find(qn('a:defRPr')).set('sz', '2800')
+    buffer = io.BytesIO()
+    prs.save(buffer)
+    plan = get_prepared_template(buffer.getvalue()).content_plan
+    assert plan.title_font_pt == 28
+    deck = Presentation(create_pptx(DECK, buffer.getvalue()))
+    assert deck.slides[1].shapes.title.text_frame.paragraphs[0].font.size.pt == 28
+    print("[PASS] Layout plan uses the master title size")
+
+def _body_size_pt(shape) -> float:
+    lvl1 = shape._element.txBody.find(qn('a:lstStyle')).find(qn('a:lvl1pPr'))
+    return int(lvl1.find(qn('a:defRPr')).get('sz')) / 100
+
+def test_body_formatting_is_inherited_from_list_style():
+    assert markdown_runs("a **b** c **d****e******") == [(False, "a "), (True, "b"), (False, " c "), (True, "de")]
+    prs = Presentation(create_pptx(DECK))
+    body = prs.slides[1].placeholders[1]
+    assert _body_size_pt(body) == 24
+    runs = [r for p in body.text_frame.paragraphs for r in p.runs]
+    assert [r.text for r in runs] == ["Hệ thống quan trọng hơn ", "mục tiêu", ".", "Thay đổi nhỏ, kết quả lớn."]
+    # Runs only carry the emphasis; size and spacing are never repeated per run/paragraph
+    assert all(r.font.size is None for r in runs) and runs[1].font.bold
+    assert body._element.txBody.findall('.//' + qn('a:pPr')) == []
+    print("[PASS] Body size/spacing set once on the list style")
+
+def test_overflowing_slide_is_split_on_bullets():
+    bullets = [f"Ý {i}: thói quen nhỏ mỗi ngày cộng dồn thành **kết quả lớn** theo thời gian dài." for i in range(20)]
+    deck = {"title": "T", "slides": [{"title": "Slide 3: Hệ thống", "content": bullets, "notes": "Ghi chú"}]}
+    plan = get_prepared_template(None).content_plan
+
+    parts = split_overflowing_slides(deck["slides"], plan)
+    assert len(parts) > 1
+    assert [b for part in parts for b in part["content"]] == bullets, "Bullets keep their order"
+    assert parts[0]["title"] == "Slide 3: Hệ thống" and parts[0]["notes"] == "Ghi chú"
+    assert all(p["title"] == "Hệ thống (tiếp)" and "notes" not in p for p in parts[1:])
+    for part in parts:
+        width, height = body_text_box_pt(plan, title_height_pt(clean_slide_title(part["title"]), plan))
+        assert text_block_height(tuple(part["content"]), width, READABLE_FONT_SIZE) <= height
+
+    prs = Presentation(create_pptx(deck))
+    assert len(prs.slides) == 1 + len(parts)
+    assert min(_body_size_pt(s.placeholders[1]) for s in list(prs.slides)[1:]) >= READABLE_FONT_SIZE
+    assert len(Presentation(create_pptx(deck, auto_split=False)).slides) == 2
+
+    # Rendered slides map back to the JSON slide the regenerate range counts
+    two = dict(deck, slides=deck["slides"] + [{"title": "Ngắn", "content": ["Một ý"]}])
+    numbers = rendered_slide_numbers(two)
+    assert numbers == [0] + [1] * len(parts) + [2] and len(numbers) == len(Presentation(create_pptx(two)).slides)
+    print(f"[PASS] 20 bullets split into {len(parts)} slides")
+
+def test_fast_writer_matches_python_pptx():
+    from pptx_fast_writer import get_slide_xml_template
+    deck = {"title": "T", "slides": DECK["slides"] + [
+        {"title": "Slide 3: <Ký tự> & \"đặc biệt\"", "content": ["**Đậm** đầu", "giữa **đậm** cuối", "a < b & c"]},
+        # Not expressible by the splicer: rendered through python-pptx inside the fast path
+        {"title": "", "content": ["Không tiêu đề"]},
+        {"title": "Tab\tvà xuống dòng", "content": ["Dòng 1\nDòng 2", ""]},
+    ]}
+    for template in (None, _template_with_slides()):
+        prepared = get_prepared_template(template)
+        assert get_slide_xml_template(prepared.content_slide_xml, prepared.content_plan).enabled
+        normal = zipfile.ZipFile(create_pptx(deck, template, fast_writer=False))
+        fast = zipfile.ZipFile(create_pptx(deck, template, fast_writer=True))
+        assert normal.namelist() == fast.namelist()
+        for name in normal.namelist():
+            assert normal.read(name) == fast.read(name), name
+
+    # Untested python-pptx version: the streaming path steps aside for add_slide
+    import pptx_fast_writer
+    tested, pptx_fast_writer.TESTED_PPTX_VERSIONS = pptx_fast_writer.TESTED_PPTX_VERSIONS, ()
+    try:
+        assert not pptx_fast_writer.streaming_supported()
+        fallback = zipfile.ZipFile(create_pptx(deck, fast_writer=True))
+    finally:
+        pptx_fast_writer.TESTED_PPTX_VERSIONS = tested
+    normal = zipfile.ZipFile(create_pptx(deck, fast_writer=False))
+    assert all(normal.read(name) == fallback.read(name) for name in normal.namelist())
+    print("[PASS] Fast writer output is part-for-part identical")
+
+def _template_with_logo() -> bytes:
+    """Default template with the same logo stored as a separate media part in three layouts."""
+    prs = Presentation()
+    logo = io.BytesIO()
+    PILImage.new("RGB", (64, 64), (0, 112, 192)).save(logo, format="PNG")
+    for index in (0, 1, 6):
+        layout_part = prs.slide_layouts[index].part
+        image_part = ImagePart.new(prs.part.package, Image.from_blob(logo.getvalue()))
+        rId = layout_part.relate_to(image_part, RT.IMAGE)
+        pic = CT_Picture.new_pic(100, "Logo", "", rId, 0, 0, 457200, 457200)
+        layout_part._element.cSld.spTree.append(pic)
+    buffer = io.BytesIO()
+    prs.save(buffer)
+    return buffer.getvalue()
+
+def test_slim_drops_unused_layouts_and_duplicate_media():
+    template = _template_with_logo()
+    slim_bytes = create_pptx(DECK, template, slim=True).getvalue()
+    full_bytes = create_pptx(DECK, template).getvalue()  # opt-in: the default keeps every layout
+    assert len(Presentation(io.BytesIO(full_bytes)).slide_layouts) == 11
+    full = zipfile.ZipFile(io.BytesIO(full_bytes))
+    slim = zipfile.ZipFile(io.BytesIO(slim_bytes))
+    media = lambda z: [n for n in z.namelist() if n.startswith("ppt/media/")]
+    assert len(media(full)) == 3 and len(media(slim)) == 1
+    assert sum(i.file_size for i in slim.infolist()) < sum(i.file_size for i in full.infolist())
+
+    prs = Presentation(io.BytesIO(slim_bytes))
+    assert [layout.name for layout in prs.slide_layouts] == ["Title Slide", "Title and Content"]
+    # Both remaining layouts still show the logo, through the shared part
+    logos = [shape.image.sha1 for layout in prs.slide_layouts for shape in layout.shapes if shape.shape_type == MSO_SHAPE_TYPE.PICTURE]
+    assert len(logos) == 2 and len(set(logos)) == 1
+    assert prs.slides[1].shapes.title.text == "Hệ thống"
+    print("[PASS] Unused layouts and duplicate media removed")
+
+def test_generated_decks_keep_geometry_invariants():
+    from bench_slide_engine import make_deck, make_template, check_geometry, CASES
+    for case in CASES:
+        for template in (None, make_template()):
+            report = check_geometry(create_pptx(make_deck(30, case=case), template).getvalue())
+            assert report["slides_checked"] >= 30 and report["violations"] == [], (case, report)
+    print("[PASS] No overlap, every box inside the slide")
+
+def test_speaker_notes_are_written():
+    deck = {"title": "T", "slides": [
+        {"title": "Có ghi chú", "content": ["Ý"], "notes": "Nói về hệ thống & mục tiêu"},
+        {"title": "Không ghi chú", "content": ["Ý"]},
+        {"title": "Ghi chú dài", "content": ["Ý"], "notes": "Dòng 1\nDòng 2"},
+    ]}
+    for fast_writer in (False, True):
+        prs = Presentation(create_pptx(deck, fast_writer=fast_writer))
+        slides = list(prs.slides)[1:]
+        assert [s.has_notes_slide for s in slides] == [True, False, True], fast_writer
+        assert slides[0].notes_slide.notes_text_frame.text == "Nói về hệ thống & mục tiêu"
+        assert slides[2].notes_slide.notes_text_frame.text == "Dòng 1\nDòng 2"
+    print("[PASS] Speaker notes written by both writers")
+
+if __name__ == "__main__":
+    test_template_is_prepared_once_and_copied_per_deck()
+    test_default_template_is_cached()
+    test_layout_plan_reads_template_defaults()
+    test_body_formatting_is_inherited_from_list_style()
+    test_overflowing_slide_is_split_on_bullets()
+    test_fast_writer_matches_python_pptx()
+    test_slim_drops_unused_layouts_and_duplicate_media()
+    test_generated_decks_keep_geometry_invariants()
+    test_speaker_notes_are_written()
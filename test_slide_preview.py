@@ -0,0 +1,77 @@
+import io
+import time
+from PIL import Image
+from pptx import Presentation
+import slide_preview
+from slide_preview import render_thumbnails, clear_thumbnail_cache, THUMBNAIL_WIDTH, OVERFLOW_COLOR
+from slide_engine import create_pptx
+
+DECK = {
+    "title": "Thói quen nguyên tử",
+    "slides": [
+        {"title": f"Slide {i + 1}: Hệ thống {i}", "content": [
+            "Hệ thống quan trọng hơn **mục tiêu**.",
+            f"Thay đổi nhỏ mỗi ngày, kết quả lớn sau {i + 1} năm.",
+        ]}
+        for i in range(40)
+    ],
+}
+
+def test_one_thumbnail_per_slide_of_the_deck():
+    clear_thumbnail_cache()
+    bullets = [f"Ý {i}: thói quen nhỏ mỗi ngày cộng dồn thành kết quả lớn theo thời gian dài." for i in range(20)]
+    deck = {"title": "T", "slides": DECK["slides"][:2] + [{"title": "Dài", "content": bullets}]}
+    thumbnails = render_thumbnails(deck, use_processes=False)
+    # Same slides as the .pptx, including "(tiếp)" continuation slides
+    assert len(thumbnails) == len(Presentation(create_pptx(deck)).slides) > 4
+    image = Image.open(io.BytesIO(thumbnails[1]))
+    assert image.format == "PNG" and image.width == THUMBNAIL_WIDTH
+    assert abs(image.width / image.height - 4 / 3) < 0.01  # Default template is 4:3
+    print(f"[PASS] {len(thumbnails)} thumbnails")
+
+def test_overflow_is_highlighted():
+    clear_thumbnail_cache()
+    bullets = [f"Ý {i}: thói quen nhỏ mỗi ngày cộng dồn thành kết quả lớn theo thời gian dài." for i in range(30)]
+    deck = {"title": "T", "slides": [{"title": "Quá dài", "content": bullets}, DECK["slides"][0]]}
+    _, overflowing, normal = render_thumbnails(deck, auto_split=False, use_processes=False)
+    has_red = lambda png: any(c == OVERFLOW_COLOR for _, c in Image.open(io.BytesIO(png)).convert("RGB").getcolors(1 << 16))
+    assert has_red(overflowing) and not has_red(normal)
+    print("[PASS] Overflowing body drawn in red")
+
+def test_thumbnails_are_cached_per_slide():
+    clear_thumbnail_cache()
+    rendered = []
+    original = slide_preview._render_batch
+    slide_preview._render_batch = lambda jobs: rendered.append(len(jobs)) or original(jobs)
+    try:
+        first = render_thumbnails(DECK, use_processes=False)
+        edited = {"title": DECK["title"], "slides": [dict(DECK["slides"][0], title="Đã sửa")] + DECK["slides"][1:]}
+        second = render_thumbnails(edited, use_processes=False)
+    finally:
+        slide_preview._render_batch = original
+    assert rendered == [41, 1], "Only the edited slide is drawn again"
+    assert first[2:] == second[2:] and first[1] != second[1]
+    print("[PASS] Unchanged slides come from the cache")
+
+def test_worker_processes_match_in_process_rendering():
+    clear_thumbnail_cache()
+    inline = render_thumbnails(DECK, use_processes=False)
+    clear_thumbnail_cache()
+    slide_preview.warm_up()
+    try:
+        render_thumbnails({"title": "warm", "slides": DECK["slides"][:1]})
+        clear_thumbnail_cache()
+        start = time.perf_counter()
+        pooled = render_thumbnails(DECK)
+        elapsed = time.perf_counter() - start
+    finally:
+        slide_preview.shutdown()
+    assert pooled == inline
+    assert elapsed < 2, f"40-slide preview took {elapsed:.2f}s"
+    print(f"[PASS] 40 slides previewed in {elapsed:.2f}s by worker processes")
+
+if __name__ == "__main__":
+    test_one_thumbnail_per_slide_of_the_deck()
+    test_overflow_is_highlighted()
+    test_thumbnails_are_cached_per_slide()
+    test_worker_processes_match_in_process_rendering()
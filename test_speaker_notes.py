@@ -0,0 +1,55 @@
+import json
+import tempfile
+import threading
+import cache_store
+from deck_store import save_deck, load_deck, find_deck, deck_options
+from speaker_notes import fill_speaker_notes, slides_missing_notes, NOTES_BATCH_SLIDES
+
+def test_notes_are_filled_in_batches_as_a_revision():
+    calls = []
+    lock = threading.Lock()
+
+    def fake_generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        slides = json.loads(parts[0].text.split(" slide sau:\n", 1)[1])
+        with lock:
+            calls.append(len(slides))
+        notes = [f"Ghi chú cho {s['title']}" for s in slides]
+        if slides[0]["title"] == "S22":
+            notes = notes[:2]  # short answer: the rest of the batch stays without notes
+        if slides[0]["title"] == "S12":
+            raise ValueError("quota")  # failed batch: the other batches are still saved
+        return json.dumps({"notes": notes}), "notes-model"
+
+    old_dir = cache_store.CACHE_DIR
+    cache_store.CACHE_DIR = tempfile.mkdtemp()
+    cache_store.clear_memory_cache()
+    try:
+        slides = [{"title": f"S{i}", "content": ["Ý"]} for i in range(1, 26)]
+        slides[0]["notes"] = "Đã có"
+        deck = {"title": "Thói quen", "slides": slides}
+        key = save_deck(deck, "doc", deck_options("Chi tiết"), "deck-model")
+
+        record = fill_speaker_notes(key, api_keys=["k1", "k2"], generate_fn=fake_generate)
+        notes = [s.get("notes") for s in record["deck"]["slides"]]
+        assert sorted(calls) == sorted([NOTES_BATCH_SLIDES, NOTES_BATCH_SLIDES, 24 - 2 * NOTES_BATCH_SLIDES])
+        assert notes[0] == "Đã có" and notes[1] == "Ghi chú cho S2" and notes[10] == "Ghi chú cho S11"
+        assert notes[11:21] == [None] * NOTES_BATCH_SLIDES
+        assert notes[21:23] == ["Ghi chú cho S22", "Ghi chú cho S23"] and notes[23:] == [None, None]
+        assert record["parent"] == key and record["model"] == "deck-model"
+        assert find_deck("doc", deck_options("Chi tiết"))["key"] == record["key"]
+        assert slides_missing_notes(load_deck(key)["deck"]) == list(range(1, 25))  # original untouched
+
+        def failing(api_keys, parts, config, model_list=None, cancel_check=None):
+            raise ValueError("quota")
+        try:
+            fill_speaker_notes(key, api_keys=["k1"], generate_fn=failing)
+            assert False, "every batch failed: the error should surface"
+        except ValueError:
+            pass
+    finally:
+        cache_store.CACHE_DIR = old_dir
+        cache_store.clear_memory_cache()
+    print(f"[PASS] Notes for 24 slides in {len(calls)} batches, saved as a revision")
+
+if __name__ == "__main__":
+    test_notes_are_filled_in_batches_as_a_revision()
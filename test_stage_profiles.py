@@ -0,0 +1,51 @@
+import os
+import json
+import tempfile
+import stage_profiles
+from stage_profiles import DEFAULT_PROFILES, parse_profiles, get_profile, stage_config
+
+def test_shipped_file_holds_only_overrides():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "stage_profiles.json"), encoding="utf-8") as f:
+        raw = json.load(f)
+    parse_profiles(raw)
+    # Defaults live in DEFAULT_PROFILES only: a field repeating its default would hide later changes to it
+    for stage, fields in raw.items():
+        default = DEFAULT_PROFILES.get(stage)
+        for field, value in fields.items():
+            assert default is None or getattr(default, field) != value, f"{stage}.{field} repeats the default"
+    print("[PASS] stage_profiles.json holds overrides only")
+
+def test_profiles_reload_when_file_changes():
+    path = os.path.join(tempfile.mkdtemp(), "profiles.json")
+    old_file = stage_profiles.PROFILES_FILE
+    stage_profiles.PROFILES_FILE = path
+    try:
+        # No file: defaults
+        assert get_profile("editor") == DEFAULT_PROFILES["editor"]
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"editor": {"models": ["gemini-2.5-flash"], "thinking_budget": 0, "max_output_tokens": 4096}}, f)
+        config, models = stage_config("editor", response_mime_type="text/plain")
+        assert models == ["gemini-2.5-flash"]
+        assert config.temperature == DEFAULT_PROFILES["editor"].temperature
+        assert config.max_output_tokens == 4096 and config.thinking_config.thinking_budget == 0
+        assert config.response_mime_type == "text/plain"
+
+        # A broken edit keeps the last good profiles
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"editor": {"temperature": "hot"}}, f)
+        os.utime(path, ns=(1, 1))
+        assert get_profile("editor").models == ["gemini-2.5-flash"]
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"editor": {"temperature": 0.2}, "custom": {"temperature": 1}}, f)
+        os.utime(path, ns=(2, 2))
+        assert get_profile("editor") == DEFAULT_PROFILES["editor"]._replace(temperature=0.2)
+        assert get_profile("custom").temperature == 1.0
+    finally:
+        stage_profiles.PROFILES_FILE = old_file
+    print("[PASS] Profiles reloaded on change, bad edits ignored")
+
+if __name__ == "__main__":
+    test_shipped_file_holds_only_overrides()
+    test_profiles_reload_when_file_changes()
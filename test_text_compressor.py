@@ -0,0 +1,66 @@
+import time
+import random
+from document_loader import StructuredDocument
+from text_normalizer import estimate_tokens
+from text_compressor import split_sentences, textrank_scores, compress_document, compress_for_prompt
+
+def test_split_sentences_keeps_offsets():
+    text = "Câu thứ nhất. Câu thứ hai!\nDòng mới không có dấu chấm\n  Câu cuối?"
+    spans = split_sentences(text)
+    assert [text[s:e] for s, e in spans] == ["Câu thứ nhất.", "Câu thứ hai!", "Dòng mới không có dấu chấm", "Câu cuối?"]
+    print("[PASS] Sentence spans")
+
+def test_central_sentences_rank_higher():
+    sentences = [
+        "Thói quen nhỏ tạo ra kết quả lớn theo thời gian.",
+        "Kết quả lớn đến từ thói quen nhỏ lặp lại mỗi ngày.",
+        "Mỗi ngày một thói quen nhỏ cộng dồn thành kết quả lớn.",
+        "Con mèo ngủ trên mái nhà.",
+    ]
+    scores = textrank_scores(sentences)
+    assert abs(scores.sum() - 1.0) < 1e-6
+    assert scores.argmin() == 3
+    print("[PASS] Off-topic sentence ranked last")
+
+def _book(chars=1_000_000, seed=7):
+    rng = random.Random(seed)
+    vocab = [f"từ{i}" for i in range(3000)] + ["thói", "quen", "hệ", "thống", "mục", "tiêu"] * 50
+    parts, total, chapter = [], 0, 0
+    while total < chars:
+        chapter += 1
+        body = [f"Chương {chapter}"]
+        for _ in range(60):
+            body.append(" ".join(rng.choice(vocab) for _ in range(rng.randint(8, 25))).capitalize() + ".")
+        text = "\n".join(body)
+        parts.append((f"Chương {chapter}", 1, text, None))
+        total += len(text)
+    return StructuredDocument.from_parts(parts)
+
+def test_compression_fits_budget_and_keeps_order():
+    doc = _book(chars=200_000)
+    compressed, stats = compress_document(doc, token_budget=10_000)
+    assert estimate_tokens(compressed.text) <= 10_000
+    assert stats["sentences_kept"] < stats["sentences_total"]
+    # Every chapter heading survives, in order
+    assert [t for t in compressed.titles if t] == [t for t in doc.titles if t]
+    # Kept sentences appear in original order
+    positions = [doc.text.find(line) for line in compressed.section_text(1).split("\n")[1:] if line]
+    assert positions == sorted(positions) and -1 not in positions
+    # Under budget: untouched
+    assert compress_for_prompt(doc, None) is doc and compress_for_prompt(doc, 10**9) is doc
+    print(f"[PASS] {stats['tokens_before']} -> {stats['tokens_after']} tokens")
+
+def test_one_million_chars_is_fast():
+    doc = _book()
+    start = time.perf_counter()
+    compressed, stats = compress_document(doc, token_budget=50_000)
+    elapsed = time.perf_counter() - start
+    assert estimate_tokens(compressed.text) <= 50_000
+    assert elapsed < 4, f"TextRank on 1M chars took {elapsed:.2f}s"
+    print(f"[PASS] {len(doc.text)} chars compressed in {elapsed:.2f}s ({stats['sentences_total']} sentences)")
+
+if __name__ == "__main__":
+    test_split_sentences_keeps_offsets()
+    test_central_sentences_rank_higher()
+    test_compression_fits_budget_and_keeps_order()
+    test_one_million_chars_is_fast()
@@ -0,0 +1,59 @@
+import time
+import text_metrics
+from text_metrics import get_font_metrics, count_lines, fit_font_size, text_block_height, split_words, line_starts
+
+BULLET = "Thói quen nguyên tử là những thay đổi nhỏ mang lại **kết quả lớn** theo thời gian."
+
+def test_fallback_metrics_cover_vietnamese():
+    metrics = get_font_metrics(None)
+    # Vietnamese letters are measured like their base letter
+    assert metrics.width("ạ", 10) == metrics.width("a", 10)
+    assert metrics.width("đ", 10) == metrics.width("d", 10)
+    assert metrics.width("WWW", 10) > metrics.width("iii", 10)
+    assert get_font_metrics(None, True).width("Hello", 10) > metrics.width("Hello", 10)
+    print("[PASS] Fallback metrics")
+
+def test_line_breaking():
+    assert count_lines("", 100, 12) == 1
+    one_line = count_lines(BULLET, 10_000, 24)
+    narrow = count_lines(BULLET, 200, 24)
+    assert one_line == 1 and narrow > 2
+    # Bigger font, more lines; a single huge word still wraps
+    assert count_lines(BULLET, 200, 32) >= narrow
+    assert count_lines("x" * 200, 100, 24) > 1
+    print(f"[PASS] {narrow} lines at 200pt width")
+
+def test_line_starts_follow_count_lines():
+    assert split_words("Một **câu đậm**, hết") == [("Một", False), ("câu", True), ("đậm,", True), ("hết", False)]
+    for width in (150, 200, 400, 10_000):
+        starts = line_starts(BULLET, width, 24)
+        assert len(starts) == count_lines(BULLET, width, 24) and starts[0] == 0
+        assert starts == sorted(set(starts)) and starts[-1] < len(split_words(BULLET))
+    print("[PASS] Line starts match count_lines")
+
+def test_fit_font_size_is_largest_fitting():
+    paragraphs = (BULLET,) * 6
+    size, fits = fit_font_size(paragraphs, 600, 300, 24, 10)
+    assert fits and 10 <= size < 24
+    assert text_block_height(paragraphs, 600, size) <= 300
+    assert text_block_height(paragraphs, 600, size + 0.5) > 300
+    assert fit_font_size((BULLET,), 600, 300, 24, 10) == (24, True)
+    assert fit_font_size((BULLET,) * 100, 600, 300, 24, 10) == (10, False)
+    print(f"[PASS] Best size {size}pt")
+
+def test_deck_layout_is_fast():
+    fit_font_size.cache_clear()
+    text_metrics.count_lines.cache_clear()
+    start = time.perf_counter()
+    for i in range(200):
+        fit_font_size(tuple(f"{BULLET} Ý {i}.{j}" for j in range(5)), 600, 300, 24, 10)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 1.0
+    print(f"[PASS] 200 slides laid out in {elapsed * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    test_fallback_metrics_cover_vietnamese()
+    test_line_breaking()
+    test_line_starts_follow_count_lines()
+    test_fit_font_size_is_largest_fitting()
+    test_deck_layout_is_fast()
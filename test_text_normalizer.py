@@ -0,0 +1,93 @@
+from text_normalizer import normalize_text, normalize_lines, estimate_tokens
+
+def _sample_book():
+    pages = []
+    for i in range(1, 8):
+        pages.append("\n".join([
+            "ATOMIC HABITS - James Clear",
+            f"Chương {i}",
+            f"Đây là nội dung thực sự của chương {i}, nói về thói quen nhỏ tạo nên khác biệt lớn.",
+            "Mỗi ngày tiến bộ 1% sẽ tạo ra kết quả gấp 37 lần sau một năm.",
+            f"{i * 10}",
+        ]))
+    toc = "\n".join([
+        "Mục lục",
+        "Chương 1 ........ 3",
+        "Chương 2 ........ 15",
+        "Chương 3 ........ 27",
+    ])
+    return toc + "\n\n" + "\n\n\n\n".join(pages)
+
+def test_strips_boilerplate_and_page_numbers():
+    text = _sample_book()
+    normalized, stats = normalize_text(text)
+
+    assert "ATOMIC HABITS - James Clear" not in normalized, "Running header should be removed"
+    assert "Mục lục" not in normalized, "TOC should be removed"
+    assert "\n70\n" not in normalized and not normalized.endswith("70"), "Page number should be removed"
+    # Real content and chapter headings must survive
+    for i in range(1, 8):
+        assert f"Chương {i}" in normalized
+        assert f"nội dung thực sự của chương {i}" in normalized
+    assert "\n\n\n" not in normalized
+
+    assert stats["boilerplate"] == 7
+    assert stats["page_numbers"] == 7
+    assert stats["toc_lines"] == 4
+    assert stats["tokens_saved"] > 0
+    assert stats["tokens_after"] == estimate_tokens(normalized)
+    print(f"[PASS] Saved {stats['tokens_saved']} tokens ({stats['percent_saved']}%)")
+
+def test_dedupes_repeated_front_matter():
+    front = "Bản quyền thuộc về nhà xuất bản. " * 10
+    text = "\n\n".join([front, "Chương 1 nội dung.", front, "Chương 2 nội dung.", front])
+    normalized, stats = normalize_text(text)
+
+    assert normalized.count("Bản quyền thuộc về nhà xuất bản.") == 10
+    assert stats["duplicate_blocks"] == 2
+    print("[PASS] Duplicate front matter removed")
+
+def test_keeps_plain_text_intact():
+    text = "Một đoạn văn bình thường.\nKhông có gì để cắt bỏ."
+    normalized, stats = normalize_text(text)
+    assert normalized == text
+    assert stats["tokens_saved"] == 0
+    print("[PASS] Plain text untouched")
+
+def test_keeps_numbered_headings_and_body_lines():
+    lines = []
+    for i in range(1, 6):
+        lines += [f"Bước {i}", f"Step {i}: chọn một thói quen", f"Ghi lại kết quả của ngày {i}", f"    - mục lồng nhau số {i}"]
+    lines += ["Mục lục", "Phần kết thúc ở chương I", "Cuộc chiến civil", "Kết luận 2"]
+    normalized, counters = normalize_lines(lines)
+    assert normalized[:4] == lines[:4], "Numbered headings and digit-varying lines are not running headers"
+    assert counters["boilerplate"] == 0 and counters["toc_lines"] == 0
+    # Indentation survives; a plain space before a trailing token is not a TOC entry
+    assert normalized[3] == "    - mục lồng nhau số 1" and normalized[-3:] == lines[-3:]
+
+    # Running headers carrying the page number are removed at page boundaries only
+    pages = "\f".join(f"Atomic Habits {i}\nTrang {i} có nội dung thật.\n" for i in range(1, 6))
+    text, stats = normalize_text(pages)
+    assert "Atomic Habits" not in text and stats["boilerplate"] == 5
+    print("[PASS] Numbered headings, indentation and body lines kept")
+
+def test_keeps_lone_years_and_chapter_numbers():
+    normalized, stats = normalize_text("Năm xuất bản\n1945\nDân số tăng\n2,500\nTrang 12\nKết thúc")
+    assert normalized == "Năm xuất bản\n1945\nDân số tăng\n2,500\nKết thúc" and stats["page_numbers"] == 1
+
+    # DOCX chapters numbered on their own line: no page breaks, no running headers
+    chapters = "\n".join(f"{i}\nNội dung chương {i} bàn về một thói quen." for i in range(1, 5))
+    normalized, stats = normalize_text(chapters)
+    assert normalized == chapters and stats["page_numbers"] == 0
+
+    # Bare numbers next to a form feed are page numbers
+    normalized, stats = normalize_text("Trang đầu có nội dung.\n1\n\fTrang hai có nội dung.\n2\n\fTrang ba.")
+    assert "\n1\n" not in normalized and stats["page_numbers"] == 2
+    print("[PASS] Lone years and chapter numbers kept, page-boundary numbers dropped")
+
+if __name__ == "__main__":
+    test_strips_boilerplate_and_page_numbers()
+    test_dedupes_repeated_front_matter()
+    test_keeps_plain_text_intact()
+    test_keeps_numbered_headings_and_body_lines()
+    test_keeps_lone_years_and_chapter_numbers()
@@ -0,0 +1,120 @@
+import io
+import json
+import tempfile
+import cache_store
+import ai_engine
+import summarizer
+from bench_wire_format import make_summary, make_deep_dive
+from bench_slide_engine import make_deck
+from wire_format import (expand_deck, expand_summary, expand_deep_dive, compact_deck, compact_summary,
+                         compact_deep_dive)
+
+def _deck(count):
+    deck = make_deck(count)
+    for slide in deck["slides"]:
+        slide["notes"] = slide["notes"].strip()
+    return deck
+
+def test_expanders_round_trip_and_accept_verbose():
+    deck = _deck(5)
+    deck["slides"][1].pop("notes")
+    assert expand_deck(compact_deck(deck)) == deck
+    assert expand_deck(deck) == deck
+    # Bare list, string bullets and unusable entries
+    assert expand_deck([["A", "Một ý"], [], "x"]) == {"title": "Slide Generated by AI",
+                                                       "slides": [{"title": "A", "content": ["Một ý"]}]}
+
+    summary = make_summary()
+    assert expand_summary(compact_summary(summary)) == summary
+    assert expand_summary(summary) == summary
+
+    full = make_deep_dive()
+    assert expand_deep_dive(compact_deep_dive(full), about_creator=full["about_creator"]) == full
+    skeleton = make_deep_dive(detail_key="brief")
+    assert expand_deep_dive(compact_deep_dive(skeleton, "brief"), "brief", skeleton["about_creator"]) == skeleton
+    print("[PASS] Compact shapes expand to the verbose ones")
+
+def test_analyze_document_compact_wire():
+    from docx import Document
+    buffer = io.BytesIO()
+    document = Document()
+    document.add_paragraph("Thói quen nhỏ tạo ra kết quả lớn. " * 20)
+    document.save(buffer)
+
+    deck = _deck(3)
+    seen = []
+    def fake_generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        seen.append(config.system_instruction)
+        return json.dumps(compact_deck(deck), ensure_ascii=False), "model"
+
+    old_dir, original = cache_store.CACHE_DIR, ai_engine.generate_content_v2
+    cache_store.CACHE_DIR = tempfile.mkdtemp()
+    cache_store.clear_memory_cache()
+    ai_engine.generate_content_v2 = fake_generate
+    try:
+        result = ai_engine.analyze_document(buffer.getvalue(), "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                                            api_key="k", compact_wire=True)
+    finally:
+        ai_engine.generate_content_v2 = original
+        cache_store.CACHE_DIR = old_dir
+        cache_store.clear_memory_cache()
+    assert "ĐỊNH DẠNG TRẢ VỀ RÚT GỌN" in seen[0]
+    assert result == deck
+    print("[PASS] analyze_document expands the compact deck")
+
+def test_staged_deep_dive_compact_wire():
+    skeleton = make_deep_dive(ideas=3, detail_key="brief")
+    configs = []
+    def fake_generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        prompt = parts[-1].text
+        configs.append(config.response_mime_type)
+        if "lập KHUNG" in prompt:
+            return json.dumps(compact_deep_dive(skeleton, "brief"), ensure_ascii=False), "skeleton-model"
+        assert "văn bản thuần" in prompt
+        return "Phân tích dạng văn bản thuần.", "commentary-model"
+
+    original = summarizer.generate_content_v2
+    summarizer.generate_content_v2 = fake_generate
+    try:
+        result = summarizer.summarize_book_deep_dive(b"Noi dung sach. " * 50, "text/plain", api_keys=["k1", "k2"],
+                                                     map_reduce=False, compact_wire=True)
+    finally:
+        summarizer.generate_content_v2 = original
+    assert result["metadata"] == skeleton["metadata"]
+    assert result["about_creator"] == summarizer.ABOUT_CREATOR
+    assert [i["commentary"] for i in result["core_ideas"]] == ["Phân tích dạng văn bản thuần."] * 3
+    assert configs.count("text/plain") == 3
+    print("[PASS] Staged Deep Dive in compact mode")
+
+def test_json_mode_keeps_the_model_answer_and_logs_sdk_tokens():
+    skeleton = make_deep_dive(ideas=2, detail_key="brief")
+    skeleton.pop("about_creator")
+    def fake_generate(api_keys, parts, config, model_list=None, cancel_check=None):
+        if "lập KHUNG" in parts[-1].text:
+            return json.dumps(skeleton, ensure_ascii=False), "skeleton-model"
+        return json.dumps({"commentary": "Phân tích"}), "commentary-model"
+
+    original = summarizer.generate_content_v2
+    summarizer.generate_content_v2 = fake_generate
+    try:
+        result = summarizer.summarize_book_deep_dive(b"Noi dung sach. " * 50, "text/plain", api_keys=["k1"],
+                                                     map_reduce=False)
+    finally:
+        summarizer.generate_content_v2 = original
+    assert result["about_creator"] == "", "JSON mode should not fill in the compact-mode fields"
+
+    class Response:
+        text = '{"t": "x"}'
+        usage_metadata = type("Usage", (), {"candidates_token_count": 7})()
+    client = type("Client", (), {})()
+    client.models = type("Models", (), {"generate_content": lambda self, **kwargs: Response()})()
+    ai_engine._last_usage.output_tokens = None
+    ai_engine.generate_with_retry_v2(client, [], None, model_list=["m"])
+    assert ai_engine.last_output_tokens() == 7
+    print("[PASS] JSON mode untouched, output tokens taken from usage_metadata")
+
+if __name__ == "__main__":
+    test_expanders_round_trip_and_accept_verbose()
+    test_analyze_document_compact_wire()
+    test_staged_deep_dive_compact_wire()
+    test_json_mode_keeps_the_model_answer_and_logs_sdk_tokens()
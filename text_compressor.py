@@ -0,0 +1,166 @@
+import re
+import time
+import numpy as np
+from utils import safe_print
+from document_loader import StructuredDocument
+from text_normalizer import estimate_tokens
+from section_retrieval import tokenize
+
+# Extractive pre-compression: rank sentences with TextRank and keep the best ones
+# (in original order) until a token budget is met. Used for huge books where a
+# high-signal digest beats sending the full text.
+
+TEXTRANK_DAMPING = 0.85
+TEXTRANK_MAX_ITER = 50
+TEXTRANK_TOL = 1e-6
+
+SENTENCE_RE = re.compile(r'[^.!?…\n]+(?:[.!?…]+["”»)]*|$)', re.MULTILINE)
+
+
+def split_sentences(text: str) -> list[tuple[int, int]]:
+    """Returns (start, end) spans of sentences; line breaks always end a sentence."""
+    spans = []
+    for match in SENTENCE_RE.finditer(text):
+        start, end = match.span()
+        # Trim surrounding whitespace without losing offsets
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            spans.append((start, end))
+    return spans
+
+
+def _tfidf_rows(sentences: list[str]):
+    """
+    Sparse L2-normalized TF-IDF matrix in COO form: (rows, cols, values, n_terms).
+    """
+    tokens = [tokenize(s) for s in sentences]
+    lengths = np.fromiter((len(t) for t in tokens), dtype=np.int64, count=len(tokens))
+    flat = [tok for toks in tokens for tok in toks]
+    if not flat:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float64), 0
+
+    terms, term_ids = np.unique(np.array(flat, dtype=object).astype(str), return_inverse=True)
+    n_terms = len(terms)
+    rows = np.repeat(np.arange(len(sentences), dtype=np.int64), lengths)
+    pair_keys, tf = np.unique(rows * n_terms + term_ids.astype(np.int64), return_counts=True)
+    rows = pair_keys // n_terms
+    cols = pair_keys % n_terms
+
+    df = np.bincount(cols, minlength=n_terms)
+    idf = np.log((1.0 + len(sentences)) / (1.0 + df)) + 1.0
+    values = (1.0 + np.log(tf)) * idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=len(sentences)))
+    values = values / np.where(norms[rows] > 0, norms[rows], 1.0)
+    return rows, cols, values, n_terms
+
+
+def textrank_scores(sentences: list[str]) -> np.ndarray:
+    """
+    TextRank over the cosine-similarity graph W = X·Xᵀ - I.
+    W is never materialized: each power iteration is two sparse mat-vecs
+    (X·(Xᵀ·v)) done with bincount, so cost is O(nnz) per iteration.
+    """
+    n = len(sentences)
+    if n == 0:
+        return np.zeros(0)
+    rows, cols, values, n_terms = _tfidf_rows(sentences)
+    if n_terms == 0:
+        return np.full(n, 1.0 / n)
+
+    def xt_dot(v):   # Xᵀ·v  (n_terms)
+        return np.bincount(cols, weights=values * v[rows], minlength=n_terms)
+
+    def x_dot(u):    # X·u   (n)
+        return np.bincount(rows, weights=values * u[cols], minlength=n)
+
+    self_sim = np.bincount(rows, weights=values * values, minlength=n)  # 1 for non-empty rows
+    out_weight = x_dot(xt_dot(np.ones(n))) - self_sim                    # row sums of W
+    safe_out = np.where(out_weight > 1e-12, out_weight, 1.0)
+    dangling = out_weight <= 1e-12
+
+    rank = np.full(n, 1.0 / n)
+    for _ in range(TEXTRANK_MAX_ITER):
+        v = np.where(dangling, 0.0, rank / safe_out)
+        spread = x_dot(xt_dot(v)) - self_sim * v
+        # Isolated sentences redistribute their rank uniformly
+        new_rank = (1.0 - TEXTRANK_DAMPING) / n + TEXTRANK_DAMPING * (spread + rank[dangling].sum() / n)
+        if np.abs(new_rank - rank).sum() < TEXTRANK_TOL:
+            rank = new_rank
+            break
+        rank = new_rank
+    return rank
+
+
+def _select_within_budget(costs: np.ndarray, scores: np.ndarray, budget_tokens: int, forced: np.ndarray) -> np.ndarray:
+    """Greedy pick by score (forced items first) until the budget is spent. Returns a bool mask."""
+    keep = forced.copy()
+    spent = int(costs[forced].sum())
+    for i in np.argsort(-scores, kind="stable"):
+        if keep[i]:
+            continue
+        if spent + costs[i] > budget_tokens:
+            continue
+        keep[i] = True
+        spent += int(costs[i])
+    return keep
+
+
+def compress_document(doc: StructuredDocument, token_budget: int) -> tuple[StructuredDocument, dict]:
+    """
+    Keeps the top TextRank sentences of the whole document, in original order,
+    within token_budget. Section headings are always kept so the outline survives.
+    Returns: (compressed_document, stats).
+    """
+    tokens_before = estimate_tokens(doc.text)
+    if tokens_before <= token_budget:
+        return doc, {"tokens_before": tokens_before, "tokens_after": tokens_before, "sentences_kept": None, "seconds": 0.0}
+
+    start_time = time.perf_counter()
+    spans = split_sentences(doc.text)
+    sentences = [doc.text[s:e] for s, e in spans]
+    scores = textrank_scores(sentences)
+    # +1 char for the joining space/newline
+    costs = np.fromiter(((e - s + 1 + 3) // 4 for s, e in spans), dtype=np.int64, count=len(spans))
+
+    heading_starts = {doc.starts[i] for i in range(len(doc)) if doc.titles[i]}
+    forced = np.fromiter((s in heading_starts for s, _ in spans), dtype=bool, count=len(spans))
+    keep = _select_within_budget(costs, scores, token_budget, forced)
+
+    # Rebuild sections from kept sentences; a newline in the source between two kept
+    # sentences is preserved as a paragraph break.
+    section_of = np.searchsorted(np.frombuffer(doc.starts, dtype=np.int64), [s for s, _ in spans], side="right") - 1
+    texts = [[] for _ in range(len(doc))]
+    last_end = {}
+    for idx in np.flatnonzero(keep):
+        s, e = spans[idx]
+        sec = int(section_of[idx])
+        if texts[sec]:
+            texts[sec].append("\n" if "\n" in doc.text[last_end[sec]:s] else " ")
+        texts[sec].append(doc.text[s:e])
+        last_end[sec] = e
+
+    parts = [(doc.titles[i], doc.levels[i], "".join(texts[i]), doc.section(i).page) for i in range(len(doc)) if texts[i]]
+    compressed = StructuredDocument.from_parts(parts, separator="\n\n", mime_type=doc.mime_type)
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": estimate_tokens(compressed.text),
+        "sentences_kept": int(keep.sum()),
+        "sentences_total": len(spans),
+        "seconds": round(time.perf_counter() - start_time, 3),
+    }
+    return compressed, stats
+
+
+def compress_for_prompt(doc: StructuredDocument, token_budget: int | None, source: str = "document") -> StructuredDocument:
+    """Applies compress_document when the document exceeds the pipeline's budget, and logs it."""
+    if not token_budget or estimate_tokens(doc.text) <= token_budget:
+        return doc
+    compressed, stats = compress_document(doc, token_budget)
+    safe_print(
+        f"🗜️ TextRank compressed {source}: {stats['tokens_before']} -> {stats['tokens_after']} tokens "
+        f"(budget {token_budget}, kept {stats['sentences_kept']}/{stats['sentences_total']} sentences, {stats['seconds']}s)"
+    )
+    return compressed
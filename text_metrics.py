@@ -0,0 +1,267 @@
+import os
+import re
+import unicodedata
+from functools import lru_cache
+import numpy as np
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFontFile
+from utils import safe_print
+
+# Text measurement with real font metrics.
+# Each font is turned once into a NumPy table of glyph advances (em units) indexed by
+# code point; strings are measured with vectorized lookups and greedy line breaking.
+# Fonts come from the system font folders (the template's theme fonts), falling back
+# to the Helvetica metrics bundled with reportlab (metrically identical to Arial).
+
+# Code points covered by the tables: Latin, Latin Extended (incl. Vietnamese 1E00-1EFF),
+# general punctuation. Anything beyond uses the font's default advance.
+TABLE_SIZE = 0x2100
+
+FONT_DIRS = [
+    os.path.join(os.environ.get("WINDIR", "C:\\Windows"), "Fonts"),
+    os.path.join(os.environ.get("LOCALAPPDATA", ""), "Microsoft", "Windows", "Fonts"),
+    "/usr/share/fonts",
+    "/usr/local/share/fonts",
+    os.path.expanduser("~/.fonts"),
+    os.path.expanduser("~/.local/share/fonts"),
+    "/Library/Fonts",
+    "/System/Library/Fonts",
+    os.path.expanduser("~/Library/Fonts"),
+]
+
+# Font file stems that do not follow the family name
+FONT_FILE_ALIASES = {
+    "times new roman": ("times", "timesbd"),
+    "calibri light": ("calibril", "calibrib"),
+    "segoe ui": ("segoeui", "segoeuib"),
+    "arial": ("arial", "arialbd"),
+    "tahoma": ("tahoma", "tahomabd"),
+    "verdana": ("verdana", "verdanab"),
+}
+
+FALLBACK_FONTS = ("Helvetica", "Helvetica-Bold")
+
+BOLD_SPLIT_RE = re.compile(r'(\*\*.*?\*\*)')
+WHITESPACE_CODES = np.array([ord(c) for c in " \t\n\r\u00a0\u2000\u2002\u2003\u2009"], dtype=np.uint32)
+WORD_RE = re.compile('[^' + ''.join(chr(c) for c in WHITESPACE_CODES) + ']+')
+
+# Line height as a multiple of the font size for single spacing (PowerPoint ~1.2)
+LINE_SPACING = 1.2
+
+
+class FontMetrics:
+    """Glyph advances of one font face, in em (1.0 = font size)."""
+
+    def __init__(self, name: str, advances: np.ndarray, default_advance: float):
+        self.name = name
+        self.advances = advances
+        self.default_advance = default_advance
+        self.space_advance = float(advances[ord(' ')])
+
+    def char_advances(self, text: str) -> np.ndarray:
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        inside = codes < TABLE_SIZE
+        return np.where(inside, self.advances[np.minimum(codes, TABLE_SIZE - 1)], self.default_advance)
+
+    def width(self, text: str, size_pt: float) -> float:
+        """Width of a single line of text in points."""
+        return float(self.char_advances(text).sum()) * size_pt
+
+
+_font_index = None
+
+def _font_file_index() -> dict:
+    """Lower-case file stem -> path for every .ttf/.otf in the font folders (scanned once)."""
+    global _font_index
+    if _font_index is None:
+        index = {}
+        for folder in FONT_DIRS:
+            if not folder or not os.path.isdir(folder):
+                continue
+            for root, _, files in os.walk(folder):
+                for filename in files:
+                    stem, ext = os.path.splitext(filename)
+                    if ext.lower() in (".ttf", ".otf"):
+                        index.setdefault(stem.lower(), os.path.join(root, filename))
+        _font_index = index
+    return _font_index
+
+
+def find_font_file(family: str, bold: bool = False) -> str | None:
+    key = family.lower().strip()
+    base = key.replace(" ", "")
+    if key in FONT_FILE_ALIASES:
+        candidates = [FONT_FILE_ALIASES[key][1 if bold else 0]]
+    elif bold:
+        candidates = [base + "bd", base + "b", base + "-bold", base + "bold"]
+    else:
+        candidates = [base, base + "-regular", base + "regular"]
+    index = _font_file_index()
+    for stem in candidates:
+        if stem in index:
+            return index[stem]
+    return None
+
+
+def _ttf_metrics(path: str) -> FontMetrics:
+    face = TTFontFile(path)
+    units = 1000.0
+    default = face.defaultWidth / units
+    advances = np.full(TABLE_SIZE, default, dtype=np.float64)
+    for code, width in face.charWidths.items():
+        if code < TABLE_SIZE:
+            advances[code] = width / units
+    return FontMetrics(os.path.basename(path), advances, default)
+
+
+def _fallback_metrics(font_name: str) -> FontMetrics:
+    """AFM widths; characters outside cp1252 are measured by their base letter (ạ -> a)."""
+    default = pdfmetrics.stringWidth("n", font_name, 1000) / 1000.0
+    advances = np.full(TABLE_SIZE, default, dtype=np.float64)
+    for code in range(32, TABLE_SIZE):
+        char = chr(code)
+        base = unicodedata.normalize('NFD', char)[0]
+        if char in "đĐ":
+            base = "d" if char == "đ" else "D"
+        try:
+            base.encode('cp1252')
+        except UnicodeEncodeError:
+            continue
+        advances[code] = pdfmetrics.stringWidth(base, font_name, 1000) / 1000.0
+    return FontMetrics(font_name, advances, default)
+
+
+@lru_cache(maxsize=32)
+def get_font_metrics(family: str | None = None, bold: bool = False) -> FontMetrics:
+    """Metrics for a font family (template theme font), or the bundled fallback."""
+    path = find_font_file(family, bold) if family else None
+    if path:
+        try:
+            return _ttf_metrics(path)
+        except Exception as e:
+            safe_print(f"⚠️ Could not read font metrics from {path}: {e}")
+    return _fallback_metrics(FALLBACK_FONTS[1 if bold else 0])
+
+
+def _word_widths(text: str, regular: FontMetrics, bold: FontMetrics) -> np.ndarray:
+    """Width of every whitespace-separated word in em; **bold** segments use the bold face."""
+    plain_parts, bold_flags = [], []
+    for part in BOLD_SPLIT_RE.split(text):
+        if not part:
+            continue
+        is_bold = part.startswith('**') and part.endswith('**') and len(part) >= 4
+        plain_parts.append(part[2:-2] if is_bold else part)
+        bold_flags.append(is_bold)
+    plain = "".join(plain_parts)
+    if not plain.strip():
+        return np.zeros(0)
+    mask = np.repeat(np.array(bold_flags), [len(p) for p in plain_parts])
+    advances = np.where(mask, bold.char_advances(plain), regular.char_advances(plain))
+    codes = np.frombuffer(plain.encode('utf-32-le'), dtype=np.uint32)
+    is_space = np.isin(codes, WHITESPACE_CODES)
+    word_ids = np.cumsum(is_space)[~is_space]
+    widths = np.bincount(word_ids, weights=advances[~is_space])
+    # Runs of whitespace leave empty word slots
+    return widths[np.bincount(word_ids) > 0]
+
+
+@lru_cache(maxsize=65536)
+def _paragraph_words(text: str, family: str | None, bold: bool) -> tuple[tuple, float]:
+    """(word widths, space width) in em; independent of the font size, so measured once."""
+    regular = get_font_metrics(family, bold)
+    return tuple(_word_widths(text, regular, get_font_metrics(family, True)).tolist()), regular.space_advance
+
+
+@lru_cache(maxsize=65536)
+def count_lines(text: str, width_pt: float, size_pt: float, family: str | None = None, bold: bool = False) -> int:
+    """
+    Number of lines text wraps to in a box width_pt wide at size_pt (greedy breaking,
+    like PowerPoint). Words longer than a line are broken across lines.
+    bold=True measures everything bold; otherwise only **marked** segments are bold.
+    """
+    words, space = _paragraph_words(text, family, bold)
+    if not words:
+        return 1
+    width = width_pt / size_pt  # box width in em
+    lines, line_width = 1, 0.0
+    for w in words:
+        if line_width and line_width + space + w <= width:
+            line_width += space + w
+            continue
+        if line_width:
+            lines += 1
+        # Over-long word: wraps by characters
+        extra = int(w // width) if w > width else 0
+        lines += extra
+        line_width = w - extra * width
+    return lines
+
+
+def split_words(text: str) -> list[tuple[str, bool]]:
+    """
+    The words count_lines measures, with **markers** removed: [(word, starts_bold), ...].
+    Word i here is word i of the width tables.
+    """
+    plain, bold_starts = [], []
+    for part in BOLD_SPLIT_RE.split(text):
+        if not part:
+            continue
+        is_bold = part.startswith('**') and part.endswith('**') and len(part) >= 4
+        plain.append(part[2:-2] if is_bold else part)
+        bold_starts.extend([is_bold] * len(plain[-1]))
+    return [(m.group(), bold_starts[m.start()]) for m in WORD_RE.finditer("".join(plain))]
+
+
+def word_widths(text: str, family: str | None = None, bold: bool = False) -> tuple[tuple, float]:
+    """(width of every word of split_words(text), width of a space), in em."""
+    return _paragraph_words(text, family, bold)
+
+
+def line_starts(text: str, width_pt: float, size_pt: float, family: str | None = None, bold: bool = False) -> list[int]:
+    """
+    Index (into split_words) of the first word of every line, with the greedy breaking
+    of count_lines. A word longer than a line gets a line of its own (and overflows it).
+    """
+    words, space = _paragraph_words(text, family, bold)
+    width = width_pt / size_pt
+    starts, line_width = [], 0.0
+    for i, w in enumerate(words):
+        if line_width and line_width + space + w <= width:
+            line_width += space + w
+            continue
+        starts.append(i)
+        line_width = w
+    return starts or [0]
+
+
+def paragraph_spacing(size_pt: float) -> float:
+    """space_before/space_after used by the slide engine (smaller text, less spacing)."""
+    return max(3, size_pt * 0.3)
+
+
+def text_block_height(paragraphs: tuple, width_pt: float, size_pt: float, family: str | None = None) -> float:
+    """Height in points of bullet paragraphs laid out at size_pt."""
+    lines = sum(count_lines(p, width_pt, size_pt, family) for p in paragraphs)
+    return lines * size_pt * LINE_SPACING + len(paragraphs) * 2 * paragraph_spacing(size_pt)
+
+
+@lru_cache(maxsize=4096)
+def fit_font_size(paragraphs: tuple, width_pt: float, height_pt: float, max_size: float, min_size: float,
+                  family: str | None = None, step: float = 0.5) -> tuple[float, bool]:
+    """
+    Largest size (multiple of step, within [min_size, max_size]) at which the paragraphs
+    fit the box. Binary search: height grows monotonically with the size.
+    Returns: (size_pt, fits). fits is False when even min_size overflows.
+    """
+    low, high = int(round(min_size / step)), int(round(max_size / step))
+    if text_block_height(paragraphs, width_pt, high * step, family) <= height_pt:
+        return high * step, True
+    if text_block_height(paragraphs, width_pt, low * step, family) > height_pt:
+        return low * step, False
+    while high - low > 1:
+        mid = (low + high) // 2
+        if text_block_height(paragraphs, width_pt, mid * step, family) <= height_pt:
+            low = mid
+        else:
+            high = mid
+    return low * step, True
@@ -0,0 +1,343 @@
+import re
+import math
+import hashlib
+from collections import Counter
+from utils import safe_print
+from document_loader import StructuredDocument
+
+# Normalization stage that sits between document_loader and the prompt builders.
+# Goal: strip text that costs input tokens but carries no meaning for the model
+# (running headers/footers, page numbers, TOC/index pages, duplicated front matter,
+# whitespace runs).
+
+# A short line must repeat at least this many times to be treated as a running header/footer
+BOILERPLATE_MIN_REPEATS = 3
+# Lines longer than this are real content, never boilerplate
+BOILERPLATE_MAX_LINE_CHARS = 80
+# Long paragraphs repeated verbatim (e.g. front matter copied into every EPUB item)
+DUPLICATE_BLOCK_MIN_CHARS = 200
+# Rough chars-per-token ratio used for reporting (Gemini averages ~4 chars/token)
+CHARS_PER_TOKEN = 4
+
+PAGE_NUMBER_RE = re.compile(
+    r'^\s*[-–—]?\s*(?:page|trang|p\.)?\s*\d{1,4}\s*(?:(?:/|of|trên)\s*\d{1,4})?\s*[-–—]?\s*$',
+    re.IGNORECASE
+)
+# A number alone on its line is also a year, a chapter number or a table value: it only counts as
+# a page number on a page boundary or in an increasing run with one that does
+BARE_NUMBER_RE = re.compile(r'^\s*\d{1,4}\s*$')
+# Largest step between consecutive page numbers of one run (unnumbered pages in between)
+PAGE_SEQUENCE_MAX_STEP = 10
+TOC_HEADING_RE = re.compile(
+    r'^\s*(?:mục\s*lục|table\s+of\s+contents|contents|index|chỉ\s*mục|danh\s*mục|bảng\s+tra\s+cứu)\s*:?\s*$',
+    re.IGNORECASE
+)
+# "Chapter 1 ......... 12", "Lời nói đầu\tix" (leader or tab before the page), index "Habit, 34, 56".
+# A plain space is not enough: body lines end in " I" or " civil" too.
+TOC_ENTRY_RE = re.compile(
+    r'^.{1,120}?(?:(?:\.{3,}|…+|\t)\s*[\divxlc]{1,5}|,\s*\d{1,4})(?:\s*[,–-]\s*\d{1,4})*\s*$', re.IGNORECASE
+)
+TOC_LEADER_RE = re.compile(r'(?:\.{3,}|…)\s*\d{1,4}\s*$')
+# Headings repeat ("Chương 3", "Bước 2", "Tóm tắt") but are structure, not boilerplate
+HEADING_RE = re.compile(
+    r'^\s*(?:(?:chapter|chương|phần|part|section|mục|bài|bước|step|lesson|ngày|day|quy tắc|rule|nguyên tắc)\s+[\w\d]+'
+    r'|\d+(?:\.\d+)*[.)]?\s+\w)',
+    re.IGNORECASE
+)
+SENTENCE_END_RE = re.compile(r'[.!?:;"”»]\s*$')
+INLINE_SPACE_RE = re.compile(r'[ \t\u00a0\u2000-\u200b]+')
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for reporting savings (no tokenizer call)."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _line_key(line: str, shape: bool = False) -> str:
+    """
+    Key used for frequency hashing: case/space insensitive.
+    shape=True also masks digits ("Atomic Habits 12" == "Atomic Habits 13"); those keys are
+    only collected and applied at page boundaries, where running headers carry page numbers.
+    """
+    key = INLINE_SPACE_RE.sub(' ', line.strip().lower())
+    if shape:
+        key = "#shape:" + re.sub(r'\d+', '#', key)
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def _neighbours(lines: list[str]) -> dict[int, tuple[int | None, int | None]]:
+    """Index of each non-blank line -> (previous, next) non-blank line index."""
+    non_blank = [i for i, line in enumerate(lines) if line.strip()]
+    return {i: (non_blank[pos - 1] if pos else None, non_blank[pos + 1] if pos + 1 < len(non_blank) else None)
+            for pos, i in enumerate(non_blank)}
+
+
+def _page_number_lines(lines: list[str], boilerplate_keys: set[str] | None = None) -> set[int]:
+    """
+    Indices of page-number lines. Labelled ones ("Trang 12", "- 12 -", "3 / 10") always count.
+    A bare number counts when it sits on a page boundary (a form feed on it or on its nearest
+    non-blank neighbour, or a neighbour that is a running header/footer), or when it belongs to an
+    increasing run of bare numbers (steps up to PAGE_SEQUENCE_MAX_STEP) holding one that does.
+    """
+    def is_break(i):
+        if i is None:
+            return False
+        stripped = lines[i].strip()
+        return "\f" in lines[i] or bool(boilerplate_keys) and (
+            _line_key(stripped) in boilerplate_keys or _line_key(stripped, shape=True) in boilerplate_keys)
+
+    neighbours = _neighbours(lines)
+    found, bare, confirmed = set(), [], set()
+    for i in neighbours:
+        if not PAGE_NUMBER_RE.match(lines[i].strip()):
+            continue
+        if not BARE_NUMBER_RE.match(lines[i]):
+            found.add(i)
+            continue
+        bare.append(i)
+        if "\f" in lines[i] or any(is_break(n) for n in neighbours[i]):
+            confirmed.add(i)
+
+    runs = []
+    for i in bare:
+        value = int(lines[i])
+        run = next((r for r in runs if 1 <= value - int(lines[r[-1]]) <= PAGE_SEQUENCE_MAX_STEP), None)
+        if run is None:
+            runs.append([i])
+        else:
+            run.append(i)
+    for run in runs:
+        if confirmed.intersection(run):
+            found.update(run)
+    return found
+
+
+def _page_boundaries(lines: list[str], page_numbers: set[int]) -> list[bool]:
+    """
+    True for lines next to a page break: the first/last line, a line holding a form feed,
+    or one whose nearest non-blank neighbour is a page number or holds a form feed.
+    """
+    def is_break(i):
+        return i is None or "\f" in lines[i] or i in page_numbers
+
+    flags = [False] * len(lines)
+    for i, (before, after) in _neighbours(lines).items():
+        flags[i] = "\f" in lines[i] or is_break(before) or is_break(after)
+    return flags
+
+
+def _boilerplate_candidate(stripped: str) -> bool:
+    # Lines ending like a sentence are kept (dialogue, repeated slogans in body text)
+    return (bool(stripped) and len(stripped) <= BOILERPLATE_MAX_LINE_CHARS
+            and not SENTENCE_END_RE.search(stripped) and not HEADING_RE.match(stripped))
+
+
+def find_boilerplate_keys(lines: list[str]) -> set[str]:
+    """
+    Returns the hashes of short lines that repeat often enough to be running headers/footers:
+    the same line (digits included) anywhere, or the same shape (digits masked) at page boundaries.
+    Headings never count, so numbered steps ("Bước 1" ... "Bước 5") stay.
+    """
+    counts = Counter()
+    for line, boundary in zip(lines, _page_boundaries(lines, _page_number_lines(lines))):
+        stripped = line.strip()
+        if not _boilerplate_candidate(stripped):
+            continue
+        counts[_line_key(stripped)] += 1
+        if boundary:
+            counts[_line_key(stripped, shape=True)] += 1
+    return {k for k, c in counts.items() if c >= BOILERPLATE_MIN_REPEATS}
+
+
+def _is_boilerplate(stripped: str, boundary: bool, boilerplate_keys: set[str]) -> bool:
+    if not _boilerplate_candidate(stripped):
+        return False
+    return _line_key(stripped) in boilerplate_keys or (boundary and _line_key(stripped, shape=True) in boilerplate_keys)
+
+
+def _is_toc_entry(line: str) -> bool:
+    stripped = line.strip()
+    if not stripped or len(stripped) > 120:
+        return False
+    return bool(TOC_LEADER_RE.search(stripped) or TOC_ENTRY_RE.match(stripped))
+
+
+def _toc_title(entry: str) -> str:
+    """Strips dot leaders and the trailing page number from a TOC entry."""
+    return re.sub(r'(?:\.{3,}|…+)?\s*\d{1,4}\s*$', '', entry).strip() if TOC_LEADER_RE.search(entry) else entry
+
+
+def _drop_toc_sections(lines: list[str]) -> tuple[list[str], int]:
+    """
+    Drops TOC/index sections: a TOC heading followed by entry-like lines,
+    or any run of 5+ lines with dot leaders / trailing page numbers.
+    """
+    kept = []
+    dropped = 0
+    i = 0
+    n = len(lines)
+    while i < n:
+        line = lines[i]
+        if TOC_HEADING_RE.match(line):
+            j = i + 1
+            toc_titles = set()
+            while j < n and (not lines[j].strip() or _is_toc_entry(lines[j])):
+                entry = lines[j].strip().lower()
+                # The TOC ends where the first listed chapter actually begins
+                if entry and entry in toc_titles:
+                    break
+                if entry:
+                    toc_titles.add(_toc_title(entry))
+                j += 1
+            # Only treat it as a TOC if at least a couple of entries followed the heading
+            entries = sum(1 for l in lines[i + 1:j] if l.strip())
+            if entries >= 2:
+                dropped += entries + 1
+                i = j
+                continue
+        if TOC_LEADER_RE.search(line.strip()):
+            j = i
+            while j < n and (not lines[j].strip() or TOC_LEADER_RE.search(lines[j].strip())):
+                j += 1
+            entries = sum(1 for l in lines[i:j] if l.strip())
+            if entries >= 5:
+                dropped += entries
+                i = j
+                continue
+        kept.append(line)
+        i += 1
+    return kept, dropped
+
+
+def normalize_lines(lines: list[str], boilerplate_keys: set[str] | None = None, seen_blocks: set[str] | None = None) -> tuple[list[str], dict]:
+    """
+    Core normalization over a list of lines.
+    boilerplate_keys / seen_blocks can be shared across calls (e.g. the whole book)
+    when normalizing one section at a time.
+    """
+    if boilerplate_keys is None:
+        boilerplate_keys = find_boilerplate_keys(lines)
+    if seen_blocks is None:
+        seen_blocks = set()
+
+    counters = {"page_numbers": 0, "boilerplate": 0, "toc_lines": 0, "duplicate_blocks": 0}
+
+    # 1. Page numbers + running headers/footers
+    cleaned = []
+    page_numbers = _page_number_lines(lines, boilerplate_keys)
+    for i, (line, boundary) in enumerate(zip(lines, _page_boundaries(lines, page_numbers))):
+        stripped = line.strip()
+        if i in page_numbers:
+            counters["page_numbers"] += 1
+            continue
+        if _is_boilerplate(stripped, boundary, boilerplate_keys):
+            counters["boilerplate"] += 1
+            continue
+        cleaned.append(line)
+
+    # 2. TOC / Index pages
+    cleaned, counters["toc_lines"] = _drop_toc_sections(cleaned)
+
+    # 3. Duplicate long blocks + whitespace collapse (leading indentation is kept: code, verse, nested lists)
+    result = []
+    for line in cleaned:
+        body = INLINE_SPACE_RE.sub(' ', line.strip())
+        line = line[:len(line) - len(line.lstrip())].replace("\f", "") + body if body else ""
+        if len(body) >= DUPLICATE_BLOCK_MIN_CHARS:
+            block_hash = hashlib.md5(body.encode('utf-8')).hexdigest()
+            if block_hash in seen_blocks:
+                counters["duplicate_blocks"] += 1
+                continue
+            seen_blocks.add(block_hash)
+        result.append(line)
+
+    return result, counters
+
+
+def _build_stats(before: str, after: str, counters: dict) -> dict:
+    tokens_before = estimate_tokens(before)
+    tokens_after = estimate_tokens(after)
+    saved = tokens_before - tokens_after
+    return {
+        "chars_before": len(before),
+        "chars_after": len(after),
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": saved,
+        "percent_saved": round(100.0 * saved / tokens_before, 1) if tokens_before else 0.0,
+        **counters,
+    }
+
+
+def normalize_text(text: str) -> tuple[str, dict]:
+    """
+    Normalizes extracted document text before prompting.
+    Returns: (normalized_text, stats) where stats reports tokens saved.
+    """
+    if not text:
+        return text, _build_stats("", "", {})
+
+    lines = text.split('\n')
+    result, counters = normalize_lines(lines)
+    normalized = BLANK_LINES_RE.sub('\n\n', '\n'.join(result)).strip('\n')
+    return normalized, _build_stats(text, normalized, counters)
+
+
+def normalize_document(doc: StructuredDocument) -> tuple[StructuredDocument, dict]:
+    """
+    Normalizes a StructuredDocument section by section.
+    Boilerplate and duplicate blocks are detected across the whole book, sections titled
+    like a TOC/index are dropped, and sections left empty are removed.
+    Returns: (normalized_document, stats).
+    """
+    boilerplate_keys = find_boilerplate_keys(doc.text.split('\n'))
+    # Section headings are structure even when they repeat ("Tóm tắt chương")
+    boilerplate_keys -= {_line_key(t, shape) for t in doc.titles if t for shape in (False, True)}
+    seen_blocks = set()
+
+    counters = {"page_numbers": 0, "boilerplate": 0, "toc_lines": 0, "duplicate_blocks": 0}
+    parts = []
+    for section in doc.sections():
+        section_lines = doc.section_text(section.index).split('\n')
+        if section.title and TOC_HEADING_RE.match(section.title):
+            counters["toc_lines"] += sum(1 for l in section_lines if l.strip())
+            continue
+
+        lines, section_counters = normalize_lines(section_lines, boilerplate_keys, seen_blocks)
+        for k, v in section_counters.items():
+            counters[k] += v
+
+        text = BLANK_LINES_RE.sub('\n\n', '\n'.join(lines)).strip('\n')
+        if text:
+            parts.append((section.title, section.level, text, section.page))
+
+    normalized = StructuredDocument.from_parts(parts, separator="\n\n", mime_type=doc.mime_type)
+    return normalized, _build_stats(doc.text, normalized.text, counters)
+
+
+def _log_stats(source: str, stats: dict):
+    safe_print(
+        f"🧹 Normalized {source}: {stats['tokens_before']} -> {stats['tokens_after']} tokens "
+        f"(saved ~{stats['tokens_saved']}, {stats['percent_saved']}%) | "
+        f"page_numbers={stats.get('page_numbers', 0)}, boilerplate={stats.get('boilerplate', 0)}, "
+        f"toc_lines={stats.get('toc_lines', 0)}, duplicate_blocks={stats.get('duplicate_blocks', 0)}"
+    )
+
+
+def normalize_for_prompt(text: str, source: str = "document") -> str:
+    """
+    Convenience wrapper used by the prompt builders: normalizes and logs the savings.
+    """
+    normalized, stats = normalize_text(text)
+    _log_stats(source, stats)
+    return normalized
+
+
+def normalize_document_for_prompt(doc: StructuredDocument, source: str = "document") -> StructuredDocument:
+    """Structured variant of normalize_for_prompt (keeps section offsets valid)."""
+    normalized, stats = normalize_document(doc)
+    _log_stats(f"{source} ({len(normalized)} sections)", stats)
+    return normalized
@@ -5,7 +5,8 @@ import os
 from pptx import Presentation
 from pptx.util import Cm
 
-REPORT_FILE = "C:\\Users\\admin\\.gemini\\antigravity\\brain\\ee52ee0a-e324-48d7-a8d0-e2a8fdd58bab\\test_results.md"
+# Markdown report location; override with SLIDEGENIUS_QUALITY_REPORT
+REPORT_FILE = os.environ.get("SLIDEGENIUS_QUALITY_REPORT", "quality_report.md")
 
 def run_quality_check():
     # 1. Define Test Cases
@@ -0,0 +1,162 @@
+from utils import safe_print
+
+# Compact wire format for Gemini responses.
+# Output tokens drive most of the latency, and the verbose schemas repeat "title", "content",
+# "notes", "commentary"... on every element. In compact mode the model answers with one-letter
+# keys and positional arrays; the expanders below rebuild today's dict shapes before
+# create_pptx / save_summary_to_pdf. They also accept the verbose shapes unchanged, so a model
+# that ignores the compact schema still produces a valid result.
+# Per-call output size (tokens as reported by the SDK) and latency are logged per mode
+# (log_wire_stats) to compare the modes; bench_wire_format.py measures the size difference on
+# sample outputs with the SDK's token counter. The chars/4 estimate is not used here: it is far
+# off for Vietnamese text and for one-letter keys, which is exactly what is being compared.
+
+WIRE_JSON = "json"
+WIRE_COMPACT = "compact"
+
+# Appended to the slide system instruction (analyze_document, outline sections)
+COMPACT_SLIDES_INSTRUCTION = """
+ĐỊNH DẠNG TRẢ VỀ RÚT GỌN (THAY CHO JSON Schema ở trên, để câu trả lời ngắn hơn):
+{"t": "TÊN BÀI THUYẾT TRÌNH (VIẾT HOA)", "s": [["Tiêu Đề Ngắn", ["Ý 1", "Ý 2", "Ý 3"], "Ghi chú chi tiết..."], ["Tiêu Đề Ngắn (Phần 2)", ["Ý tiếp theo..."]]]}
+- Mỗi slide là một mảng: [tiêu đề, mảng các ý, ghi chú]. Bỏ phần tử ghi chú nếu không viết ghi chú.
+- KHÔNG dùng các khóa "title", "slides", "content", "notes". Mọi yêu cầu khác về nội dung giữ nguyên.
+"""
+
+# Appended to the standard summary system instruction
+COMPACT_SUMMARY_INSTRUCTION = """
+ĐỊNH DẠNG TRẢ VỀ RÚT GỌN (THAY CHO cấu trúc JSON ở trên):
+{"t": "Tiêu đề tài liệu", "o": "Tóm tắt tổng quan", "k": ["Điểm chính 1: ...", "Điểm chính 2: ..."], "c": "Kết luận"}
+"""
+
+# Appended to the Deep Dive prompts: the third element of each core idea is the commentary
+# (single shot) or the brief (staged skeleton). "about_creator" is a fixed text filled in locally.
+COMPACT_DEEP_DIVE_INSTRUCTION = """
+ĐỊNH DẠNG TRẢ VỀ RÚT GỌN (THAY CHO cấu trúc JSON ở trên, để câu trả lời ngắn hơn):
+{{"m": ["Tên sách", "Slogan", "Tên tác giả"], "b": ["Ý tưởng lớn 1", "..."], "i": ["Đoạn giới thiệu", "Trích dẫn hay nhất"], "c": [["TÊN Ý TƯỞNG LỚN 1", "Trích dẫn", "{detail}"], "..."], "a": "Tóm tắt tiểu sử tác giả"}}
+- KHÔNG viết "about_creator" và không dùng các khóa dài ("metadata", "core_ideas", "commentary"...).
+"""
+
+# Commentary calls answer with the essay itself instead of {"commentary": "..."}
+COMPACT_COMMENTARY_FORMAT = "Chỉ trả về đoạn văn phân tích (văn bản thuần, không JSON, không tiêu đề)."
+
+SUMMARY_KEYS = {"t": "title", "o": "overview", "k": "key_points", "c": "conclusion"}
+SLIDE_KEYS = {"t": "title", "c": "content", "n": "notes"}
+
+
+def wire_mode(compact: bool) -> str:
+    return WIRE_COMPACT if compact else WIRE_JSON
+
+
+def _text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _rename(data: dict, keys: dict) -> dict:
+    """Short keys -> long keys; a long key already present wins."""
+    expanded = {long: data[short] for short, long in keys.items() if short in data and long not in data}
+    return dict({k: v for k, v in data.items() if k not in keys}, **expanded)
+
+
+def _positional(value, names: tuple) -> dict:
+    """["a", "b"] -> {names[0]: "a", names[1]: "b"}; dicts pass through."""
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, (list, tuple)):
+        return {name: _text(item) for name, item in zip(names, value)}
+    return {names[0]: _text(value)} if value else {}
+
+
+def expand_slide(item) -> dict | None:
+    """[title, [bullets], notes?] (or {"t", "c", "n"}) -> {"title", "content", "notes"?}; None if unusable."""
+    if isinstance(item, dict):
+        return _rename(item, SLIDE_KEYS)
+    if not isinstance(item, (list, tuple)) or not item:
+        return None
+    content = item[1] if len(item) > 1 else []
+    if not isinstance(content, (list, tuple)):
+        content = [content] if content else []
+    slide = {"title": _text(item[0]), "content": [str(c) for c in content]}
+    if len(item) > 2 and _text(item[2]):
+        slide["notes"] = _text(item[2])
+    return slide
+
+
+def expand_deck(data) -> dict:
+    """Compact {"t", "s"} (or a bare slide list) -> {"title", "slides"}; verbose decks are returned as-is."""
+    if isinstance(data, list):
+        data = {"slides": data}
+    if not isinstance(data, dict):
+        raise ValueError("Lỗi đọc dữ liệu từ AI: không phải cấu trúc bài thuyết trình.")
+    if "slides" not in data and "s" not in data:
+        return data
+    raw = data["slides"] if "slides" in data else data["s"]
+    slides = [s for s in (expand_slide(item) for item in raw or []) if s is not None]
+    deck = {k: v for k, v in data.items() if k not in ("t", "s")}
+    deck["title"] = _text(data.get("title", data.get("t"))) or "Slide Generated by AI"
+    deck["slides"] = slides
+    return deck
+
+
+def expand_summary(data: dict) -> dict:
+    """{"t", "o", "k", "c"} -> {"title", "overview", "key_points", "conclusion"}."""
+    return _rename(data, SUMMARY_KEYS)
+
+
+def expand_deep_dive(data: dict, detail_key: str = "commentary", about_creator: str = "") -> dict:
+    """
+    Compact Deep Dive {"m", "b", "i", "c", "a"} -> the dict shape save_summary_to_pdf reads.
+    detail_key: name of the third element of each core idea ("commentary", or "brief" for the skeleton).
+    """
+    if "metadata" in data or "core_ideas" in data:
+        data = dict(data)
+        data.setdefault("about_creator", about_creator)
+        return data
+    ideas = []
+    for idea in data.get("c") or []:
+        idea = _positional(idea, ("title", "quote", detail_key))
+        if idea:
+            ideas.append(idea)
+    return {
+        "metadata": _positional(data.get("m"), ("title", "slogan", "author")),
+        "big_ideas": [_text(b) for b in data.get("b") or []],
+        "introduction": _positional(data.get("i"), ("text", "best_quote")),
+        "core_ideas": ideas,
+        "about_author": _text(data.get("a")),
+        "about_creator": about_creator,
+    }
+
+
+def compact_deck(deck: dict) -> dict:
+    """Inverse of expand_deck (what the model sends in compact mode), for measurements and tests."""
+    slides = []
+    for slide in deck.get("slides", []):
+        item = [slide.get("title", ""), list(slide.get("content", []))]
+        if slide.get("notes"):
+            item.append(slide["notes"])
+        slides.append(item)
+    return {"t": deck.get("title", ""), "s": slides}
+
+
+def compact_summary(summary: dict) -> dict:
+    return {short: summary.get(long) for short, long in SUMMARY_KEYS.items() if long in summary}
+
+
+def compact_deep_dive(data: dict, detail_key: str = "commentary") -> dict:
+    metadata = data.get("metadata") or {}
+    introduction = data.get("introduction") or {}
+    return {
+        "m": [metadata.get("title", ""), metadata.get("slogan", ""), metadata.get("author", "")],
+        "b": list(data.get("big_ideas", [])),
+        "i": [introduction.get("text", ""), introduction.get("best_quote", "")],
+        "c": [[i.get("title", ""), i.get("quote", ""), i.get(detail_key, "")] for i in data.get("core_ideas", [])],
+        "a": data.get("about_author", ""),
+    }
+
+
+def log_wire_stats(stage: str, compact: bool, text: str, elapsed: float, output_tokens: int | None = None):
+    """
+    One log line per call so the modes can be compared from real runs.
+    output_tokens: usage_metadata.candidates_token_count of the call (ai_engine.last_output_tokens()).
+    """
+    tokens = f"{output_tokens} output tokens" if output_tokens is not None else "output tokens not reported"
+    safe_print(f"📦 Wire [{stage}] mode={wire_mode(compact)}: {len(text or '')} chars, {tokens}, {elapsed:.1f}s")